@@ -0,0 +1,222 @@
+"""
+Vectorized rotation conversions.
+
+Every function takes arrays with any number of leading dims, e.g. a 72D
+SMPL pose reshaped to N x 24 x 3, and converts all of them at once
+instead of calling cv2.Rodrigues per joint.
+
+  axis-angle  (..., 3)     rotation vector, angle = norm (cv2.Rodrigues)
+  matrix      (..., 3, 3)
+  quaternion  (..., 4)     w, x, y, z
+  euler       (..., 3)     angles in the order of the axes string, same
+                           convention as scipy's Rotation.as_euler:
+                           'xyz' extrinsic, 'XYZ' intrinsic
+
+Kept python 2 compatible for mayapy.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# Below this angle the first order expansions are used.
+EPS = 1e-8
+
+
+def _skew(v):
+    """
+    (..., 3) -> (..., 3, 3) cross product matrices.
+    """
+    x, y, z = v[..., 0], v[..., 1], v[..., 2]
+    zero = np.zeros_like(x)
+    return np.stack([zero, -z, y,
+                     z, zero, -x,
+                     -y, x, zero], axis=-1).reshape(v.shape[:-1] + (3, 3))
+
+
+def axis_angle_to_matrix(aa):
+    """
+    Rodrigues formula, same as cv2.Rodrigues(aa)[0] per vector.
+    :param aa: (..., 3)
+    :return: (..., 3, 3)
+    """
+    aa = np.asarray(aa, dtype=np.float64)
+    angle = np.linalg.norm(aa, axis=-1)[..., np.newaxis, np.newaxis]
+    small = angle < EPS
+    safe_angle = np.where(small, 1., angle)
+    K = _skew(aa)
+    K2 = np.matmul(K, K)
+    # sin(t)/t and (1-cos(t))/t^2 on the unnormalized skew matrix.
+    a = np.where(small, 1., np.sin(safe_angle) / safe_angle)
+    b = np.where(small, 0.5, (1. - np.cos(safe_angle)) / safe_angle ** 2)
+    return np.eye(3) + a * K + b * K2
+
+
+def quaternion_to_matrix(quat):
+    """
+    :param quat: (..., 4) w, x, y, z, normalized here
+    :return: (..., 3, 3)
+    """
+    quat = np.asarray(quat, dtype=np.float64)
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    w, x, y, z = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    R = np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+        2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+        2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y),
+    ], axis=-1)
+    return R.reshape(quat.shape[:-1] + (3, 3))
+
+
+def matrix_to_quaternion(R):
+    """
+    Picks the best conditioned of the four formulas per matrix, so it is
+    stable for all angles (up to pi).
+    :param R: (..., 3, 3) rotation matrices
+    :return: (..., 4) w, x, y, z with w >= 0
+    """
+    R = np.asarray(R, dtype=np.float64)
+    m00, m11, m22 = R[..., 0, 0], R[..., 1, 1], R[..., 2, 2]
+    trace = m00 + m11 + m22
+    # 4 * squares of w, x, y, z.
+    cands = np.stack([1 + trace,
+                      1 + m00 - m11 - m22,
+                      1 - m00 + m11 - m22,
+                      1 - m00 - m11 + m22], axis=-1)
+    best = np.argmax(cands, axis=-1)
+    s = np.sqrt(np.maximum(np.take_along_axis(
+        cands, best[..., np.newaxis], axis=-1)[..., 0], EPS)) * 2
+
+    d21 = R[..., 2, 1] - R[..., 1, 2]
+    d02 = R[..., 0, 2] - R[..., 2, 0]
+    d10 = R[..., 1, 0] - R[..., 0, 1]
+    s21 = R[..., 2, 1] + R[..., 1, 2]
+    s02 = R[..., 0, 2] + R[..., 2, 0]
+    s10 = R[..., 1, 0] + R[..., 0, 1]
+    quats = np.stack([
+        np.stack([s * s / 4, d21, d02, d10], axis=-1),
+        np.stack([d21, s * s / 4, s10, s02], axis=-1),
+        np.stack([d02, s10, s * s / 4, s21], axis=-1),
+        np.stack([d10, s02, s21, s * s / 4], axis=-1),
+    ], axis=-2) / s[..., np.newaxis, np.newaxis]
+    quat = np.take_along_axis(
+        quats, best[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+    quat = quat * np.where(quat[..., :1] < 0, -1., 1.)
+    return quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+
+
+def quaternion_to_axis_angle(quat):
+    """
+    :param quat: (..., 4) w, x, y, z
+    :return: (..., 3), angle in [0, pi]
+    """
+    quat = np.asarray(quat, dtype=np.float64)
+    quat = quat * np.where(quat[..., :1] < 0, -1., 1.)
+    xyz = quat[..., 1:]
+    sin_half = np.linalg.norm(xyz, axis=-1, keepdims=True)
+    angle = 2 * np.arctan2(sin_half, quat[..., :1])
+    small = sin_half < EPS
+    # angle / sin(angle / 2) -> 2 / w for small angles.
+    scale = np.where(small, 2. / np.maximum(quat[..., :1], EPS),
+                     angle / np.where(small, 1., sin_half))
+    return xyz * scale
+
+
+def axis_angle_to_quaternion(aa):
+    """
+    :param aa: (..., 3)
+    :return: (..., 4) w, x, y, z
+    """
+    aa = np.asarray(aa, dtype=np.float64)
+    angle = np.linalg.norm(aa, axis=-1, keepdims=True)
+    small = angle < EPS
+    # sin(angle / 2) / angle -> 1 / 2 for small angles.
+    scale = np.where(small, 0.5, np.sin(angle / 2) / np.where(small, 1., angle))
+    return np.concatenate([np.cos(angle / 2), aa * scale], axis=-1)
+
+
+def matrix_to_axis_angle(R):
+    """
+    Same as cv2.Rodrigues(R)[0] per matrix.
+    :param R: (..., 3, 3)
+    :return: (..., 3)
+    """
+    return quaternion_to_axis_angle(matrix_to_quaternion(R))
+
+
+def _elementary(axis, angle):
+    """
+    Rotations of angle (...) around axis 0, 1 or 2 -> (..., 3, 3).
+    """
+    c, s = np.cos(angle), np.sin(angle)
+    one, zero = np.ones_like(angle), np.zeros_like(angle)
+    if axis == 0:
+        R = [one, zero, zero, zero, c, -s, zero, s, c]
+    elif axis == 1:
+        R = [c, zero, s, zero, one, zero, -s, zero, c]
+    else:
+        R = [c, -s, zero, s, c, zero, zero, zero, one]
+    return np.stack(R, axis=-1).reshape(np.shape(angle) + (3, 3))
+
+
+def _parse_order(order):
+    axes = ['xyz'.index(a) for a in order.lower()]
+    if len(order) != 3 or sorted(axes) != [0, 1, 2] or \
+            not (order.islower() or order.isupper()):
+        raise Exception('Unsupported euler order %s, use 3 different axes, '
+                        'lower case (extrinsic) or upper case (intrinsic)'
+                        % order)
+    return axes, order.isupper()
+
+
+def euler_to_matrix(angles, order='xyz', degrees=False):
+    """
+    :param angles: (..., 3) in the order of the axes
+    :param order: e.g. 'xyz' (extrinsic) or 'XYZ' (intrinsic)
+    :return: (..., 3, 3)
+    """
+    axes, intrinsic = _parse_order(order)
+    angles = np.asarray(angles, dtype=np.float64)
+    if degrees:
+        angles = np.deg2rad(angles)
+    R = np.eye(3)
+    for i, axis in enumerate(axes):
+        Ri = _elementary(axis, angles[..., i])
+        # Intrinsic rotations compose on the right, extrinsic on the left.
+        R = np.matmul(R, Ri) if intrinsic else np.matmul(Ri, R)
+    return R
+
+
+def matrix_to_euler(R, order='xyz', degrees=False):
+    """
+    Same as scipy's Rotation.from_matrix(R).as_euler(order), the middle
+    angle is in [-pi/2, pi/2] and the last one is 0 at gimbal lock.
+    :param R: (..., 3, 3)
+    :param order: e.g. 'xyz' (extrinsic) or 'XYZ' (intrinsic)
+    :return: (..., 3)
+    """
+    axes, intrinsic = _parse_order(order)
+    R = np.asarray(R, dtype=np.float64)
+    if not intrinsic:
+        # Extrinsic xyz is intrinsic ZYX with the angles reversed.
+        axes = axes[::-1]
+    i, j, k = axes
+    # +1 for the cyclic orders (xyz, yzx, zxy).
+    sign = 1. if (j - i) % 3 == 1 else -1.
+
+    sin_b = np.clip(sign * R[..., i, k], -1., 1.)
+    b = np.arcsin(sin_b)
+    a = np.arctan2(-sign * R[..., j, k], R[..., k, k])
+    c = np.arctan2(-sign * R[..., i, j], R[..., i, i])
+    # Gimbal lock, only a + c (or a - c) is defined: put it all in a.
+    lock = np.abs(sin_b) > 1 - 1e-7
+    a = np.where(lock, np.arctan2(sign * R[..., k, j], R[..., j, j]), a)
+    c = np.where(lock, 0., c)
+
+    angles = np.stack([a, b, c], axis=-1)
+    if not intrinsic:
+        angles = angles[..., ::-1]
+    if degrees:
+        angles = np.rad2deg(angles)
+    return angles
@@ -0,0 +1,99 @@
+"""
+Camera side of ingest.py.
+
+Listens for UDP pings, and for each host that pings connects back over
+TCP and streams frames with frame_protocol. A frame is only grabbed once
+the previous one has been handed to the socket (await drain), so when the
+network or the receiver is slow the camera skips frames instead of
+queueing them.
+
+Sample usage:
+
+  cap = cv2.VideoCapture(0)
+  serve_camera(lambda: (cap.read()[1], time.time()), port=1024)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+from .frame_protocol import FrameWriter
+
+
+class _PingProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_ping):
+        self.on_ping = on_ping
+
+    def datagram_received(self, data, addr):
+        print('Recived Multicast data bytes from {}'.format(addr))
+        self.on_ping(addr)
+
+
+class CameraSender(object):
+    def __init__(self, grab_fn, reply_port=1024, codec='raw', quality=90):
+        """
+        Args:
+          grab_fn: () -> (frame, timestamp), frame None to skip, called
+                   from a single grabbing thread
+          reply_port: TCP port of the ingest server on the pinging host
+          codec, quality: see FrameWriter
+        """
+        self.grab_fn = grab_fn
+        self.reply_port = reply_port
+        self.codec = codec
+        self.quality = quality
+        # The camera is read from one thread even with several receivers.
+        self.grabber = ThreadPoolExecutor(1)
+        self.streams = {}
+
+    def on_ping(self, addr):
+        host = addr[0]
+        if host in self.streams and not self.streams[host].done():
+            # already streaming there
+            return
+        self.streams[host] = asyncio.ensure_future(self.stream(host))
+
+    async def stream(self, host):
+        print('sending acknowledgement to', (host, self.reply_port))
+        loop = asyncio.get_running_loop()
+        writer = FrameWriter(self.codec, self.quality)
+        try:
+            _, stream = await asyncio.open_connection(host, self.reply_port)
+        except OSError as e:
+            print('Could not connect to %s:%d: %s' % (host, self.reply_port, e))
+            return
+        print("connection received")
+        try:
+            while True:
+                frame, timestamp = await loop.run_in_executor(
+                    self.grabber, self.grab_fn)
+                if frame is None:
+                    continue
+                writer.set_frame(frame, timestamp)
+                writer.write_to(stream)
+                await stream.drain()
+        except (ConnectionError, OSError) as e:
+            print('Stream to %s closed: %s' % (host, e))
+        finally:
+            writer.close()
+            stream.close()
+
+
+def serve_camera(grab_fn, host='0.0.0.0', port=1024, reply_port=1024,
+                 codec='raw', quality=90):
+    """
+    Blocking: answers pings on host:port (UDP) by streaming grab_fn()
+    frames to reply_port on the pinging host.
+    """
+    sender = CameraSender(grab_fn, reply_port, codec, quality)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _PingProtocol(sender.on_ping),
+            local_addr=(host, port))
+        print('Camera server listen to {}:{}'.format(host, port))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            transport.close()
+
+    asyncio.run(main())
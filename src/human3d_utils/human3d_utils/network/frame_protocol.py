@@ -0,0 +1,299 @@
+"""
+Framed binary protocol for sending NumPy frames over TCP.
+
+Each message is a fixed size header followed by the payload:
+
+  magic   4s   b'H3DF'
+  codec   B    index into codec.CODECS
+  dtype   B    index into DTYPES
+  ndim    B    1 to 3
+  shape   3I   shape of the decoded frame, unused dims are 1
+  ts      d    timestamp of the frame
+  seq     Q    sequence number
+  nbytes  I    size of the payload
+
+With the raw codec the payload is the pixel buffer: the sender writes the
+header and a memoryview of the frame, the receiver reads the pixels with
+recv_into straight into a ring of preallocated arrays. No pickle, no
+copies. With jpeg/h264 the payload is the encoded data and the receiver
+decodes it on a worker pool, see codec.py.
+"""
+from collections import deque
+import struct
+
+import numpy as np
+
+from .codec import CODECS, make_encoder, make_decoder
+
+MAGIC = b'H3DF'
+HEADER = struct.Struct('<4sBBB3IdQI')
+DTYPES = [np.dtype(t) for t in ['uint8', 'uint16', 'int16', 'float32',
+                                'float64']]
+# Refuse anything bigger than this from the network.
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def pack_header(frame, timestamp, seq, codec='raw', nbytes=None):
+    """
+    Header of one frame.
+    :param frame: C-contiguous numpy array with at most 3 dims
+    :param timestamp: frame timestamp
+    :param seq: sequence number
+    :param codec: one of codec.CODECS
+    :param nbytes: payload size, defaults to the raw frame size
+    :return: bytes
+    """
+    if frame.dtype not in DTYPES:
+        raise Exception('Unsupported frame dtype: %s' % frame.dtype)
+    if frame.ndim > 3:
+        raise Exception('Frames have at most 3 dims, got %d' % frame.ndim)
+    if nbytes is None:
+        nbytes = frame.nbytes
+    shape = list(frame.shape) + [1] * (3 - frame.ndim)
+    return HEADER.pack(MAGIC, CODECS.index(codec), DTYPES.index(frame.dtype),
+                       frame.ndim, shape[0], shape[1], shape[2], timestamp,
+                       seq, nbytes)
+
+
+def unpack_header(header):
+    """
+    :param header: HEADER.size bytes
+    :return: codec, dtype, shape, timestamp, seq, nbytes
+    """
+    magic, codec_id, dtype_id, ndim, s0, s1, s2, timestamp, seq, nbytes = \
+        HEADER.unpack(header)
+    if magic != MAGIC:
+        raise Exception('Bad frame header: %r' % magic)
+    if codec_id >= len(CODECS) or dtype_id >= len(DTYPES) or \
+            not 1 <= ndim <= 3:
+        raise Exception('Bad frame header: codec %d, dtype %d, ndim %d' %
+                        (codec_id, dtype_id, ndim))
+    codec = CODECS[codec_id]
+    dtype = DTYPES[dtype_id]
+    shape = (s0, s1, s2)[:ndim]
+    raw_bytes = int(np.prod(shape)) * dtype.itemsize
+    if not 0 < raw_bytes <= MAX_FRAME_BYTES or nbytes > MAX_FRAME_BYTES or \
+            (codec == 'raw' and nbytes != raw_bytes):
+        raise Exception('Bad frame header: %d bytes for %s %s %s' %
+                        (nbytes, codec, shape, dtype))
+    return codec, dtype, shape, timestamp, seq, nbytes
+
+
+class FrameWriter(object):
+    """
+    Sender, either on a non-blocking socket:
+
+        if not writer.pending():
+            writer.set_frame(color, timestamp)
+        writer.send(sock)
+
+    or on an asyncio stream:
+
+        writer.set_frame(color, timestamp)
+        writer.write_to(stream)
+        await stream.drain()
+
+    codec: 'raw', 'jpeg' (with quality) or 'h264' (with fps)
+    """
+
+    def __init__(self, codec='raw', quality=90, fps=30):
+        if codec not in CODECS:
+            raise Exception('Unknown codec %s, must be one of %s' %
+                            (codec, ', '.join(CODECS)))
+        self.codec = codec
+        self.quality = quality
+        self.fps = fps
+        self.encoder = None
+        self.chunks = []
+        self.seq = 0
+
+    def pending(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def set_frame(self, frame, timestamp):
+        frame = np.ascontiguousarray(frame)
+        if self.codec == 'raw':
+            payload = frame.reshape(-1).view(np.uint8)
+        else:
+            if self.encoder is None:
+                self.encoder = make_encoder(self.codec, frame.shape,
+                                            self.quality, self.fps)
+            payload = self.encoder.encode(frame)
+        header = pack_header(frame, timestamp, self.seq, self.codec,
+                             len(payload))
+        self.seq += 1
+        self.chunks = [memoryview(header)]
+        if len(payload):
+            self.chunks.append(memoryview(payload))
+
+    def send(self, sock):
+        """
+        Sends as much as the socket takes.
+        :param sock: non-blocking socket
+        :return: True once the whole frame is sent
+        """
+        while self.chunks:
+            try:
+                sent = sock.send(self.chunks[0])
+            except BlockingIOError:
+                return False
+            if not sent:
+                return False
+            if sent < len(self.chunks[0]):
+                self.chunks[0] = self.chunks[0][sent:]
+                return False
+            self.chunks.pop(0)
+        return True
+
+    def write_to(self, stream):
+        """
+        Hands the whole frame to an asyncio StreamWriter or transport.
+        """
+        for chunk in self.chunks:
+            stream.write(chunk)
+        self.chunks = []
+
+    def close(self):
+        if self.encoder is not None:
+            self.encoder.close()
+
+
+class FrameReader(object):
+    """
+    Non-blocking receiver, either on a socket:
+
+        for image, timestamp, seq in reader.read_from(sock):
+            ...
+
+    or from an asyncio.BufferedProtocol, see ingest.py:
+
+        get_buffer   -> reader.get_buffer()
+        buffer_updated(n) -> reader.buffer_updated(n); reader.poll()
+
+    Raw images are views of one of ring_size preallocated buffers, they
+    stay valid until ring_size more frames are received. Copy them to keep
+    them longer. Encoded frames are decoded by num_workers threads and
+    come out in order, possibly a few reads later.
+    """
+
+    def __init__(self, ring_size=4, num_workers=2):
+        self.header = bytearray(HEADER.size)
+        self.header_view = memoryview(self.header)
+        self.ring_size = ring_size
+        self.num_workers = num_workers
+        self.ring = []
+        self.slot = 0
+        self.received = 0
+        self.closed = False
+        self.frame = None
+        self.decoder = None
+        self.decoder_key = None
+        self.ready = deque()
+
+    def _start_frame(self):
+        self.codec, dtype, shape, self.timestamp, self.seq, nbytes = \
+            unpack_header(self.header)
+        if self.codec != 'raw':
+            key = (self.codec, shape)
+            if self.decoder_key != key:
+                if self.decoder is not None:
+                    self.decoder.close()
+                self.decoder = make_decoder(self.codec, shape,
+                                            self.num_workers)
+                self.decoder_key = key
+            self.shape = shape
+            self.payload = memoryview(bytearray(nbytes))
+            return
+        buf = self.ring[self.slot] if self.ring else None
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            # First frame or the stream changed: (re)allocate the ring.
+            self.ring = [np.empty(shape, dtype=dtype)
+                         for _ in range(self.ring_size)]
+            self.slot = 0
+        self.frame = self.ring[self.slot]
+        self.payload = memoryview(self.frame.reshape(-1).view(np.uint8))
+
+    def _finish_frame(self):
+        self.received = 0
+        if self.codec != 'raw':
+            self.decoder.submit(self.payload, self.shape, self.timestamp,
+                                self.seq)
+            return
+        self.ready.append((self.frame, self.timestamp, self.seq))
+        self.slot = (self.slot + 1) % self.ring_size
+
+    def get_buffer(self):
+        """
+        :return: memoryview the next received bytes go into
+        """
+        if self.received < HEADER.size:
+            return self.header_view[self.received:]
+        return self.payload[self.received - HEADER.size:]
+
+    def buffer_updated(self, n):
+        """
+        n bytes were written into the last get_buffer(), 0 means the
+        connection closed.
+        """
+        if n == 0:
+            self.closed = True
+            return
+        self.received += n
+        if self.received == HEADER.size:
+            self._start_frame()
+            if len(self.payload) == 0:
+                self._finish_frame()
+        elif self.received > HEADER.size and \
+                self.received - HEADER.size == len(self.payload):
+            self._finish_frame()
+
+    def poll(self):
+        """
+        :return: list of (image, timestamp, seq) ready so far, in order
+        """
+        if self.decoder is not None:
+            self.ready.extend(self.decoder.poll())
+        frames = list(self.ready)
+        self.ready.clear()
+        return frames
+
+    def _read(self, sock):
+        self.buffer_updated(sock.recv_into(self.get_buffer()))
+
+    def read_from(self, sock):
+        """
+        Reads what is available on sock.
+        :return: list of (image, timestamp, seq) ready so far, in order
+        """
+        try:
+            self._read(sock)
+        except BlockingIOError:
+            pass
+        return self.poll()
+
+    def recv_frame(self, sock):
+        """
+        Blocking version of read_from for a single frame.
+        :return: (image, timestamp, seq), or None if the connection closed
+        """
+        while not self.ready and not self.closed:
+            self._read(sock)
+            if self.decoder is not None:
+                # Wait for the frame that just came in to be decoded.
+                self.ready.extend(self.decoder.poll(wait=self.received == 0))
+        if not self.ready and self.decoder is not None:
+            self.ready.extend(self.decoder.poll(wait=True))
+        return self.ready.popleft() if self.ready else None
+
+    def close(self):
+        if self.decoder is not None:
+            self.decoder.close()
+
+
+def send_frame(sock, frame, timestamp, seq=0):
+    """
+    Blocking send of one raw frame.
+    """
+    frame = np.ascontiguousarray(frame)
+    sock.sendall(pack_header(frame, timestamp, seq))
+    sock.sendall(memoryview(frame.reshape(-1).view(np.uint8)))
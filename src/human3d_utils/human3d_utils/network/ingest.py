@@ -0,0 +1,312 @@
+"""
+asyncio ingest server for many camera streams.
+
+Cameras (camera_sender.py) connect over TCP after a UDP ping and stream
+frames with frame_protocol. Every connection is a Camera that only keeps
+its latest frame: a frame that is not taken before the next one arrives
+is dropped, so a slow consumer never builds up a backlog. Frames are
+read with recv_into straight into the FrameReader ring, and while the
+consumer runs on the event loop the sockets are simply not read, so TCP
+flow control pushes back on the senders.
+
+Sample usage:
+
+  async def main():
+      server = IngestServer(port=1024)
+      await server.start()
+      server.ping('172.27.15.168', 1024)
+      async for frames in server.frame_sets(num_cameras=2, max_skew=0.02):
+          # frames: {camera_id: CameraFrame}
+          ...
+      server.close()
+
+  asyncio.run(main())
+"""
+from collections import deque, namedtuple
+import asyncio
+import socket
+import time
+
+import numpy as np
+
+from .frame_protocol import FrameReader
+
+CameraFrame = namedtuple('CameraFrame', ['image', 'timestamp', 'seq',
+                                         't_recv'])
+
+
+class Camera(object):
+    """
+    Latest-frame slot of one connected camera.
+    """
+
+    def __init__(self, address, port):
+        self.camera_id = '%s:%d' % (address, port)
+        self.address = address
+        self.port = port
+        self.connected = True
+        self.latest = None
+        self.fresh = False
+        # last taken frame, kept as attributes for the client decorators
+        self.frame_id = -1
+        self.timestamp = None
+        self.seq = None
+
+        # Stats
+        self.num_received = 0
+        self.num_taken = 0
+        self.num_dropped = 0
+        self.recv_times = deque(maxlen=100)
+        self.ages = deque(maxlen=100)
+
+    def update(self, frames):
+        """
+        :param frames: list of (image, timestamp, seq) from FrameReader.poll
+        """
+        if not frames:
+            return
+        now = time.time()
+        if self.fresh:
+            self.num_dropped += 1
+        self.num_dropped += len(frames) - 1
+        self.num_received += len(frames)
+        self.recv_times.extend([now] * len(frames))
+        image, timestamp, seq = frames[-1]
+        self.latest = CameraFrame(image, timestamp, seq, now)
+        self.fresh = True
+
+    def take(self):
+        """
+        :return: the latest CameraFrame, its image is a copy that stays
+                 valid after more frames come in
+        """
+        frame = self.latest
+        frame = frame._replace(image=np.array(frame.image))
+        self.fresh = False
+        self.frame_id = self.num_taken
+        self.num_taken += 1
+        self.timestamp = frame.timestamp
+        self.seq = frame.seq
+        self.ages.append(time.time() - frame.t_recv)
+        return frame
+
+    def stats(self):
+        """
+        Returns a dict with the receive fps over the last 100 frames, the
+        mean time (sec) frames waited in the slot before being taken and
+        frame counts.
+        """
+        if len(self.recv_times) > 1:
+            fps = (len(self.recv_times) - 1) / max(
+                self.recv_times[-1] - self.recv_times[0], 1e-8)
+        else:
+            fps = 0.
+        return {
+            'fps': fps,
+            'latency': np.mean(self.ages) if self.ages else 0.,
+            'received': self.num_received,
+            'taken': self.num_taken,
+            'dropped': self.num_dropped,
+            'connected': self.connected,
+        }
+
+
+class _CameraProtocol(asyncio.BufferedProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.reader = FrameReader(ring_size=server.ring_size,
+                                  num_workers=server.decode_workers)
+        self.camera = None
+
+    def connection_made(self, transport):
+        address, port = transport.get_extra_info('peername')[:2]
+        self.transport = transport
+        self.camera = Camera(address, port)
+        self.server._add(self)
+
+    def get_buffer(self, sizehint):
+        return self.reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            self.reader.buffer_updated(nbytes)
+        except Exception as e:
+            # bad header, drop the connection
+            print('Closing %s: %s' % (self.camera.camera_id, e))
+            self.transport.close()
+            return
+        self.poll()
+
+    def poll(self):
+        frames = self.reader.poll()
+        if frames:
+            self.camera.update(frames)
+            self.server.updated.set()
+
+    def connection_lost(self, exc):
+        self.reader.close()
+        self.camera.connected = False
+        self.server._remove(self)
+
+
+class IngestServer(object):
+    def __init__(self,
+                 host='0.0.0.0',
+                 port=1024,
+                 ring_size=4,
+                 decode_workers=2,
+                 on_connect=None,
+                 poll_interval=0.005):
+        """
+        Args:
+          host, port: TCP address the cameras connect to
+          ring_size: receive buffers per camera, raw frames are views of
+                     them until taken
+          decode_workers: threads decoding jpeg/h264 per camera
+          on_connect: called with each new Camera
+          poll_interval: how often (sec) decoded jpeg/h264 frames are
+                         collected
+        """
+        self.host = host
+        self.port = port
+        self.ring_size = ring_size
+        self.decode_workers = decode_workers
+        self.on_connect = on_connect
+        self.poll_interval = poll_interval
+        self.cameras = {}
+        self.protocols = []
+        self.server = None
+        self.poller = None
+        self.closed = False
+        self.updated = None
+
+    async def start(self):
+        self.updated = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: _CameraProtocol(self), self.host, self.port,
+            reuse_address=True)
+        self.poller = loop.create_task(self._poll_decoders())
+        print('Ingest server listening on {}:{}'.format(self.host, self.port))
+        return self
+
+    def ping(self, ip, port=1024, message='EtherSensePing!!'):
+        """
+        Asks the camera server(s) at ip:port (UDP) to connect and stream.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            print('sending "%s"' % message + str((ip, port)))
+            sock.sendto(message.encode(), (ip, port))
+        finally:
+            sock.close()
+
+    def close(self):
+        self.closed = True
+        if self.poller is not None:
+            self.poller.cancel()
+        if self.server is not None:
+            self.server.close()
+        for protocol in list(self.protocols):
+            protocol.transport.close()
+        if self.updated is not None:
+            self.updated.set()
+
+    def connected_cameras(self):
+        return [camera for camera in self.cameras.values()
+                if camera.connected]
+
+    async def frames(self):
+        """
+        Yields (camera, CameraFrame) for every frame taken, the camera
+        that has waited longest goes first. Frames that come in while the
+        consumer is busy replace the ones not taken yet.
+        """
+        while not self.closed:
+            fresh = [camera for camera in self.connected_cameras()
+                     if camera.fresh]
+            if fresh:
+                camera = min(fresh, key=lambda camera: camera.latest.t_recv)
+                yield camera, camera.take()
+                continue
+            await self._wait()
+
+    async def frame_sets(self, num_cameras=None, max_skew=None):
+        """
+        Yields {camera_id: CameraFrame} with one new frame per connected
+        camera.
+          num_cameras: wait until at least this many cameras are connected
+          max_skew: most time (sec) between the receive times of the
+                    frames in a set, older frames are skipped
+        """
+        while not self.closed:
+            cameras = self.connected_cameras()
+            if not cameras or (num_cameras and len(cameras) < num_cameras) \
+                    or not all(camera.fresh for camera in cameras):
+                await self._wait()
+                continue
+            if max_skew is not None:
+                newest = max(camera.latest.t_recv for camera in cameras)
+                late = [camera for camera in cameras
+                        if newest - camera.latest.t_recv > max_skew]
+                if late:
+                    # Wait for the next frame of the late cameras.
+                    for camera in late:
+                        camera.fresh = False
+                        camera.num_dropped += 1
+                    continue
+            yield dict((camera.camera_id, camera.take())
+                       for camera in cameras)
+
+    def stats(self):
+        """
+        Returns {camera_id: Camera.stats()}.
+        """
+        return dict((camera_id, camera.stats())
+                    for camera_id, camera in self.cameras.items())
+
+    async def _wait(self):
+        self.updated.clear()
+        await self.updated.wait()
+
+    async def _poll_decoders(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for protocol in self.protocols:
+                if protocol.reader.decoder is not None:
+                    protocol.poll()
+
+    def _add(self, protocol):
+        camera = protocol.camera
+        print('Incoming connection from %s' % camera.camera_id)
+        self.protocols.append(protocol)
+        self.cameras[camera.camera_id] = camera
+        self.on_connect and self.on_connect(camera)
+        self.updated.set()
+
+    def _remove(self, protocol):
+        print('Connection closed from %s' % protocol.camera.camera_id)
+        self.protocols.remove(protocol)
+        self.updated.set()
+
+
+def run_ingest(handle_frame, ip, port=1024, message='EtherSensePing!!',
+               initialize=None, decode_workers=2):
+    """
+    Blocking loop for the client decorators: pings the camera servers at
+    ip:port and calls handle_frame(camera, image) for each frame taken.
+    initialize(camera) is called when a camera connects.
+    """
+
+    async def main():
+        server = IngestServer('', port, decode_workers=decode_workers,
+                              on_connect=initialize)
+        await server.start()
+        try:
+            server.ping(ip, port, message)
+            async for camera, frame in server.frames():
+                handle_frame(camera, frame.image)
+        finally:
+            server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Freezes a trained model into a single constant graph and runs it.
+
+Only the outputs of the last IEF stage are kept, so the SMPL of the
+earlier stages, the saver and mean_var are all pruned away and startup is
+just reading one GraphDef.
+
+Sample call to export:
+python -m src.FrozenModel --load_path=<model.ckpt-667589> --frozen_path=hmr_frozen.pb
+Theta only (no mesh in the graph):
+python -m src.FrozenModel --load_path=<ckpt> --frozen_path=hmr_theta.pb --frozen_outputs=theta,cams
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import flags
+import tensorflow as tf
+
+from .config import get_config
+from .RunModel import RunModel, ThetaSMPL
+
+# Names of the final stage outputs in RunModel.final_outputs.
+OUTPUT_NAMES = ['joints', 'verts', 'cams', 'joints3d', 'theta']
+
+flags.DEFINE_string('frozen_path', None, 'path of the frozen graph (.pb)')
+flags.DEFINE_list('frozen_outputs', OUTPUT_NAMES,
+                  'final stage outputs kept in the frozen graph')
+
+
+def freeze_model(config, frozen_path, outputs=OUTPUT_NAMES):
+    """
+    Restores config.load_path and writes a frozen GraphDef with only the
+    requested outputs to frozen_path.
+    """
+    for name in outputs:
+        if name not in OUTPUT_NAMES:
+            raise Exception('Unknown output %s, must be one of %s' %
+                            (name, ', '.join(OUTPUT_NAMES)))
+    graph = tf.Graph()
+    with graph.as_default():
+        sess = tf.Session(graph=graph)
+        model = RunModel(config, sess=sess)
+        input_name = model.images_pl.op.name
+        output_names = [model.final_outputs[name].op.name for name in outputs]
+        # Variables -> constants, this also drops everything the outputs
+        # don't depend on (earlier stage SMPL, saver ops).
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            sess, graph.as_graph_def(), output_names)
+        sess.close()
+
+    from tensorflow.tools.graph_transforms import TransformGraph
+    graph_def = TransformGraph(graph_def, [input_name], output_names, [
+        'strip_unused_nodes',
+        'fold_constants(ignore_errors=true)',
+        'fold_batch_norms',
+        'fold_old_batch_norms',
+    ])
+
+    with tf.gfile.GFile(frozen_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('Saved frozen graph with %s to %s (%d nodes)' %
+          (', '.join(outputs), frozen_path, len(graph_def.node)))
+
+
+class FrozenModel(object):
+    def __init__(self, config, sess=None):
+        """
+        Same interface as RunModel, but loads config.frozen_path instead
+        of building the model and restoring a checkpoint.
+        """
+        self.frozen_path = config.frozen_path
+        if not self.frozen_path:
+            raise Exception(
+                "[!] You need to specify `frozen_path` to load a frozen model")
+        self.img_size = config.img_size
+        # For predict_theta and verts_from_theta.
+        self.theta_smpl = ThetaSMPL(
+            config.smpl_model_path, config.joint_type, self.img_size)
+
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(self.frozen_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        if sess is None:
+            self.sess = tf.Session(graph=tf.Graph())
+        else:
+            self.sess = sess
+        with self.sess.graph.as_default():
+            tf.import_graph_def(graph_def, name='hmr')
+
+        graph = self.sess.graph
+        self.images_pl = graph.get_tensor_by_name('hmr/input_images:0')
+        self.outputs = {}
+        for name in OUTPUT_NAMES:
+            try:
+                self.outputs[name] = graph.get_tensor_by_name(
+                    'hmr/%s:0' % name)
+            except KeyError:
+                # Not exported.
+                pass
+        print('Loaded frozen graph %s with outputs: %s' %
+              (self.frozen_path, ', '.join(sorted(self.outputs.keys()))))
+
+    def predict(self, images, get_theta=False):
+        """
+        images: num_batch, img_size, img_size, 3
+        Preprocessed to range [-1, 1]
+        """
+        names = ['joints', 'verts', 'cams', 'joints3d']
+        if get_theta:
+            names.append('theta')
+        results = self.predict_dict(images, names)
+        return tuple(results[name] for name in names)
+
+    def predict_dict(self, images, outputs=None):
+        """
+        images: num_batch, img_size, img_size, 3
+        Preprocessed to range [-1, 1]
+        outputs: names to fetch, all exported outputs if None.
+        """
+        if outputs is None:
+            outputs = list(self.outputs.keys())
+        missing = [name for name in outputs if name not in self.outputs]
+        if missing:
+            raise Exception('%s not in the frozen graph %s, re-export with '
+                            '--frozen_outputs' %
+                            (', '.join(missing), self.frozen_path))
+        fetch_dict = dict((name, self.outputs[name]) for name in outputs)
+
+        results = self.sess.run(fetch_dict, {self.images_pl: images})
+
+        # Return joints in original image space.
+        if 'joints' in results:
+            results['joints'] = ((results['joints'] + 1) * 0.5) * self.img_size
+
+        return results
+
+    def predict_theta(self, images, get_joints=False):
+        """
+        Same as RunModel.predict_theta, needs theta in the frozen graph.
+        """
+        theta = self.predict_dict(images, ['theta'])['theta']
+        results = {'theta': theta, 'cams': theta[:, :3]}
+        if get_joints:
+            results['joints'], results['joints3d'] = self.theta_smpl.joints(
+                theta)
+        return results
+
+    def verts_from_theta(self, theta):
+        return self.theta_smpl.verts(theta)
+
+
+def main(config):
+    if not config.frozen_path:
+        raise Exception("[!] You need to specify `frozen_path` to export to")
+    freeze_model(config, config.frozen_path, config.frozen_outputs)
+
+
+if __name__ == '__main__':
+    config = get_config()
+    main(config)
@@ -76,27 +76,86 @@ def align_by_pelvis(joints, get_pelvis=False):
         return joints - np.expand_dims(pelvis, axis=0)
 
 
-def compute_errors(gt3ds, preds):
+def batch_align_by_pelvis(joints):
+    """
+    align_by_pelvis for N x 14 x 3 joints.
+    """
+    left_id = 3
+    right_id = 2
+
+    pelvis = (joints[:, left_id] + joints[:, right_id]) / 2.
+    return joints - np.expand_dims(pelvis, axis=1)
+
+
+def batch_compute_similarity_transform(S1, S2):
+    """
+    compute_similarity_transform for N x J x 3 points, with one stacked
+    SVD for all N.
+    """
+    assert S1.shape == S2.shape
+
+    # 1. Remove mean.
+    mu1 = S1.mean(axis=1, keepdims=True)
+    mu2 = S2.mean(axis=1, keepdims=True)
+    X1 = S1 - mu1
+    X2 = S2 - mu2
+
+    # 2. Compute variance of X1 used for scale.
+    var1 = np.sum(X1**2, axis=(1, 2))
+
+    # 3. The outer product of X1 and X2, N x 3 x 3.
+    K = np.matmul(X1.transpose(0, 2, 1), X2)
+
+    # 4. Solution that Maximizes trace(R'K) is R=U*V', where U, V are
+    # singular vectors of K.
+    U, s, Vh = np.linalg.svd(K)
+    V = Vh.transpose(0, 2, 1)
+    Ut = U.transpose(0, 2, 1)
+    # Construct Z that fixes the orientation of R to get det(R)=1.
+    Z = np.tile(np.eye(U.shape[1]), (len(U), 1, 1))
+    Z[:, -1, -1] *= np.sign(np.linalg.det(np.matmul(U, Vh)))
+    # Construct R.
+    R = np.matmul(V, np.matmul(Z, Ut))
+
+    # 5. Recover scale.
+    scale = np.trace(np.matmul(R, K), axis1=1, axis2=2) / var1
+
+    # 6. Recover translation (row vectors, so R acts as R').
+    scale = scale[:, np.newaxis, np.newaxis]
+    t = mu2 - scale*np.matmul(mu1, R.transpose(0, 2, 1))
+
+    # 7. Error:
+    S1_hat = scale*np.matmul(S1, R.transpose(0, 2, 1)) + t
+
+    return S1_hat
+
+
+def compute_errors(gt3ds, preds, chunk_size=10000):
     """
     Gets MPJPE after pelvis alignment + MPJPE after Procrustes.
     Evaluates on the 14 common joints.
     Inputs:
       - gt3ds: N x 14 x 3
       - preds: N x 14 x 3
+      - chunk_size: frames aligned at once, bounds the memory used
+    Returns N errors, N PA errors
     """
+    preds = np.asarray(preds)
+    gt3ds = np.reshape(gt3ds, preds.shape)
     errors, errors_pa = [], []
-    for i, (gt3d, pred) in enumerate(zip(gt3ds, preds)):
-        gt3d = gt3d.reshape(-1, 3)
+    for i in range(0, len(gt3ds), chunk_size):
         # Root align.
-        gt3d = align_by_pelvis(gt3d)
-        pred3d = align_by_pelvis(pred)
+        gt3d = batch_align_by_pelvis(gt3ds[i:i + chunk_size])
+        pred3d = batch_align_by_pelvis(preds[i:i + chunk_size])
 
-        joint_error = np.sqrt(np.sum((gt3d - pred3d)**2, axis=1))
-        errors.append(np.mean(joint_error))
+        joint_error = np.sqrt(np.sum((gt3d - pred3d)**2, axis=2))
+        errors.append(np.mean(joint_error, axis=1))
 
         # Get PA error.
-        pred3d_sym = compute_similarity_transform(pred3d, gt3d)
-        pa_error = np.sqrt(np.sum((gt3d - pred3d_sym)**2, axis=1))
-        errors_pa.append(np.mean(pa_error))
+        pred3d_sym = batch_compute_similarity_transform(pred3d, gt3d)
+        pa_error = np.sqrt(np.sum((gt3d - pred3d_sym)**2, axis=2))
+        errors_pa.append(np.mean(pa_error, axis=1))
 
-    return errors, errors_pa
+    if not errors:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(errors), np.concatenate(errors_pa)
@@ -4,6 +4,11 @@ Evaluation of H3.6M.
 Sample call from hmr:
 python -m src.benchmark.evaluate_h36m --batch_size=500 --load_path=<model_to_eval>
 python -m src.benchmark.evaluate_h36m --batch_size=500 --load_path=/home/kanazawa/projects/hmr_v2/models/model.ckpt-667589
+
+The crops and gt3ds don't depend on the model, to decode them once for all
+checkpoints build the crop cache and pass it to every evaluation:
+python -m src.benchmark.evaluate_h36m --build_crop_cache --crop_dir=<crop_dir>
+python -m src.benchmark.evaluate_h36m --crop_dir=<crop_dir> --load_path=<model_to_eval>
 """
 
 from __future__ import absolute_import
@@ -13,7 +18,6 @@ from __future__ import print_function
 import itertools
 from absl import flags
 import numpy as np
-import deepdish as dd
 from time import time
 from os.path import exists, join, expanduser, split
 from os import makedirs
@@ -24,6 +28,7 @@ from src.config import get_config
 from ..util import renderer as vis_util
 from ..RunModel import RunModel
 from .eval_util import compute_errors
+from .pred_store import PredictionStore
 from ..datasets.common import read_images_from_tfrecords
 
 kPredDir = '/tmp/hmr_output'
@@ -40,6 +45,13 @@ flags.DEFINE_integer(
 )
 flags.DEFINE_boolean(
     'vis', False, 'If true, visualizes the best and worst 30 results.')
+flags.DEFINE_string(
+    'crop_dir', '',
+    'If set, reads the uint8 crops and gt3ds of each sequence from this '
+    'cache (memory-mapped) instead of the tfrecords, adding missing ones.')
+flags.DEFINE_boolean(
+    'build_crop_cache', False,
+    'If true, only fills crop_dir with all sequences of the protocol.')
 
 model = None
 sess = None
@@ -118,11 +130,26 @@ def get_h36m_seqs(protocol=2):
     return all_pairs, action_names
 
 
+def preprocess_crops(images):
+    """
+    uint8 crops from the crop cache -> float32 in [-1, 1], like the
+    tfrecord reader returns.
+    """
+    if images.dtype == np.uint8:
+        return (images * (2 / 255.) - 1).astype(np.float32)
+    return images
+
+
 # -- Core: ---
-def get_data(seq_name, config):
+def get_crop_store(config):
     """
-    Read preprocessed image from tfrecords.
+    The crop cache is a PredictionStore of the eval crops, one per img_size.
     """
+    return PredictionStore(
+        join(expanduser(config.crop_dir), 'crops%d' % config.img_size))
+
+
+def read_data(seq_name, config, normalize=True):
     global sess
     if sess is None:
         sess = tf.Session()
@@ -130,11 +157,42 @@ def get_data(seq_name, config):
     tf_path = join(
         expanduser(config.tfh36m_dir), 'test', seq_name + '.tfrecord')
     images, kps, gt3ds = read_images_from_tfrecords(
-        tf_path, img_size=config.img_size, sess=sess)
-
+        tf_path, img_size=config.img_size, sess=sess, normalize=normalize)
     return images, gt3ds
 
 
+def get_data(seq_name, config):
+    """
+    Read preprocessed image from tfrecords.
+
+    With crop_dir, the crops are uint8 memmaps of the crop cache, see
+    preprocess_crops.
+    """
+    if not config.crop_dir:
+        return read_data(seq_name, config)
+
+    store = get_crop_store(config)
+    if not store.has(seq_name):
+        images, gt3ds = read_data(seq_name, config, normalize=False)
+        store.save(seq_name, {'images': images, 'gt3ds': gt3ds})
+    data = store.load(seq_name, fields=['images', 'gt3ds'])
+    return data['images'], data['gt3ds']
+
+
+def build_crop_cache(config):
+    """
+    Decodes all sequences of the protocol into crop_dir.
+    """
+    store = get_crop_store(config)
+    all_pairs, _ = get_h36m_seqs(config.protocol)
+    for itr, (sub_id, action, trial_id, cam_id) in enumerate(all_pairs):
+        file_seq_name = 'S%d_%s_%d_cam%01d' % (sub_id, action, trial_id,
+                                               cam_id)
+        print('%d/%d %s' % (itr, len(all_pairs), file_seq_name))
+        if not store.has(file_seq_name):
+            get_data(file_seq_name, config)
+
+
 def run_model(images, config):
     """
     Runs trained model to get predictions on each seq.
@@ -154,27 +212,11 @@ def run_model(images, config):
         print('Batch %d/%d' % (b, num_total_batches))
         start_ind = b * batch_size
         end_ind = (b + 1) * batch_size
-        images_here = images[start_ind:end_ind]
-
-        if end_ind > N:
-            end_ind = N
-            # Need to pad dummy bc batch size is not dynamic,,
-            num_here = images_here.shape[0]
-            images_wdummy = np.vstack([
-                images_here,
-                np.zeros((batch_size - num_here, config.img_size,
-                          config.img_size, 3))
-            ])
-            joints, verts, cams, joints3d, thetas = model.predict(
-                images_wdummy, get_theta=True)
-            joints = joints[:num_here]
-            verts = verts[:num_here]
-            cams = cams[:num_here]
-            joints3d = joints3d[:num_here]
-            thetas = thetas[:num_here]
-        else:
-            joints, verts, cams, joints3d, thetas = model.predict(
-                images_here, get_theta=True)
+        images_here = preprocess_crops(images[start_ind:end_ind])
+
+        # Batch size is dynamic, the last batch is just smaller.
+        joints, verts, cams, joints3d, thetas = model.predict(
+            images_here, get_theta=True)
 
         all_joints.append(joints)
         all_verts.append(verts)
@@ -213,7 +255,7 @@ def add_visuals(errors, results, images):
         content = {
             'vert': results['verts'][ind],
             'joint': results['joints'][ind],
-            'image': images[ind],
+            'image': preprocess_crops(images[ind]),
             'cam': results['cams'][ind],
         }
         extreme_errors.append(errors[ind])
@@ -223,7 +265,7 @@ def add_visuals(errors, results, images):
         content = {
             'vert': results['verts'][best_ind],
             'joint': results['joints'][best_ind],
-            'image': images[best_ind],
+            'image': preprocess_crops(images[best_ind]),
             'cam': results['cams'][best_ind],
         }
         extreme_errors.append(errors[best_ind])
@@ -237,9 +279,10 @@ def evaluate_sequence(seq_info, pred_dir):
     file_seq_name = 'S%d_%s_%d_cam%01d' % (sub_id, action, trial_id, cam_id)
     print('%s' % (seq_name))
 
-    save_path = join(pred_dir, file_seq_name + '_pred.h5')
-    if exists(save_path):
-        results = dd.io.load(save_path)
+    store = PredictionStore(pred_dir)
+    if store.has(file_seq_name):
+        # Only the errors are read, the rest stays on disk (memory-mapped).
+        results = store.load(file_seq_name)
         errors = results['errors']
         errors_pa = results['errors_pa']
         if config.vis:
@@ -263,7 +306,7 @@ def evaluate_sequence(seq_info, pred_dir):
         results['errors'] = errors
         results['errors_pa'] = errors_pa
         # Save results
-        dd.io.save(save_path, results)
+        store.save(file_seq_name, results)
 
     if config.vis:
         add_visuals(errors, results, images)
@@ -399,6 +442,11 @@ def main(config):
 
 if __name__ == '__main__':
     config = get_config()
+    if config.build_crop_cache:
+        if not config.crop_dir:
+            raise Exception('Must specify the crop_dir to build!')
+        build_crop_cache(config)
+        exit(0)
     if not config.load_path:
         raise Exception('Must specify a model to use to predict!')
     if 'model.ckpt' not in config.load_path:
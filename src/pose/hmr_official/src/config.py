@@ -52,12 +52,20 @@ flags.DEFINE_string('model_type', 'resnet_fc3_dropout',
 flags.DEFINE_string(
     'joint_type', 'cocoplus',
     'cocoplus (19 keypoints) or lsp 14 keypoints, returned by SMPL')
+flags.DEFINE_integer(
+    'skin_topk', 0,
+    'if > 0, SMPL skinning at test time only uses the top-k LBS weights '
+    'of each vertex, 0 is dense skinning')
 
 # Training settings:
 # TODO! If you want to train, change this to your 'tf_datasets' or specify it with the flag.
 DATA_DIR = '/scratch1/projects/tf_datasets/'
 
 flags.DEFINE_string('data_dir', DATA_DIR, 'Where to save training models')
+flags.DEFINE_string(
+    'precrop_dir', None,
+    'if set, training images are read from these pre-cropped tfrecords '
+    '(datasets/precrop_tfrecords.py, same layout) instead of data_dir')
 flags.DEFINE_string('log_dir', 'logs', 'Where to save training models')
 flags.DEFINE_string('model_dir', None, 'Where model will be saved -- filled automatically')
 flags.DEFINE_integer('log_img_step', 100, 'How often to visualize img during training')
@@ -65,6 +73,10 @@ flags.DEFINE_integer('epoch', 100, '# of epochs to train')
 
 flags.DEFINE_list('datasets', ['lsp', 'lsp_ext', 'mpii', 'coco'],
                           'datasets to use for training')
+flags.DEFINE_list(
+    'dataset_weights', [],
+    'sampling weight of each of datasets (same order), normalized. Empty is '
+    'half from the datasets with 3D labels, half from the rest, by size')
 flags.DEFINE_list('mocap_datasets', ['CMU', 'H3.6', 'jointLim'],
                   'datasets to use for adversarial prior training')
 
@@ -94,6 +106,16 @@ flags.DEFINE_integer('trans_max', 20, 'Value to jitter translation')
 flags.DEFINE_float('scale_max', 1.23, 'Max value of scale jitter')
 flags.DEFINE_float('scale_min', 0.8, 'Min value of scale jitter')
 
+# Input pipeline
+flags.DEFINE_integer('num_readers', 8, 'Number of tfrecords read in parallel')
+flags.DEFINE_integer('shuffle_buffer', 5000,
+                     'Number of serialized examples shuffled from')
+flags.DEFINE_list('shuffle_buffers', [],
+                  'shuffle_buffer of each of datasets (same order)')
+flags.DEFINE_integer(
+    'data_seed', None,
+    'if set, the file order, shuffling and augmentation are deterministic')
+
 
 def get_config():
     config = flags.FLAGS
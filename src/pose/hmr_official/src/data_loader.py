@@ -6,18 +6,55 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from os.path import join
+from os.path import exists, join
 from glob import glob
+import json
 
+import numpy as np
 import tensorflow as tf
 
 from .tf_smpl.batch_lbs import batch_rodrigues
 from .util import data_utils
 
 _3D_DATASETS = ['h36m', 'up', 'mpi_inf_3dhp']
-
-
-def num_examples(datasets):
+# Random ops per example, each gets its own stateless seed.
+_NUM_RANDOM_OPS = 3
+# Sources per loader, for the stateless seeds.
+_MAX_SOURCES = 100
+# 216=24*3*3 pose, 10 shape, 42=14*3 3D joints
+_LABEL3D_DIM = 268
+# Exact number of records per tfrecord, in data_dir.
+_COUNT_CACHE = 'num_examples.json'
+
+
+def count_examples(files, cache_path=None):
+    """
+    Exact number of records in files. Counting reads the whole files, so
+    the count of each file is kept in the json cache_path (if writable).
+    """
+    counts = {}
+    if cache_path is not None and exists(cache_path):
+        with open(cache_path, 'r') as f:
+            counts = json.load(f)
+    missing = [path for path in files if path not in counts]
+    for path in missing:
+        print('Counting the examples of %s' % path)
+        counts[path] = sum(1 for _ in tf.python_io.tf_record_iterator(path))
+    if missing and cache_path is not None:
+        try:
+            with open(cache_path, 'w') as f:
+                json.dump(counts, f, indent=1, sort_keys=True)
+        except IOError:
+            print('Could not save the example counts to %s' % cache_path)
+    return sum(counts[path] for path in files)
+
+
+def num_examples(datasets, dataset_dir=None):
+    """
+    Number of examples of datasets. If dataset_dir is given, the records of
+    the tfrecords are counted (once, see count_examples) instead of using
+    the numbers of the original conversions.
+    """
     _NUM_TRAIN = {
         'lsp': 1000,
         'lsp_ext': 10000,
@@ -38,10 +75,44 @@ def num_examples(datasets):
     use_dict = _NUM_TRAIN
 
     for d in datasets:
-        total += use_dict[d]
+        if dataset_dir is None:
+            total += use_dict[d]
+        else:
+            total += count_examples(
+                data_utils.get_all_files(dataset_dir, [d]),
+                cache_path=join(dataset_dir, _COUNT_CACHE))
     return total
 
 
+def check_precrop_dir(config):
+    """
+    Raises if the crops in config.precrop_dir are too small for the
+    augmentation of config, training from them would then see edge padding
+    where the full images have pixels.
+    """
+    min_size = data_utils.get_precrop_size(config.img_size, config.scale_min,
+                                           config.trans_max)
+    info_path = join(config.precrop_dir, data_utils.PRECROP_INFO)
+    if not exists(info_path):
+        print('No %s, could not check that the crops are at least %d px' %
+              (info_path, min_size))
+        return
+    with open(info_path, 'r') as f:
+        crop_size = json.load(f)['crop_size']
+    if crop_size < min_size:
+        raise Exception(
+            'The crops in %s are %d px, the augmentation needs %d px. '
+            'Pre-crop again with --crop_size %d.' %
+            (config.precrop_dir, crop_size, min_size, min_size))
+
+
+def get_image_dir(config):
+    """
+    Where the image tfrecords are, the pre-cropped ones if given.
+    """
+    return config.precrop_dir or config.data_dir
+
+
 class DataLoader(object):
     def __init__(self, config):
         self.config = config
@@ -49,6 +120,10 @@ class DataLoader(object):
         self.use_3d_label = config.use_3d_label
 
         self.dataset_dir = config.data_dir
+        # Image tfrecords, mocap ones are always in dataset_dir.
+        self.image_dir = get_image_dir(config)
+        if config.precrop_dir:
+            check_precrop_dir(config)
         self.datasets = config.datasets
         self.mocap_datasets = config.mocap_datasets
         self.batch_size = config.batch_size
@@ -59,6 +134,18 @@ class DataLoader(object):
         self.scale_range = [config.scale_min, config.scale_max]
 
         self.image_normalizing_fn = data_utils.rescale_image
+        # Input pipeline:
+        self.num_readers = config.num_readers
+        self.shuffle_buffer = config.shuffle_buffer
+        self.seed = config.data_seed
+        # Sampling mix, per dataset:
+        self.dataset_weights = [float(w) for w in config.dataset_weights]
+        self.shuffle_buffers = [int(b) for b in config.shuffle_buffers]
+        for name, values in [('dataset_weights', self.dataset_weights),
+                             ('shuffle_buffers', self.shuffle_buffers)]:
+            if values and len(values) != len(self.datasets):
+                raise Exception('[!] %s needs one value per dataset (%s)' %
+                                (name, ', '.join(self.datasets)))
 
     def load(self):
         if self.use_3d_label:
@@ -68,36 +155,130 @@ class DataLoader(object):
 
         return image_loader
 
+    def get_dataset(self, files, map_fn, shuffle_buffer, name):
+        """
+        Endless dataset of map_fn(example_serialized, index).
+        The files are shuffled every epoch and num_readers of them are read
+        in parallel. The serialized examples are shuffled before map_fn, so
+        the shuffle buffer holds strings, not decoded images. index counts
+        the examples and seeds the augmentation if data_seed is set.
+        """
+        with tf.name_scope(name):
+            dataset = tf.data.Dataset.from_tensor_slices(files)
+            dataset = dataset.shuffle(len(files), seed=self.seed).repeat()
+            dataset = dataset.interleave(
+                tf.data.TFRecordDataset,
+                cycle_length=min(self.num_readers, len(files)),
+                block_length=1,
+                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            dataset = dataset.shuffle(shuffle_buffer, seed=self.seed)
+            dataset = tf.data.Dataset.zip(
+                (dataset, tf.data.Dataset.range(np.iinfo(np.int64).max)))
+            return dataset.map(
+                map_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+    def batch(self, dataset, batch_size):
+        """
+        Returns the tensors of the next batch of dataset.
+        """
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+        return dataset.make_one_shot_iterator().get_next()
+
+    def get_weights(self, with_3d):
+        """
+        Sampling probability of each dataset: dataset_weights normalized, or
+        by default half from the datasets with 3D labels and half from the
+        rest (like the old paired loader), by size within each half.
+        """
+        if self.dataset_weights:
+            weights = np.array(self.dataset_weights)
+        else:
+            sizes = np.array([
+                num_examples(d, dataset_dir=self.image_dir)
+                for d in self.datasets
+            ], dtype=np.float64)
+            is_3d = np.array([with_3d and d in _3D_DATASETS
+                              for d in self.datasets])
+            weights = np.zeros(len(self.datasets))
+            for group in [is_3d, ~is_3d]:
+                if group.any():
+                    weights[group] = sizes[group] / sizes[group].sum()
+        if weights.sum() <= 0:
+            raise Exception('[!] dataset_weights must not all be 0')
+        return weights / weights.sum()
+
+    def get_source(self, dataset, source_id, shuffle_buffer, with_3d):
+        """
+        Dataset of the examples of one source. With with_3d every source
+        gives (image, label, label3d, has3d), label3d is zeros and has3d
+        False where the source has no 3D labels.
+        """
+        files = data_utils.get_all_files(self.image_dir, [dataset])
+        if len(files) == 0:
+            raise Exception('[!] No tfrecords of %s in %s' %
+                            (dataset, self.image_dir))
+        has_3d = with_3d and dataset in _3D_DATASETS
+
+        def read(example_serialized, index):
+            if not has_3d:
+                image, label = self.read_data(
+                    example_serialized, index, has_3d=False,
+                    source_id=source_id)
+                if not with_3d:
+                    return image, label
+                label3d = tf.zeros([_LABEL3D_DIM])
+                has3d = tf.constant([False, False], dtype=tf.bool)
+                return image, label, label3d, has3d
+            image, label, label3d, has_smpl3d = self.read_data(
+                example_serialized, index, has_3d=True, source_id=source_id)
+            # 3D joint is always available for data with 3d.
+            # has3d column is [3d_joints, 3d_smpl]
+            has3d = tf.concat([[True], has_smpl3d], axis=0)
+            return image, label, label3d, has3d
+
+        return self.get_dataset(files, read, shuffle_buffer,
+                                name='input_%s' % dataset)
+
+    def sample_sources(self, with_3d):
+        """
+        One dataset per source, each read and shuffled on its own, sampled
+        from with get_weights.
+        """
+        weights = self.get_weights(with_3d)
+        num_images = num_examples(self.datasets, dataset_dir=self.image_dir)
+        sources, source_weights = [], []
+        for source_id, (dataset, weight) in enumerate(
+                zip(self.datasets, weights)):
+            size = num_examples(dataset, dataset_dir=self.image_dir)
+            # Per epoch of num_images examples.
+            print('%s: %d examples, weight %.3f, %.2f passes per epoch' %
+                  (dataset, size, weight, weight * num_images / size))
+            if weight == 0:
+                continue
+            shuffle_buffer = (self.shuffle_buffers[source_id]
+                              if self.shuffle_buffers else self.shuffle_buffer)
+            sources.append(self.get_source(dataset, source_id, shuffle_buffer,
+                                           with_3d))
+            source_weights.append(weight)
+        if len(sources) == 1:
+            return sources[0]
+        return tf.data.experimental.sample_from_datasets(
+            sources, weights=source_weights, seed=self.seed)
+
     def get_loader(self):
         """
         Outputs:
           image_batch: batched images as per data_format
           label_batch: batched keypoint labels N x K x 3
         """
-        files = data_utils.get_all_files(self.dataset_dir, self.datasets)
-
-        do_shuffle = True
-        fqueue = tf.train.string_input_producer(
-            files, shuffle=do_shuffle, name="input")
-        image, label = self.read_data(fqueue, has_3d=False)
-        min_after_dequeue = 5000
-        num_threads = 8
-        capacity = min_after_dequeue + 3 * self.batch_size
-
-        pack_these = [image, label]
-        pack_name = ['image', 'label']
-
-        all_batched = tf.train.shuffle_batch(
-            pack_these,
-            batch_size=self.batch_size,
-            num_threads=num_threads,
-            capacity=capacity,
-            min_after_dequeue=min_after_dequeue,
-            enqueue_many=False,
-            name='input_batch_train')
-        batch_dict = {}
-        for name, batch in zip(pack_name, all_batched):
-            batch_dict[name] = batch
+        dataset = self.sample_sources(with_3d=False)
+        image_batch, label_batch = self.batch(dataset, self.batch_size)
+
+        batch_dict = {
+            'image': image_batch,
+            'label': label_batch,
+        }
 
         return batch_dict
 
@@ -116,15 +297,11 @@ class DataLoader(object):
 
         Problem is that those datasets without pose/shape do not have them
         in the tfrecords. There's no way to check for this in TF,
-        so, instead make 2 string_input_producers, one for data without 3d
-        and other for data with 3d.
-        And send [2 x *] to train.*batch
+        so, instead each source fills in zeros and False for what it
+        doesn't have, see get_source.
         """
-        datasets_no3d = [d for d in self.datasets if d not in _3D_DATASETS]
         datasets_yes3d = [d for d in self.datasets if d in _3D_DATASETS]
-
-        files_no3d = data_utils.get_all_files(self.dataset_dir, datasets_no3d)
-        files_yes3d = data_utils.get_all_files(self.dataset_dir,
+        files_yes3d = data_utils.get_all_files(self.image_dir,
                                                datasets_yes3d)
 
         # Make sure we have dataset with 3D.
@@ -133,47 +310,9 @@ class DataLoader(object):
             import ipdb; ipdb.set_trace()
             exit(1)
 
-        do_shuffle = True
-
-        fqueue_yes3d = tf.train.string_input_producer(
-            files_yes3d, shuffle=do_shuffle, name="input_w3d")
-        image, label, label3d, has_smpl3d = self.read_data(
-            fqueue_yes3d, has_3d=True)
-
-        if len(files_no3d) != 0:
-            fqueue_no3d = tf.train.string_input_producer(
-                files_no3d, shuffle=do_shuffle, name="input_wout3d")
-            image_no3d, label_no3d = self.read_data(fqueue_no3d, has_3d=False)
-            label3d_no3d = tf.zeros_like(label3d)
-            image = tf.parallel_stack([image, image_no3d])
-            label = tf.parallel_stack([label, label_no3d])
-            label3d = tf.parallel_stack([label3d, label3d_no3d])
-            # 3D joint is always available for data with 3d.
-            has_3d_joints = tf.constant([True, False], dtype=tf.bool)
-            has_3d_smpl = tf.concat([has_smpl3d, [False]], axis=0)
-        else:
-            # If no "no3d" images, need to make them 1 x *
-            image = tf.expand_dims(image, 0)
-            label = tf.expand_dims(label, 0)
-            label3d = tf.expand_dims(label3d, 0)
-            has_3d_joints = tf.constant([True], dtype=tf.bool)
-            has_3d_smpl = has_smpl3d
-
-        # Combine 3D bools.
-        # each is 2 x 1, column is [3d_joints, 3d_smpl]
-        has_3dgt = tf.stack([has_3d_joints, has_3d_smpl], axis=1)
-
-        min_after_dequeue = 2000
-        capacity = min_after_dequeue + 3 * self.batch_size
-
-        image_batch, label_batch, label3d_batch, bool_batch = tf.train.shuffle_batch(
-            [image, label, label3d, has_3dgt],
-            batch_size=self.batch_size,
-            num_threads=8,
-            capacity=capacity,
-            min_after_dequeue=min_after_dequeue,
-            enqueue_many=True,
-            name='input_batch_train_3d')
+        dataset = self.sample_sources(with_3d=True)
+        image_batch, label_batch, label3d_batch, bool_batch = self.batch(
+            dataset, self.batch_size)
 
         if self.data_format == 'NCHW':
             image_batch = tf.transpose(image_batch, [0, 3, 1, 2])
@@ -194,7 +333,7 @@ class DataLoader(object):
 
     def get_smpl_loader(self):
         """
-        Loads dataset in form of queue, loads shape/pose of smpl.
+        Loads dataset of smpl shape/pose.
         returns a batch of pose & shape
         """
 
@@ -219,34 +358,43 @@ class DataLoader(object):
         files = list of tf records.
         """
         with tf.name_scope('input_smpl_loader'):
-            filename_queue = tf.train.string_input_producer(
-                files, shuffle=True)
-
             mosh_batch_size = self.batch_size * self.config.num_stage
 
-            min_after_dequeue = 1000
-            capacity = min_after_dequeue + 3 * mosh_batch_size
-
-            pose, shape = data_utils.read_smpl_data(filename_queue)
-            pose_batch, shape_batch = tf.train.batch(
-                [pose, shape],
-                batch_size=mosh_batch_size,
-                num_threads=4,
-                capacity=capacity,
-                name='input_smpl_batch')
+            dataset = self.get_dataset(
+                files,
+                lambda example_serialized, _: data_utils.parse_smpl_example(
+                    example_serialized),
+                shuffle_buffer=1000,
+                name='input_smpl')
+            pose_batch, shape_batch = self.batch(dataset, mosh_batch_size)
 
             return pose_batch, shape_batch
 
-    def read_data(self, filename_queue, has_3d=False):
-        with tf.name_scope(None, 'read_data', [filename_queue]):
-            reader = tf.TFRecordReader()
-            _, example_serialized = reader.read(filename_queue)
+    def get_seed(self, index, op_id, source_id=0):
+        """
+        Stateless seed of random op op_id for example index of source
+        source_id, None unless data_seed is set.
+        """
+        if self.seed is None:
+            return None
+        stream = (self.seed * _MAX_SOURCES + source_id) * _NUM_RANDOM_OPS
+        return tf.stack([
+            index,
+            tf.constant(stream + op_id, dtype=tf.int64),
+        ])
+
+    def read_data(self, example_serialized, index, has_3d=False,
+                  source_id=0):
+        with tf.name_scope(None, 'read_data', [example_serialized]):
+            seeds = [self.get_seed(index, op_id, source_id)
+                     for op_id in range(_NUM_RANDOM_OPS)]
             if has_3d:
                 image, image_size, label, center, fname, pose, shape, gt3d, has_smpl3d = data_utils.parse_example_proto(
                     example_serialized, has_3d=has_3d)
                 # Need to send pose bc image can get flipped.
                 image, label, pose, gt3d = self.image_preprocessing(
-                    image, image_size, label, center, pose=pose, gt3d=gt3d)
+                    image, image_size, label, center, pose=pose, gt3d=gt3d,
+                    seeds=seeds)
 
                 # Convert pose to rotation.
                 # Do not ignore the global!!
@@ -261,7 +409,7 @@ class DataLoader(object):
                 image, image_size, label, center, fname = data_utils.parse_example_proto(
                     example_serialized)
                 image, label = self.image_preprocessing(
-                    image, image_size, label, center)
+                    image, image_size, label, center, seeds=seeds)
 
             # label should be K x 3
             label = tf.transpose(label)
@@ -277,7 +425,8 @@ class DataLoader(object):
                             label,
                             center,
                             pose=None,
-                            gt3d=None):
+                            gt3d=None,
+                            seeds=(None, None, None)):
         margin = tf.to_int32(self.output_size / 2)
         with tf.name_scope(None, 'image_preprocessing',
                            [image, image_size, label, center]):
@@ -286,10 +435,12 @@ class DataLoader(object):
 
             # Randomly shift center.
             print('Using translation jitter: %d' % self.trans_max)
-            center = data_utils.jitter_center(center, self.trans_max)
+            center = data_utils.jitter_center(
+                center, self.trans_max, seed=seeds[0])
             # randomly scale image.
             image, keypoints, center = data_utils.jitter_scale(
-                image, image_size, keypoints, center, self.scale_range)
+                image, image_size, keypoints, center, self.scale_range,
+                seed=seeds[1])
 
             # Pad image with safe margin.
             # Extra 50 for safety.
@@ -313,9 +464,10 @@ class DataLoader(object):
 
             if pose is not None:
                 crop, crop_kp, new_pose, new_gt3d = data_utils.random_flip(
-                    crop, crop_kp, pose, gt3d)
+                    crop, crop_kp, pose, gt3d, seed=seeds[2])
             else:
-                crop, crop_kp = data_utils.random_flip(crop, crop_kp)
+                crop, crop_kp = data_utils.random_flip(
+                    crop, crop_kp, seed=seeds[2])
 
             # Normalize kp output to [-1, 1]
             final_vis = tf.cast(crop_kp[2, :] > 0, tf.float32)
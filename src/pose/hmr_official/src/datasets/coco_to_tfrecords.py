@@ -12,7 +12,7 @@ import tensorflow as tf
 
 from pycocotools.coco import COCO
 
-from .common import convert_to_example, ImageCoder, resize_img
+from .common import convert_to_example, resize_img, write_shards
 
 tf.app.flags.DEFINE_string('data_directory', '/scratch1/storage/coco/',
                            'data directory: top of coco')
@@ -24,6 +24,9 @@ tf.app.flags.DEFINE_integer('train_shards', 500,
                             'Number of shards in training TFRecord files.')
 tf.app.flags.DEFINE_integer('validation_shards', 500,
                             'Number of shards in validation TFRecord files.')
+tf.app.flags.DEFINE_integer('num_workers', None,
+                            'Number of conversion processes, all cpus if '
+                            'None.')
 FLAGS = tf.app.flags.FLAGS
 
 joint_names = [
@@ -290,6 +293,14 @@ def add_to_tfrecord(coco, img_id, img_dir, coder, writer, is_train):
     return len(people)
 
 
+def add_image(context, img_id, coder, writer):
+    """
+    write_shards add_fn, context is (coco, img_dir, is_train).
+    """
+    coco, img_dir, is_train = context
+    return add_to_tfrecord(coco, img_id, img_dir, coder, writer, is_train)
+
+
 def process_coco(data_dir, out_dir, num_shards, is_train=True):
 
     if is_train:
@@ -305,33 +316,19 @@ def process_coco(data_dir, out_dir, num_shards, is_train=True):
     # initialize COCO api for person keypoints annotations
     coco = COCO(anno_file)
     catIds = coco.getCatIds(catNms=['person'])
-    img_inds = coco.getImgIds(catIds=catIds)
-    # Only run on  'single person's
-    coder = ImageCoder()
-
-    i = 0
-    # Count on shards
-    fidx = 0
-    num_ppl = 0
-    total_num_ppl = 0
-    while i < len(img_inds):
-        tf_filename = out_path % fidx
-        print('Starting tfrecord file %s' % tf_filename)
-        with tf.python_io.TFRecordWriter(tf_filename) as writer:
-            # Count on total ppl in each shard
-            num_ppl = 0
-            while i < len(img_inds) and num_ppl < num_shards:
-                if i % 100 == 0:
-                    print('Reading img %d/%d' % (i, len(img_inds)))
-                num_ppl += add_to_tfrecord(coco, img_inds[i], img_dir, coder,
-                                           writer, is_train)
-                i += 1
-            total_num_ppl += num_ppl
-
-        fidx += 1
-
-    print('Made %d shards, with total # of people: %d' %
-          (fidx - 1, total_num_ppl))
+    img_inds = sorted(coco.getImgIds(catIds=catIds))
+
+    # Shards have num_shards images each, the number of people varies.
+    total_num_ppl = write_shards(
+        out_path,
+        img_inds,
+        num_shards,
+        add_image,
+        context=(coco, img_dir, is_train),
+        num_workers=FLAGS.num_workers)
+
+    print('Made %d shards, with total # of new people: %d' %
+          ((len(img_inds) + num_shards - 1) // num_shards, total_num_ppl))
 
 
 def main(unused_argv):
@@ -6,20 +6,25 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import cv2
 import tensorflow as tf
 import numpy as np
 
 
-class ImageCoder(object):
+class TFImageCoder(object):
     """Helper class that provides TensorFlow image coding utilities.
     Taken from
     https://github.com/tensorflow/models/blob/master/inception/inception/data/build_image_data.py
+    Every call is a sess.run, prefer CVImageCoder.
     """
 
-    def __init__(self):
+    def __init__(self, sess=None):
         # Create a single Session to run all image coding calls.
-        self._sess = tf.Session()
+        self._sess = tf.Session() if sess is None else sess
+        with self._sess.graph.as_default():
+            self._build()
 
+    def _build(self):
         # Initializes function that converts PNG to JPEG data.
         self._png_data = tf.placeholder(dtype=tf.string)
         image = tf.image.decode_png(self._png_data, channels=3)
@@ -81,6 +86,96 @@ class ImageCoder(object):
         return image
 
 
+class CVImageCoder(object):
+    """
+    Same interface as TFImageCoder, with OpenCV (libjpeg-turbo, libpng) in
+    the calling thread: no session round trip, stateless so thread-safe,
+    and the codecs release the GIL. Images are RGB uint8 like TF's.
+    JPEG quality defaults are TF's (95, and 100 for png_to_jpeg).
+    """
+
+    def png_to_jpeg(self, image_data):
+        return self.encode_jpeg(self.decode_png(image_data), quality=100)
+
+    def _decode(self, image_data):
+        buf = np.frombuffer(image_data, dtype=np.uint8)
+        # TF doesn't apply the EXIF orientation, and the labels are in the
+        # stored (unrotated) frame.
+        image = cv2.imdecode(
+            buf, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            raise Exception('Could not decode image of %d bytes' % len(buf))
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    def _encode(self, ext, image, params):
+        ok, buf = cv2.imencode(ext, cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                               params)
+        if not ok:
+            raise Exception('Could not encode %s' % ext)
+        return buf.tobytes()
+
+    def decode_jpeg(self, image_data):
+        image = self._decode(image_data)
+        assert len(image.shape) == 3
+        assert image.shape[2] == 3
+        return image
+
+    def encode_jpeg(self, image, quality=95):
+        return self._encode('.jpg', image,
+                            [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+
+    def encode_png(self, image):
+        return self._encode('.png', image, [])
+
+    def decode_png(self, image_data):
+        image = self._decode(image_data)
+        assert len(image.shape) == 3
+        assert image.shape[2] == 3
+        return image
+
+
+IMAGE_CODERS = {
+    'opencv': CVImageCoder,
+    'tf': TFImageCoder,
+}
+DEFAULT_IMAGE_CODER = 'opencv'
+
+
+def get_image_coder(name=DEFAULT_IMAGE_CODER, **kwargs):
+    """
+    Returns an image coder of IMAGE_CODERS, kwargs go to its constructor
+    (e.g. sess for 'tf').
+    """
+    if name not in IMAGE_CODERS:
+        raise Exception('Unknown image coder %s, use one of %s' %
+                        (name, ', '.join(sorted(IMAGE_CODERS))))
+    return IMAGE_CODERS[name](**kwargs)
+
+
+# Kept for the old name.
+ImageCoder = TFImageCoder
+
+
+def compare_image_coders(image_datas, coder, reference=None):
+    """
+    Decodes each jpeg of image_datas with coder and reference (TFImageCoder
+    by default) to check they match.
+    Returns:
+      Max absolute pixel difference of each image, 0 if identical.
+    """
+    if reference is None:
+        reference = TFImageCoder()
+    diffs = []
+    for image_data in image_datas:
+        image = coder.decode_jpeg(image_data).astype(np.int16)
+        image_ref = reference.decode_jpeg(image_data).astype(np.int16)
+        if image.shape != image_ref.shape:
+            raise Exception('Decoded shapes differ: %s vs %s' %
+                            (image.shape, image_ref.shape))
+        diffs.append(int(np.abs(image - image_ref).max()))
+    return diffs
+
+
 def int64_feature(value):
     """Wrapper for inserting int64 features into Example proto."""
     if not isinstance(value, list) and not isinstance(value, np.ndarray):
@@ -229,35 +324,147 @@ def resize_img(img, scale_factor):
     return new_img, actual_factor
 
 
-def read_images_from_tfrecords(tf_path, img_size=224, sess=None):
+# State of a write_shards worker process.
+_shard_worker = {}
+
+
+def _init_shard_worker(context, coder_name):
+    _shard_worker['context'] = context
+    # One per process, made after the fork (the tf one has a session).
+    _shard_worker['coder'] = get_image_coder(coder_name)
+
+
+def _write_shard(args):
+    """
+    Writes the examples of items to tf_filename, through a temporary file
+    so tf_filename only exists once complete.
+    """
+    import os
+    add_fn, tf_filename, items = args
+    tmp_filename = '%s.tmp%d' % (tf_filename, os.getpid())
+    num_examples = 0
+    try:
+        with tf.python_io.TFRecordWriter(tmp_filename) as writer:
+            for item in items:
+                num_examples += add_fn(_shard_worker['context'], item,
+                                       _shard_worker['coder'], writer)
+    except:
+        os.remove(tmp_filename)
+        raise
+    os.rename(tmp_filename, tf_filename)
+    return tf_filename, num_examples
+
+
+def write_shards(out_path, items, items_per_shard, add_fn, context=None,
+                 num_workers=None, coder_name=DEFAULT_IMAGE_CODER):
+    """
+    Converts items to the tfrecords out_path % 0, 1, .. with a process pool.
+
+    Shard k has the examples of items[k * items_per_shard:
+    (k + 1) * items_per_shard], whatever the number of workers. Shards are
+    renamed into place when complete and existing shards are skipped, so an
+    interrupted conversion resumes where it stopped.
+
+    Args:
+      out_path: tfrecord path with a %d for the shard index, or the list of
+                the paths of all shards.
+      items: list of whatever add_fn converts, e.g. image ids.
+      items_per_shard: number of items per shard.
+      add_fn: add_fn(context, item, coder, writer) writes the examples of
+              item and returns how many. Module level so the workers get it.
+      context: sent once to each worker for add_fn, e.g. the annotations.
+      num_workers: number of processes, each with its own image coder.
+                   Defaults to the number of cpus.
+      coder_name: image coder of the workers, see get_image_coder.
+    Returns:
+      Number of examples written, not counting skipped shards.
+    """
+    from multiprocessing import Pool
+    from os.path import exists
+
+    shards = []
+    for fidx, start in enumerate(range(0, len(items), items_per_shard)):
+        if isinstance(out_path, list):
+            tf_filename = out_path[fidx]
+        else:
+            tf_filename = out_path % fidx
+        if exists(tf_filename):
+            continue
+        shards.append((add_fn, tf_filename,
+                       items[start:start + items_per_shard]))
+    num_shards = (len(items) + items_per_shard - 1) // items_per_shard
+    print('Writing %d/%d shards, %d already done' %
+          (len(shards), num_shards, num_shards - len(shards)))
+
+    num_examples = 0
+    pool = Pool(num_workers, _init_shard_worker, (context, coder_name))
+    try:
+        for i, (tf_filename, num_shard_examples) in enumerate(
+                pool.imap_unordered(_write_shard, shards)):
+            print('%d/%d wrote %s, %d examples' %
+                  (i + 1, len(shards), tf_filename, num_shard_examples))
+            num_examples += num_shard_examples
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return num_examples
+
+
+def crop_image(image, center, crop_size, out=None):
+    """
+    Crops crop_size x crop_size around center, repeating the border pixels
+    where the crop leaves the image (same as np.pad(mode='edge') and then
+    cropping), without padding the whole image.
+    """
+    top_left = np.array(center) - crop_size // 2
+    rows = np.clip(np.arange(top_left[1], top_left[1] + crop_size), 0,
+                   image.shape[0] - 1)
+    cols = np.clip(np.arange(top_left[0], top_left[0] + crop_size), 0,
+                   image.shape[1] - 1)
+    if out is None:
+        return image[np.ix_(rows, cols)]
+    out[...] = image[np.ix_(rows, cols)]
+    return out
+
+
+def read_images_from_tfrecords(tf_path, img_size=224, sess=None,
+                               num_threads=8, normalize=True, coder=None):
     """
     Returns image, kp, and gt3d from the tf_paths
 
     This returns a preprocessed image, cropped around img_size.
+    The jpegs are decoded by num_threads threads, which crop and normalize
+    them straight into one float32 N x img_size x img_size x 3 array.
+    If normalize is False, the crops are left as uint8 in [0, 255].
+    coder is an image coder or its name (see get_image_coder), sess is only
+    used by the 'tf' one.
     """
+    from multiprocessing.pool import ThreadPool
     from time import time
     from os.path import exists
     if not exists(tf_path):
         print('%s doesnt exist!' % tf_path)
         exit(1)
 
-    if sess is None:
-        sess = tf.Session()
+    if coder is None or isinstance(coder, str):
+        coder_name = coder or DEFAULT_IMAGE_CODER
+        kwargs = {'sess': sess} if coder_name == 'tf' else {}
+        coder = get_image_coder(coder_name, **kwargs)
 
     t0 = time()
-    all_images, all_kps, all_gt3ds = [], [], []
+    all_image_data, all_centers, all_kps, all_gt3ds = [], [], [], []
 
-    itr = 0
-
-    # Decode op graph
-    image_data_pl = tf.placeholder(dtype=tf.string)
-    decode_op = tf.image.decode_jpeg(image_data_pl)
+    # Same crop size as padding by margin on both sides.
+    margin = int(img_size/2)
+    crop_size = 2 * margin
 
     for serialized_ex in tf.python_io.tf_record_iterator(tf_path):
         example = tf.train.Example()
         example.ParseFromString(serialized_ex)
         image_data = example.features.feature['image/encoded'].bytes_list.value[0]
-        image = sess.run(decode_op, feed_dict={image_data_pl:  image_data})
 
         x = example.features.feature['image/x'].float_list.value
         y = example.features.feature['image/y'].float_list.value
@@ -269,37 +476,41 @@ def read_images_from_tfrecords(tf_path, img_size=224, sess=None):
         vis = np.array(vis, dtype='bool')
         center = np.array(center)
 
-        # Crop img_size.
-        # Pad in case.
-        margin = int(img_size/2)
-        image_pad = np.pad(image, ((margin,), (margin,), (0,)), mode='edge')
-
-        # figure out starting point
-        start_pt = center
-        end_pt = center + 2*margin
-
-        x_crop = x + margin - start_pt[0]
-        y_crop = y + margin - start_pt[1]
+        # Keypoints in the crop, which starts at center - margin.
+        x_crop = x + margin - center[0]
+        y_crop = y + margin - center[1]
         kp_crop = np.vstack([x_crop, y_crop])
         kp_final = 2 * (kp_crop / img_size) - 1
         kp_final = np.vstack((vis * kp_final, vis)).T
-        # crop:
-        crop = image_pad[start_pt[1]:end_pt[1], start_pt[0]:end_pt[0], :]
-        
-        # Normalize image to [-1, 1]
-        crop = 2 * ((crop / 255.) - 0.5)
 
         # Note: This says mosh but gt3d is the gt H3.6M joints & not from mosh.
         gt3d = example.features.feature['mosh/gt3d'].float_list.value
         gt3d = np.array(gt3d).reshape(-1, 3)
 
-        all_images.append(crop)
+        all_image_data.append(image_data)
+        all_centers.append(center)
         all_kps.append(kp_final)
         all_gt3ds.append(gt3d)
 
-        itr += 1
+    images = np.empty((len(all_image_data), crop_size, crop_size, 3),
+                      dtype=np.float32 if normalize else np.uint8)
+
+    def decode_crop(i):
+        image = coder.decode_jpeg(all_image_data[i])
+        crop = crop_image(image, all_centers[i], crop_size, out=images[i])
+        if normalize:
+            # Normalize image to [-1, 1]
+            crop *= 2 / 255.
+            crop -= 1
+
+    # Decoding releases the GIL, so threads run in parallel.
+    pool = ThreadPool(num_threads)
+    try:
+        pool.map(decode_crop, range(len(images)))
+    finally:
+        pool.close()
+        pool.join()
 
-    images = np.stack(all_images)
     kps = np.stack(all_kps)
     gt3ds = np.stack(all_gt3ds)
 
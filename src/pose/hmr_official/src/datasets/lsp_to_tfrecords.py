@@ -15,7 +15,7 @@ import numpy as np
 
 import tensorflow as tf
 
-from .common import convert_to_example, ImageCoder
+from .common import convert_to_example, write_shards
 
 tf.app.flags.DEFINE_string('img_directory',
                            '/scratch1/storage/human_datasets/lsp_dataset',
@@ -28,6 +28,9 @@ tf.app.flags.DEFINE_integer('train_shards', 500,
                             'Number of shards in training TFRecord files.')
 tf.app.flags.DEFINE_integer('validation_shards', 500,
                             'Number of shards in validation TFRecord files.')
+tf.app.flags.DEFINE_integer('num_workers', None,
+                            'Number of conversion processes, all cpus if '
+                            'None.')
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -72,34 +75,30 @@ def _add_to_tfrecord(image_path, label, coder, writer, is_lsp_ext=False):
     writer.write(example.SerializeToString())
 
 
+def add_image(is_lsp_ext, item, coder, writer):
+    """
+    write_shards add_fn, item is (image_path, label).
+    """
+    image_path, label = item
+    _add_to_tfrecord(image_path, label, coder, writer, is_lsp_ext=is_lsp_ext)
+    return 1
+
+
 def package(img_paths, labels, out_path, num_shards):
     """
     packages the images and labels into multiple tfrecords.
     """
     is_lsp_ext = True if len(img_paths) == 10000 else False
-    coder = ImageCoder()
-
-    i = 0
-    fidx = 0
-    while i < len(img_paths):
-        # Open new TFRecord file.
-        tf_filename = out_path % fidx
-        print('Starting tfrecord file %s' % tf_filename)
-        with tf.python_io.TFRecordWriter(tf_filename) as writer:
-            j = 0
-            while i < len(img_paths) and j < num_shards:
-                if i % 100 == 0:
-                    print('Converting image %d/%d' % (i, len(img_paths)))
-                _add_to_tfrecord(
-                    img_paths[i],
-                    labels[:, :, i],
-                    coder,
-                    writer,
-                    is_lsp_ext=is_lsp_ext)
-                i += 1
-                j += 1
-
-        fidx += 1
+    items = [(img_path, labels[:, :, i])
+             for i, img_path in enumerate(img_paths)]
+
+    write_shards(
+        out_path,
+        items,
+        num_shards,
+        add_image,
+        context=is_lsp_ext,
+        num_workers=FLAGS.num_workers)
 
 
 def load_mat(fname):
@@ -10,7 +10,7 @@ import numpy as np
 
 import tensorflow as tf
 
-from .common import convert_to_example_wmosh, ImageCoder, resize_img
+from .common import convert_to_example_wmosh, resize_img, write_shards
 from .mpi_inf_3dhp.read_mpi_inf_3dhp import get_paths, read_mat, mpi_inf_3dhp_to_lsp_idx, read_camera
 
 tf.app.flags.DEFINE_string('data_directory', '/scratch1/storage/mpi_inf_3dhp/',
@@ -22,6 +22,9 @@ tf.app.flags.DEFINE_string('output_directory',
 tf.app.flags.DEFINE_string('split', 'train', 'train or trainval')
 tf.app.flags.DEFINE_integer('train_shards', 500,
                             'Number of shards in training TFRecord files.')
+tf.app.flags.DEFINE_integer('num_workers', None,
+                            'Number of conversion processes, all cpus if '
+                            'None.')
 
 FLAGS = tf.app.flags.FLAGS
 MIN_VIS_PTS = 8  # This many points must be within the image.
@@ -183,32 +186,22 @@ def add_to_tfrecord(im_path,
     return True
 
 
+def add_frame(context, item, coder, writer):
+    """
+    write_shards add_fn, item is (im_path, gt2d, gt3d, cam).
+    """
+    im_path, gt2d, gt3d, cam = item
+    return int(add_to_tfrecord(im_path, gt2d, gt3d, cam, coder, writer))
+
+
 def save_to_tfrecord(out_name, im_paths, gt2ds, gt3ds, cams, num_shards):
-    coder = ImageCoder()
-    i = 0
-    # Count on shards
-    fidx = 0
-    # Count failures
-    num_bad = 0
-    while i < len(im_paths):
-        tf_filename = out_name % fidx
-        print('Starting tfrecord file %s' % tf_filename)
-        with tf.python_io.TFRecordWriter(tf_filename) as writer:
-            j = 0
-            while i < len(im_paths) and j < num_shards:
-                if i % 100 == 0:
-                    print('Reading img %d/%d' % (i, len(im_paths)))
-                success = add_to_tfrecord(im_paths[i], gt2ds[i], gt3ds[i],
-                                          cams[i], coder, writer)
-                i += 1
-                if success:
-                    j += 1
-                else:
-                    num_bad += 1
-
-        fidx += 1
-
-    print('Done, wrote to %s, num skipped %d' % (out_name, num_bad))
+    # Shards have num_shards frames each, less the skipped ones.
+    items = list(zip(im_paths, gt2ds, gt3ds, cams))
+    num_good = write_shards(
+        out_name, items, num_shards, add_frame,
+        num_workers=FLAGS.num_workers)
+
+    print('Done, wrote %d new examples to %s' % (num_good, out_name))
 
 
 def process_mpi_inf_3dhp_train(data_dir, out_dir, is_train=False):
@@ -255,7 +248,8 @@ def process_mpi_inf_3dhp_train(data_dir, out_dir, is_train=False):
     all_cams = np.vstack(all_cams)
     assert (all_gt3ds.shape[0] == len(all_img_paths))
     # Now shuffle it all.
-    shuffle_id = np.random.permutation(len(all_img_paths))
+    # Seeded, so a resumed conversion puts the same frames in each shard.
+    shuffle_id = np.random.RandomState(0).permutation(len(all_img_paths))
     all_img_paths = np.array(all_img_paths)[shuffle_id]
     all_gt2ds = all_gt2ds[shuffle_id]
     all_gt3ds = all_gt3ds[shuffle_id]
@@ -13,7 +13,7 @@ import numpy as np
 
 import tensorflow as tf
 
-from .common import convert_to_example, ImageCoder, resize_img
+from .common import convert_to_example, resize_img, write_shards
 
 tf.app.flags.DEFINE_string('img_directory',
                            '/scratch1/storage/human_datasets/mpii',
@@ -26,6 +26,9 @@ tf.app.flags.DEFINE_integer('train_shards', 500,
                             'Number of shards in training TFRecord files.')
 tf.app.flags.DEFINE_integer('validation_shards', 500,
                             'Number of shards in validation TFRecord files.')
+tf.app.flags.DEFINE_integer('num_workers', None,
+                            'Number of conversion processes, all cpus if '
+                            'None.')
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -232,6 +235,14 @@ def add_to_tfrecord(anno, img_id, img_dir, coder, writer, is_train):
     return len(people)
 
 
+def add_image(context, img_id, coder, writer):
+    """
+    write_shards add_fn, context is (anno, img_dir, is_train).
+    """
+    anno, img_dir, is_train = context
+    return add_to_tfrecord(anno, img_id, img_dir, coder, writer, is_train)
+
+
 def process_mpii(anno, img_dir, out_dir, num_shards, is_train=True):
     all_ids = np.array(range(len(anno.annolist)))
     if is_train:
@@ -247,29 +258,15 @@ def process_mpii(anno, img_dir, out_dir, num_shards, is_train=True):
     # If there's only 1 person in the image, annorect is not an array
     # So just go over each image, and add every single_person in that image
     # add_to_tfrecords returns the # of ppl added.
-    # So it's possible some shards go over the limit but this is ok.
-
-    coder = ImageCoder()
-
-    i = 0
-    # Count on shards
-    fidx = 0
-    num_ppl = 0
-    while i < len(img_inds):
-
-        tf_filename = out_path % fidx
-        print('Starting tfrecord file %s' % tf_filename)
-        with tf.python_io.TFRecordWriter(tf_filename) as writer:
-            # Count on total ppl in each shard
-            num_ppl = 0
-            while i < len(img_inds) and num_ppl < num_shards:
-                if i % 100 == 0:
-                    print('Reading img %d/%d' % (i, len(img_inds)))
-                num_ppl += add_to_tfrecord(anno, img_inds[i], img_dir, coder,
-                                           writer, is_train)
-                i += 1
-
-        fidx += 1
+    # Shards have num_shards images each, so the number of ppl varies.
+    num_ppl = write_shards(
+        out_path,
+        list(img_inds),
+        num_shards,
+        add_image,
+        context=(anno, img_dir, is_train),
+        num_workers=FLAGS.num_workers)
+    print('Total # of new people: %d' % num_ppl)
 
 
 def main(unused_argv):
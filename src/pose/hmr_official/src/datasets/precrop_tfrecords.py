@@ -0,0 +1,155 @@
+"""
+Pre-crops converted training tfrecords around each person.
+
+The converters store every person in a large image (up to 600x600 for
+MPII), which the trainer decodes, rescales and pads on every step before
+cropping 224x224. This rewrites each example with a fixed crop_size x
+crop_size crop (edge padded) around its center. It keeps the example
+format, with the keypoints, face points, center, crop point and camera
+shifted to match. So the trainer reads the output unchanged, with
+--precrop_dir set to the output directory.
+
+The crop has to hold everything the augmentation can look at, up to
+img_size / 2 / scale_min + trans_max = 160px from the center by default.
+So crop_size defaults to the smallest size that does (322 with the
+training defaults, see data_utils.get_precrop_size), and smaller sizes
+are refused. The size is saved in precrop.json, and the DataLoader checks
+it against its own augmentation flags.
+
+Sample usage:
+python -m src.datasets.precrop_tfrecords --data_directory <tf_datasets> \
+    --output_directory <tf_datasets_precrop> --datasets lsp,mpii,coco
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from os import makedirs
+from os.path import dirname, exists, join, relpath
+import json
+
+import numpy as np
+
+import tensorflow as tf
+
+from .common import crop_image, write_shards
+from ..util.data_utils import PRECROP_INFO, get_all_files, get_precrop_size
+
+tf.app.flags.DEFINE_string('data_directory',
+                           '/scratch1/projects/tf_datasets/',
+                           'data directory: top of the training tfrecords')
+tf.app.flags.DEFINE_string('output_directory',
+                           '/scratch1/projects/tf_datasets_precrop/',
+                           'Output data directory, same layout')
+tf.app.flags.DEFINE_list('datasets',
+                         ['lsp', 'lsp_ext', 'mpii', 'coco', 'mpi_inf_3dhp',
+                          'h36m'],
+                         'datasets to pre-crop')
+tf.app.flags.DEFINE_integer('crop_size', None,
+                            'Side of the stored crops, the smallest that '
+                            'covers the augmentation if None')
+# Augmentation the crops are for, same flags and defaults as config.py.
+tf.app.flags.DEFINE_integer('img_size', 224, 'Input image size to the network')
+tf.app.flags.DEFINE_integer('trans_max', 20, 'Value to jitter translation')
+tf.app.flags.DEFINE_float('scale_min', 0.8, 'Min value of scale jitter')
+tf.app.flags.DEFINE_integer('num_workers', None,
+                            'Number of conversion processes, all cpus if '
+                            'None.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def _shift_floats(feature, offset, start=0, num=None):
+    values = np.array(feature.float_list.value)
+    end = len(values) if num is None else start + num
+    values[start:end] += offset
+    feature.float_list.value[:] = values.tolist()
+
+
+def precrop_example(example, coder, crop_size):
+    """
+    Crops the image of example (tf.train.Example) in place.
+    """
+    features = example.features.feature
+    margin = crop_size // 2
+    image = coder.decode_jpeg(features['image/encoded'].bytes_list.value[0])
+    center = np.array(features['image/center'].int64_list.value)
+    crop = crop_image(image, center, 2 * margin)
+    # Everything moves by the top left corner of the crop.
+    start_pt = center - margin
+
+    features['image/encoded'].bytes_list.value[:] = [coder.encode_jpeg(crop)]
+    features['image/height'].int64_list.value[:] = [crop.shape[0]]
+    features['image/width'].int64_list.value[:] = [crop.shape[1]]
+    features['image/center'].int64_list.value[:] = [margin, margin]
+    _shift_floats(features['image/x'], -start_pt[0])
+    _shift_floats(features['image/y'], -start_pt[1])
+    if 'image/face_pts' in features:
+        # 3 x 5 raveled: x, y, visibility.
+        _shift_floats(features['image/face_pts'], -start_pt[0], 0, 5)
+        _shift_floats(features['image/face_pts'], -start_pt[1], 5, 5)
+    if 'meta/crop_pt' in features:
+        crop_pt = np.array(features['meta/crop_pt'].int64_list.value)
+        features['meta/crop_pt'].int64_list.value[:] = (
+            crop_pt + start_pt).tolist()
+    if 'image/cam' in features:
+        # Principal point: [f, px, py].
+        _shift_floats(features['image/cam'], -start_pt[0], 1, 1)
+        _shift_floats(features['image/cam'], -start_pt[1], 2, 1)
+    return example
+
+
+def add_tfrecord(crop_size, tf_path, coder, writer):
+    """
+    write_shards add_fn, writes the pre-cropped examples of tf_path.
+    """
+    num_examples = 0
+    for serialized_ex in tf.python_io.tf_record_iterator(tf_path):
+        example = tf.train.Example()
+        example.ParseFromString(serialized_ex)
+        precrop_example(example, coder, crop_size)
+        writer.write(example.SerializeToString())
+        num_examples += 1
+    return num_examples
+
+
+def main(unused_argv):
+    print('Saving results to %s' % FLAGS.output_directory)
+
+    min_size = get_precrop_size(FLAGS.img_size, FLAGS.scale_min,
+                                FLAGS.trans_max)
+    crop_size = FLAGS.crop_size or min_size
+    if crop_size < min_size:
+        raise Exception('crop_size %d is smaller than the %d px the '
+                        'augmentation needs' % (crop_size, min_size))
+
+    tf_paths = get_all_files(FLAGS.data_directory, FLAGS.datasets)
+    out_paths = [
+        join(FLAGS.output_directory, relpath(tf_path, FLAGS.data_directory))
+        for tf_path in tf_paths
+    ]
+    for out_dir in set(dirname(out_path) for out_path in out_paths):
+        if not exists(out_dir):
+            makedirs(out_dir)
+
+    # One output tfrecord per input tfrecord, with the same name.
+    num_examples = write_shards(
+        out_paths,
+        tf_paths,
+        1,
+        add_tfrecord,
+        context=crop_size,
+        num_workers=FLAGS.num_workers)
+    print('Pre-cropped %d new examples' % num_examples)
+
+    with open(join(FLAGS.output_directory, PRECROP_INFO), 'w') as f:
+        json.dump({
+            'crop_size': crop_size,
+            'img_size': FLAGS.img_size,
+            'trans_max': FLAGS.trans_max,
+            'scale_min': FLAGS.scale_min,
+        }, f, indent=1)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -8,7 +8,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from .data_loader import num_examples
+from .data_loader import get_image_dir, num_examples
 
 from .ops import keypoint_l1_loss, compute_3d_loss, align_by_pelvis
 from .models import Discriminator_separable_rotations, get_encoder_fn_separate
@@ -65,7 +65,8 @@ class HMRTrainer(object):
         self.total_params = self.num_theta + self.num_cam + 10
 
         # Data
-        num_images = num_examples(config.datasets)
+        num_images = num_examples(
+            config.datasets, dataset_dir=get_image_dir(config))
         num_mocap = num_examples(config.mocap_datasets)
 
         self.num_itr_per_epoch = num_images / self.batch_size
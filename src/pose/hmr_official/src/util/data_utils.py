@@ -4,9 +4,13 @@ Utils for data loading for training.
 
 from os.path import join
 from glob import glob
+import math
 
 import tensorflow as tf
 
+# Written next to pre-cropped tfrecords, see datasets/precrop_tfrecords.py.
+PRECROP_INFO = 'precrop.json'
+
 
 def parse_example_proto(example_serialized, has_3d=False):
     """Parses an Example proto.
@@ -133,27 +137,33 @@ def get_all_files(dataset_dir, datasets, split='train'):
     return all_files
 
 
-def read_smpl_data(filename_queue):
+def parse_smpl_example(example_serialized):
     """
     Parses a smpl Example proto.
     It's contents are:
         'pose'  : 72-D float
         'shape' : 10-D float
     """
-    with tf.name_scope(None, 'read_smpl_data', [filename_queue]):
-        reader = tf.TFRecordReader()
-        _, example_serialized = reader.read(filename_queue)
+    feature_map = {
+        'pose': tf.FixedLenFeature((72, ), dtype=tf.float32),
+        'shape': tf.FixedLenFeature((10, ), dtype=tf.float32)
+    }
+
+    features = tf.parse_single_example(example_serialized, feature_map)
+    pose = tf.cast(features['pose'], dtype=tf.float32)
+    shape = tf.cast(features['shape'], dtype=tf.float32)
 
-        feature_map = {
-            'pose': tf.FixedLenFeature((72, ), dtype=tf.float32),
-            'shape': tf.FixedLenFeature((10, ), dtype=tf.float32)
-        }
+    return pose, shape
 
-        features = tf.parse_single_example(example_serialized, feature_map)
-        pose = tf.cast(features['pose'], dtype=tf.float32)
-        shape = tf.cast(features['shape'], dtype=tf.float32)
 
-        return pose, shape
+def read_smpl_data(filename_queue):
+    """
+    parse_smpl_example of the next record of filename_queue.
+    """
+    with tf.name_scope(None, 'read_smpl_data', [filename_queue]):
+        reader = tf.TFRecordReader()
+        _, example_serialized = reader.read(filename_queue)
+        return parse_smpl_example(example_serialized)
 
 
 def decode_jpeg(image_buffer, name=None):
@@ -176,20 +186,41 @@ def decode_jpeg(image_buffer, name=None):
         return image
 
 
-def jitter_center(center, trans_max):
+def random_uniform(shape, minval, maxval, dtype=tf.float32, seed=None):
+    """
+    tf.random_uniform, or if seed (2-vector int tensor) is given its stateless
+    version, which gives the same numbers for the same seed whatever the
+    order the ops run in.
+    """
+    if seed is None:
+        return tf.random_uniform(
+            shape, minval=minval, maxval=maxval, dtype=dtype)
+    if dtype.is_integer:
+        # Same as the int version: uniform in [minval, maxval).
+        values = tf.random.stateless_uniform(
+            shape, seed=seed, minval=float(minval), maxval=float(maxval))
+        return tf.cast(tf.floor(values), dtype)
+    return tf.random.stateless_uniform(
+        shape, seed=seed, minval=minval, maxval=maxval, dtype=dtype)
+
+
+def jitter_center(center, trans_max, seed=None):
     with tf.name_scope(None, 'jitter_center', [center, trans_max]):
-        rand_trans = tf.random_uniform(
-            [2, 1], minval=-trans_max, maxval=trans_max, dtype=tf.int32)
+        rand_trans = random_uniform(
+            [2, 1], minval=-trans_max, maxval=trans_max, dtype=tf.int32,
+            seed=seed)
         return center + rand_trans
 
 
-def jitter_scale(image, image_size, keypoints, center, scale_range):
+def jitter_scale(image, image_size, keypoints, center, scale_range,
+                 seed=None):
     with tf.name_scope(None, 'jitter_scale', [image, image_size, keypoints]):
-        scale_factor = tf.random_uniform(
+        scale_factor = random_uniform(
             [1],
             minval=scale_range[0],
             maxval=scale_range[1],
-            dtype=tf.float32)
+            dtype=tf.float32,
+            seed=seed)
         new_size = tf.to_int32(tf.to_float(image_size) * scale_factor)
         new_image = tf.image.resize_images(image, new_size)
 
@@ -206,6 +237,17 @@ def jitter_scale(image, image_size, keypoints, center, scale_range):
             tf.stack([cx, cy]), tf.int32)
 
 
+def get_precrop_size(img_size, scale_min, trans_max):
+    """
+    Smallest side of the pre-cropped images (datasets/precrop_tfrecords.py)
+    that holds every crop the augmentation can take. The crop reaches
+    img_size / 2 scaled pixels from a center jittered by up to trans_max,
+    and the scale is at least scale_min.
+    """
+    # + 1 for the int casts of the scaled size and center.
+    return 2 * (int(math.ceil(trans_max + img_size / 2. / scale_min)) + 1)
+
+
 def pad_image_edge(image, margin):
     """ Pads image in each dimension by margin, in numpy:
     image_pad = np.pad(image,
@@ -237,12 +279,12 @@ def pad_image_edge(image, margin):
         return image
 
 
-def random_flip(image, kp, pose=None, gt3d=None):
+def random_flip(image, kp, pose=None, gt3d=None, seed=None):
     """
     mirrors image L/R and kp, also pose if supplied
     """
 
-    uniform_random = tf.random_uniform([], 0, 1.0)
+    uniform_random = random_uniform([], 0, 1.0, seed=seed)
     mirror_cond = tf.less(uniform_random, .5)
 
     if pose is not None:
@@ -0,0 +1,146 @@
+"""
+CVImageCoder against TFImageCoder, on JPEGs and PNGs made here: color
+at a few qualities, grayscale and one with an EXIF orientation tag.
+
+TF decodes JPEGs with its IFAST DCT by default and OpenCV with ISLOW, so
+JPEG pixels may differ by a few levels. PNGs must match exactly.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from src.datasets.common import (CVImageCoder, TFImageCoder,  # noqa: E402
+                                 compare_image_coders)
+
+JPEG_MAX_DIFF = 8
+JPEG_MEAN_DIFF = 1.
+
+
+def make_image(height, width, channels=3, seed=0):
+    """
+    Smooth gradients plus noise, uint8.
+    """
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[:height, :width]
+    image = np.stack([
+        128 + 100 * np.sin(x / 7. + c) * np.cos(y / 11. - c)
+        for c in range(channels)
+    ], axis=2) + rng.randn(height, width, channels) * 10
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def imencode(ext, image, params=()):
+    ok, buf = cv2.imencode(ext, image, list(params))
+    assert ok
+    return buf.tobytes()
+
+
+def add_exif_orientation(jpeg_data, orientation):
+    """
+    Inserts an APP1 Exif segment with only the Orientation tag after SOI.
+    """
+    # Big endian TIFF header, one IFD entry: tag 0x0112, SHORT, count 1.
+    tiff = (b'MM\x00\x2a' + struct.pack('>I', 8) + struct.pack('>H', 1) +
+            struct.pack('>HHIHH', 0x0112, 3, 1, orientation, 0) +
+            struct.pack('>I', 0))
+    payload = b'Exif\x00\x00' + tiff
+    app1 = b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+    return jpeg_data[:2] + app1 + jpeg_data[2:]
+
+
+@pytest.fixture(scope='module')
+def coders():
+    with tf.Graph().as_default():
+        reference = TFImageCoder()
+        yield CVImageCoder(), reference
+        reference._sess.close()
+
+
+def get_jpegs():
+    color = cv2.cvtColor(make_image(120, 160), cv2.COLOR_RGB2BGR)
+    gray = make_image(90, 70, channels=1)[:, :, 0]
+    jpegs = {}
+    for quality in [50, 95, 100]:
+        jpegs['color_q%d' % quality] = imencode(
+            '.jpg', color, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    jpegs['gray'] = imencode('.jpg', gray)
+    # Landscape as stored, portrait if the orientation were applied.
+    jpegs['exif_rotated'] = add_exif_orientation(
+        imencode('.jpg', make_image(40, 80)), 6)
+    return jpegs
+
+
+JPEGS = get_jpegs()
+
+
+@pytest.mark.parametrize('name', sorted(JPEGS))
+def test_decode_jpeg(coders, name):
+    coder, reference = coders
+    image_data = JPEGS[name]
+    image = coder.decode_jpeg(image_data)
+    image_ref = reference.decode_jpeg(image_data)
+    assert image.dtype == np.uint8
+    assert image.shape == image_ref.shape
+    diff = np.abs(image.astype(np.int16) - image_ref)
+    assert diff.max() <= JPEG_MAX_DIFF
+    assert diff.mean() <= JPEG_MEAN_DIFF
+    assert compare_image_coders([image_data], coder, reference) == \
+        [diff.max()]
+
+
+def test_exif_orientation_ignored(coders):
+    coder, _ = coders
+    image_data = JPEGS['exif_rotated']
+    # The tag is there: plain IMREAD_COLOR rotates to portrait.
+    rotated = cv2.imdecode(np.frombuffer(image_data, np.uint8),
+                           cv2.IMREAD_COLOR)
+    assert rotated.shape == (80, 40, 3)
+    assert coder.decode_jpeg(image_data).shape == (40, 80, 3)
+
+
+@pytest.mark.parametrize('channels', [1, 3, 4])
+def test_decode_png(coders, channels):
+    coder, reference = coders
+    image = make_image(50, 60, channels=channels)
+    if channels == 1:
+        image = image[:, :, 0]
+    image_data = imencode('.png', image)
+    decoded = coder.decode_png(image_data)
+    assert decoded.shape == (50, 60, 3)
+    np.testing.assert_array_equal(decoded, reference.decode_png(image_data))
+
+
+def test_encode_jpeg(coders):
+    coder, reference = coders
+    image = make_image(64, 48)
+    # Each coder's JPEG decodes close to the other's.
+    for encoder in [coder, reference]:
+        image_data = encoder.encode_jpeg(image)
+        diff = np.abs(reference.decode_jpeg(image_data).astype(np.int16) -
+                      coder.decode_jpeg(image_data))
+        assert diff.max() <= JPEG_MAX_DIFF
+    # Both keep the RGB order.
+    red = np.zeros((16, 16, 3), dtype=np.uint8)
+    red[:, :, 0] = 255
+    for encoder in [coder, reference]:
+        decoded = reference.decode_jpeg(encoder.encode_jpeg(red))
+        assert decoded[:, :, 0].min() > 200
+        assert decoded[:, :, 2].max() < 50
+
+
+def test_png_to_jpeg(coders):
+    coder, reference = coders
+    image_data = imencode('.png', cv2.cvtColor(make_image(40, 40),
+                                               cv2.COLOR_RGB2BGR))
+    diff = np.abs(
+        reference.decode_jpeg(coder.png_to_jpeg(image_data)).astype(np.int16)
+        - reference.decode_jpeg(reference.png_to_jpeg(image_data)))
+    assert diff.max() <= JPEG_MAX_DIFF
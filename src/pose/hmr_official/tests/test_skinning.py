@@ -0,0 +1,130 @@
+"""
+Parity of the top-k sparse LBS skinning with dense skinning, for the
+NumPy (np_smpl) and TF (batch_smpl) SMPL.
+
+The models are synthetic SMPL pkls with the real layout (24 joints, 10
+betas, 207 pose basis) and a few hundred vertices, each skinned to 6
+joints with decaying weights, so dropping weights has a known effect.
+
+Run from src/pose/hmr_official:
+python -m pytest
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pickle
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from src.tf_smpl.np_smpl import (NumpySMPL, batch_rodrigues,
+                                 batch_global_rigid_transformation,
+                                 sparse_skinning, topk_skinning_weights)
+
+NUM_VERTS = 300
+# Non-zero weights per vertex of the synthetic model.
+VERT_WEIGHTS = np.array([0.55, 0.25, 0.1, 0.05, 0.03, 0.02])
+SMPL_PARENTS = [-1, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 12, 13, 14,
+                16, 17, 18, 19, 20, 21]
+# Largest vertex error allowed per k, for vertices within about 1 of the
+# origin. The weights of a vertex go to random joints, so dropping some is
+# worse than on SMPL. Keeping all the non-zero weights is exact up to
+# rounding.
+TOLERANCES = {1: 0.75, 2: 0.5, 4: 0.1, 6: 1e-12, 24: 1e-12}
+
+
+def make_smpl_dict(seed=0):
+    rng = np.random.RandomState(seed)
+    weights = np.zeros((NUM_VERTS, 24))
+    for v in range(NUM_VERTS):
+        weights[v, rng.choice(24, len(VERT_WEIGHTS), replace=False)] = \
+            VERT_WEIGHTS
+    J_regressor = rng.rand(24, NUM_VERTS) * (rng.rand(24, NUM_VERTS) < 0.1)
+    J_regressor /= J_regressor.sum(axis=1, keepdims=True)
+    cocoplus = rng.rand(19, NUM_VERTS) * (rng.rand(19, NUM_VERTS) < 0.1)
+    cocoplus /= cocoplus.sum(axis=1, keepdims=True)
+    return {
+        'v_template': rng.randn(NUM_VERTS, 3) * 0.3,
+        'shapedirs': rng.randn(NUM_VERTS, 3, 10) * 0.01,
+        'posedirs': rng.randn(NUM_VERTS, 3, 207) * 0.01,
+        'J_regressor': sp.csc_matrix(J_regressor),
+        'cocoplus_regressor': sp.csc_matrix(cocoplus),
+        'kintree_table': np.array([SMPL_PARENTS, list(range(24))]),
+        'weights': weights,
+    }
+
+
+@pytest.fixture(scope='module')
+def smpl_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('smpl').joinpath('smpl.pkl')
+    with open(str(path), 'wb') as f:
+        pickle.dump(make_smpl_dict(), f, protocol=2)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def params():
+    rng = np.random.RandomState(1)
+    betas = rng.randn(5, 10)
+    thetas = rng.randn(5, 72) * 0.5
+    return betas, thetas
+
+
+@pytest.mark.parametrize('k', sorted(TOLERANCES))
+def test_sparse_skinning(smpl_path, params, k):
+    dd = make_smpl_dict()
+    _, thetas = params
+    Rs = batch_rodrigues(thetas.reshape(-1, 3)).reshape(-1, 24, 3, 3)
+    Js = np.tile(np.matmul(dd['J_regressor'].toarray(),
+                           dd['v_template'])[None], [len(Rs), 1, 1])
+    _, A = batch_global_rigid_transformation(Rs, Js, dd['kintree_table'][0])
+    dense = np.matmul(dd['weights'], A.reshape(len(Rs), 24, 16))
+
+    idx, w = topk_skinning_weights(dd['weights'], k)
+    assert idx.shape == (NUM_VERTS, k)
+    np.testing.assert_allclose(w.sum(axis=1), 1)
+    T = sparse_skinning(A, idx, w)
+    assert T.shape == (len(Rs), NUM_VERTS, 4, 4)
+    if k >= len(VERT_WEIGHTS):
+        # Every non-zero weight is kept, same blend as dense.
+        np.testing.assert_allclose(T.reshape(dense.shape), dense,
+                                   rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('k', sorted(TOLERANCES))
+def test_numpy_smpl_topk(smpl_path, params, k):
+    betas, thetas = params
+    dense = NumpySMPL(smpl_path, dtype=np.float64)
+    sparse = NumpySMPL(smpl_path, dtype=np.float64, skin_topk=k)
+    verts, joints, _ = dense(betas, thetas, get_skin=True)
+    verts_k, joints_k, _ = sparse(betas, thetas, get_skin=True)
+    assert verts_k.shape == verts.shape
+    assert np.max(np.abs(verts_k - verts)) <= TOLERANCES[k]
+    assert np.max(np.abs(joints_k - joints)) <= TOLERANCES[k]
+    # Joints only path skins the regressor's vertices the same way.
+    np.testing.assert_allclose(
+        sparse.get_joints(betas, thetas), joints_k, rtol=0, atol=1e-10)
+
+
+@pytest.mark.parametrize('k', sorted(TOLERANCES))
+def test_tf_smpl_topk(smpl_path, params, k):
+    tf = pytest.importorskip('tensorflow')
+    from src.tf_smpl.batch_smpl import SMPL
+
+    betas, thetas = params
+    dense = NumpySMPL(smpl_path, dtype=np.float64)
+    verts, joints, _ = dense(betas, thetas, get_skin=True)
+    with tf.Graph().as_default():
+        # batch_lbs is float32 only.
+        smpl = SMPL(smpl_path, skin_topk=k)
+        verts_k, joints_k, _ = smpl(
+            tf.constant(betas, tf.float32), tf.constant(thetas, tf.float32),
+            get_skin=True)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            verts_k, joints_k = sess.run([verts_k, joints_k])
+    assert verts_k.shape == verts.shape
+    assert np.max(np.abs(verts_k - verts)) <= TOLERANCES[k] + 1e-4
+    assert np.max(np.abs(joints_k - joints)) <= TOLERANCES[k] + 1e-4
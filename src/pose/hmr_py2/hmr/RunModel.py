@@ -10,8 +10,59 @@ from os.path import exists
 
 from .tf_smpl import projection as proj_util
 from .tf_smpl.batch_smpl import SMPL
+from .tf_smpl.np_smpl import NumpySMPL
 from .models import get_encoder_fn_separate
 
+
+class ThetaSMPL(object):
+    """
+    Turns predicted theta [cam (3), pose (72), shape (10)] into joints or
+    vertices on the CPU, only when they are asked for.
+    The NumPy SMPL is loaded on first use.
+    """
+
+    def __init__(self, smpl_model_path, joint_type, img_size,
+                 shape_cache_size=16):
+        self.smpl_model_path = smpl_model_path
+        self.joint_type = joint_type
+        self.img_size = img_size
+        self.shape_cache_size = shape_cache_size
+        self.smpl = None
+
+    def get_smpl(self):
+        if self.smpl is None:
+            self.smpl = NumpySMPL(
+                self.smpl_model_path,
+                joint_type=self.joint_type,
+                shape_cache_size=self.shape_cache_size)
+        return self.smpl
+
+    def split(self, theta):
+        theta = np.asarray(theta).reshape(-1, 85)
+        return theta[:, :3], theta[:, 3:75], theta[:, 75:]
+
+    def verts(self, theta):
+        """
+        Returns verts (N x 6890 x 3) and joints3d (N x 19 x 3).
+        """
+        _, poses, shapes = self.split(theta)
+        verts, joints3d, _ = self.get_smpl()(shapes, poses, get_skin=True)
+        return verts, joints3d
+
+    def joints(self, theta):
+        """
+        Returns joints (N x 19 x 2) in image space, like RunModel.predict,
+        and joints3d (N x 19 x 3). Doesn't skin the whole mesh.
+        """
+        cams, poses, shapes = self.split(theta)
+        joints3d = self.get_smpl().get_joints(shapes, poses)
+        # Same as proj_util.batch_orth_proj_idrot.
+        cams = cams[:, None, :]
+        joints = cams[:, :, 0:1] * (joints3d[:, :, :2] + cams[:, :, 1:])
+        joints = ((joints + 1) * 0.5) * self.img_size
+        return joints, joints3d
+
+
 class RunModel(object):
     def __init__(self, config, sess=None):
         """
@@ -38,8 +89,11 @@ class RunModel(object):
         self.data_format = config.data_format
         self.smpl_model_path = config.smpl_model_path
         
-        input_size = (self.batch_size, self.img_size, self.img_size, 3)
-        self.images_pl = tf.placeholder(tf.float32, shape=input_size)
+        # Batch dimension is dynamic, so the same graph runs single frames
+        # and large offline batches. batch_size is only a default chunk size.
+        input_size = (None, self.img_size, self.img_size, 3)
+        self.images_pl = tf.placeholder(
+            tf.float32, shape=input_size, name='input_images')
 
         # Model Settings
         self.num_stage = config.num_stage
@@ -53,7 +107,11 @@ class RunModel(object):
         # Theta size: camera (3) + pose (24*3) + shape (10)
         self.total_params = self.num_cam + self.num_theta + 10
 
-        self.smpl = SMPL(self.smpl_model_path, joint_type=self.joint_type)
+        self.smpl = SMPL(self.smpl_model_path, joint_type=self.joint_type,
+                         skin_topk=config.skin_topk)
+        # For predict_theta and verts_from_theta.
+        self.theta_smpl = ThetaSMPL(
+            self.smpl_model_path, self.joint_type, self.img_size)
 
         # self.theta0_pl = tf.placeholder_with_default(
         #     self.load_mean_param(), shape=[self.batch_size, self.total_params], name='theta0')
@@ -87,7 +145,7 @@ class RunModel(object):
         self.all_cams = []
         self.all_Js = []
         self.final_thetas = []
-        theta_prev = tf.tile(self.mean_var, [self.batch_size, 1])
+        theta_prev = tf.tile(self.mean_var, [tf.shape(self.images_pl)[0], 1])
         for i in np.arange(self.num_stage):
             print('Iteration %d' % i)
             # ---- Compute outputs
@@ -126,6 +184,16 @@ class RunModel(object):
             # Finally)update to end iteration.
             theta_prev = theta_here
 
+        # Named outputs of the last stage, these are what gets fetched and
+        # what FrozenModel keeps when freezing the graph.
+        self.final_outputs = {
+            'joints': tf.identity(self.all_kps[-1], name='joints'),
+            'verts': tf.identity(self.all_verts[-1], name='verts'),
+            'cams': tf.identity(self.all_cams[-1], name='cams'),
+            'joints3d': tf.identity(self.all_Js[-1], name='joints3d'),
+            'theta': tf.identity(self.final_thetas[-1], name='theta'),
+        }
+
 
     def prepare(self):
         print('Restoring checkpoint %s..' % self.load_path)
@@ -155,13 +223,7 @@ class RunModel(object):
             self.images_pl: images,
             # self.theta0_pl: self.mean_var,
         }
-        fetch_dict = {
-            'joints': self.all_kps[-1],
-            'verts': self.all_verts[-1],
-            'cams': self.all_cams[-1],
-            'joints3d': self.all_Js[-1],
-            'theta': self.final_thetas[-1],
-        }
+        fetch_dict = self.final_outputs
 
         results = self.sess.run(fetch_dict, feed_dict)
 
@@ -170,3 +232,28 @@ class RunModel(object):
         results['joints'] = ((joints + 1) * 0.5) * self.img_size
 
         return results
+
+    def predict_theta(self, images, get_joints=False):
+        """
+        Fast mode, only fetches theta so no SMPL runs in the graph.
+        images: num_batch, img_size, img_size, 3
+        Preprocessed to range [-1, 1]
+
+        Returns a dict with theta (N x 85) and cams (N x 3). If get_joints,
+        also joints (image space) and joints3d computed from theta on the
+        CPU. Use verts_from_theta to get the mesh later.
+        """
+        theta = self.sess.run(self.final_outputs['theta'],
+                              {self.images_pl: images})
+        results = {'theta': theta, 'cams': theta[:, :self.num_cam]}
+        if get_joints:
+            results['joints'], results['joints3d'] = self.theta_smpl.joints(
+                theta)
+        return results
+
+    def verts_from_theta(self, theta):
+        """
+        theta: N x 85 as returned by predict_theta.
+        Returns verts (N x 6890 x 3) and joints3d.
+        """
+        return self.theta_smpl.verts(theta)
@@ -5,10 +5,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import pickle
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
+from itertools import groupby
 import json
 import os
+import pickle
+from queue import Queue
+import subprocess
+import sys
+import threading
 from time import time
 
 from absl import flags
@@ -33,8 +39,10 @@ from src.evaluation.eval_util import (
     update_dict_entries,
     mean_of_dict_values,
 )
+from src.evaluation.mesh_eval import MeshEvaluator
+from src.evaluation.phi_cache import PhiCache
 from src.evaluation.tester import Tester
-from src.tf_smpl.batch_smpl import SMPL
+from src.evaluation.work_queue import atomic_write, WorkQueue
 
 # Model Parameters.
 flags.DEFINE_string('resnet_path',
@@ -50,44 +58,49 @@ flags.DEFINE_string(
 # Data Parameters
 flags.DEFINE_string('tf_dir', '', 'Parent directory of tfrecords.')
 flags.DEFINE_string('pred_dir', 'predictions_cache', 'Prediction Directory.')
+flags.DEFINE_string('phi_dir', '',
+                    'If set, caches the per-frame image features here.')
 flags.DEFINE_list('test_datasets',
                   ['3dpw', 'nba', 'penn_action'],
                   'Datasets to evaluate.')
 flags.DEFINE_string('split', 'val', 'val or test.')
 flags.DEFINE_integer('min_visible', 6, 'Minimum visible keypoints')
 flags.DEFINE_boolean('reverse', False, 'If True, runs tf records in reverse')
+flags.DEFINE_integer('num_workers', 1,
+                     'Number of worker processes. Tubes are shared through a '
+                     'work queue in the prediction directory, so an '
+                     'interrupted run resumes where it stopped.')
+flags.DEFINE_list('worker_gpus', [],
+                  'If set, worker i only sees GPU worker_gpus[i % len].')
+flags.DEFINE_integer('worker_id', -1,
+                     'Set by main for its worker processes, which run tubes '
+                     'and leave the aggregation to main.')
 
 
 SMPL_MODEL_PATH = ('models/neutral_smpl_with_cocoplustoesankles_reg.pkl')
 DATASETS_3D = ['3dpw', 'h36m']
+CONST_KEYS = ['past', 'past_const', 'present', 'future', 'future_const']
+# Tubes read ahead of the model by the loader thread of each worker.
+PREFETCH = 2
+
+mesh_evaluator = None
 
 # Hide some of the TensorFlow Warnings.
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 
+def get_mesh_evaluator():
+    """
+    SMPL graph and session shared by all sequences, built on first use.
+    """
+    global mesh_evaluator
+    if mesh_evaluator is None:
+        mesh_evaluator = MeshEvaluator(SMPL_MODEL_PATH, joint_type='cocoplus')
+    return mesh_evaluator
+
+
 def compute_gpu_smpl(poses, shapes, get_joints=False):
-    smpl = SMPL(SMPL_MODEL_PATH, joint_type='cocoplus')
-    verts_tensor, Js_tensor, _ = smpl(tf.constant(shapes, dtype=tf.float32),
-                                      tf.constant(poses, dtype=tf.float32),
-                                      get_skin=True)
-    init = tf.group(tf.global_variables_initializer(),
-                    tf.local_variables_initializer())
-
-    # Start running ops on the graph. Allow_soft_placement must be set to
-    # True to build towers on GPU, as some of the ops don't have GPU
-    # implementations.
-    sess_config = tf.ConfigProto(allow_soft_placement=True,
-                                 log_device_placement=False)
-    sess = tf.Session(config=sess_config)
-    sess.run(init)
-    if get_joints:
-        verts, joints = sess.run([verts_tensor, Js_tensor])
-        sess.close()
-        return verts, joints
-    else:
-        verts = sess.run(verts_tensor)
-        sess.close()
-        return verts
+    return get_mesh_evaluator()(poses, shapes, get_joints=get_joints)
 
 
 def restore_config(config):
@@ -152,8 +165,7 @@ def compute_errors_batched(kps_gt,
         if compute_mesh:
             # Only compute mesh error if evaluating on test set.
             shapes_gt = np.tile(shape_gt, (len(poses_gt), 1))  # N x 10
-            poses_pred = np.array([rot_mat_to_axis_angle(pose)
-                                   for pose in poses_pred])
+            poses_pred = rot_mat_to_axis_angle(poses_pred)
             mesh_gt_tpose = compute_gpu_smpl(
                 poses=np.zeros_like(poses_gt),
                 shapes=shapes_gt,
@@ -208,8 +220,6 @@ def test_sequence(data, preds, eval_path, pred_mode='pred', has_3d=False,
         Dictionary of lists. Keys are accel and kp. If 3d, also has pose
         and mesh.
     """
-    images = (np.array(data['images']) / 255) * 2 - 1
-
     if pred_mode == 'hal':
         # The keys have a '_hal' suffix in them.
         preds = {k.replace('_hal', ''): v[:, 1]  # Only want center prediction.
@@ -230,15 +240,14 @@ def test_sequence(data, preds, eval_path, pred_mode='pred', has_3d=False,
         poses_pred=preds['poses'],
         shape_gt=data['shape'],
         shapes_pred=preds['shapes'],
-        img_size=images.shape[1],
+        img_size=np.shape(data['images'])[1],
         has_3d=has_3d,
         min_visible=min_visible,
         compute_mesh=compute_mesh,
     )
 
-    with open(eval_path, 'wb') as f:
-        print('Saving eval to', eval_path)
-        pickle.dump(errors, f)
+    print('Saving eval to', eval_path)
+    atomic_write(eval_path, lambda f: pickle.dump(errors, f))
     print('Eval time:', time() - t0)
     return errors
 
@@ -256,7 +265,7 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         errors_past, errors_past_const, errors_future, errors_future_const
     """
     delta_t = config.delta_t
-    images = (np.array(data['images']) / 255) * 2 - 1
+    img_size = np.shape(data['images'])[1]
 
     kps_pred = preds['kps_hal']
     errors_present = compute_errors_batched(
@@ -266,7 +275,7 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         joints_pred=preds['joints_hal'][:, 0, :14],
         poses_gt=data['poses'],
         poses_pred=preds['poses_hal'][:, 0],
-        img_size=images.shape[1],
+        img_size=img_size,
         has_3d=has_3d,
         min_visible=min_visible,
     )
@@ -277,7 +286,7 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         joints_pred=preds['joints_hal'][delta_t:, 0, :14],
         poses_gt=data['poses'][:-delta_t],
         poses_pred=preds['poses_hal'][delta_t:, 0],
-        img_size=images.shape[1],
+        img_size=img_size,
         has_3d=has_3d,
         min_visible=min_visible,
     )
@@ -288,7 +297,7 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         joints_pred=preds['joints_hal'][delta_t:, 1, :14],
         poses_gt=data['poses'][:-delta_t],
         poses_pred=preds['poses_hal'][delta_t:, 1],
-        img_size=images.shape[1],
+        img_size=img_size,
         has_3d=has_3d,
         min_visible=min_visible,
     )
@@ -299,7 +308,7 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         joints_pred=preds['joints_hal'][:-delta_t, 2, :14],
         poses_gt=data['poses'][delta_t:],
         poses_pred=preds['poses_hal'][:-delta_t, 2],
-        img_size=images.shape[1],
+        img_size=img_size,
         has_3d=has_3d,
         min_visible=min_visible,
     )
@@ -310,7 +319,7 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         joints_pred=preds['joints_hal'][:-delta_t, 1, :14],
         poses_gt=data['poses'][delta_t:],
         poses_pred=preds['poses_hal'][:-delta_t, 1],
-        img_size=images.shape[1],
+        img_size=img_size,
         has_3d=has_3d,
         min_visible=min_visible,
     )
@@ -321,9 +330,8 @@ def test_sequence_const(data, preds, eval_path, has_3d=False, min_visible=6):
         'future': errors_future,
         'future_const': errors_future_const,
     }
-    with open(eval_path, 'wb') as f:
-        print('Saving eval to', eval_path)
-        pickle.dump(errors_dict, f)
+    print('Saving eval to', eval_path)
+    atomic_write(eval_path, lambda f: pickle.dump(errors_dict, f))
     return errors_dict
 
 
@@ -350,131 +358,239 @@ def save_results(config, all_dataset_results, json_path=''):
         print_summary(all_dataset_results)
 
 
-def main(config):
-    t0 = time()
-    config = restore_config(config)
-    print('-' * 20)
-    print('Evaluating {}'.format(config.load_path))
+def get_tf_paths(config, dataset):
+    if dataset == 'h36m':
+        pattern = '*cam03*.tfrecord'
+    else:
+        pattern = '*.tfrecord'
+    return sorted(glob(os.path.join(
+        config.tf_dir,
+        dataset,
+        config.split,
+        pattern,
+    )))
 
-    json_path = get_result_path_name(
-        split=config.split,
+
+def get_units(config):
+    """
+    Lists the tubes to evaluate, in the order results are aggregated.
+
+    Returns:
+        List of (dataset, tf_path, p_id).
+    """
+    units = []
+    for dataset in config.test_datasets:
+        for tf_path in get_tf_paths(config, dataset):
+            num_tubes = sum(1 for _ in tf.python_io.tf_record_iterator(tf_path))
+            units.extend((dataset, tf_path, p_id) for p_id in range(num_tubes))
+    return units
+
+
+def get_eval_path(config, tf_path, p_id):
+    return get_eval_path_name(
         load_path=config.load_path,
         pred_mode=config.pred_mode,
-        datasets=config.test_datasets,
+        tf_path=tf_path,
+        p_id=p_id,
         pred_dir=config.pred_dir,
+        min_visible=config.min_visible,
     )
 
-    if os.path.exists(json_path):
-        print(json_path, 'already exists!')
-        all_dataset_results = json.load(open(json_path, 'r'))
-        save_results(config, all_dataset_results)
-        print('Total time:', time() - t0)
-        print('-' * 20)
-        exit(0)
 
+def get_work_queue(config):
+    return WorkQueue(os.path.join(
+        config.pred_dir,
+        os.path.basename(config.load_path),
+        'queue_{}_{}'.format(config.split, config.pred_mode),
+    ))
+
+
+def get_unit_name(eval_path):
+    return os.path.basename(eval_path).replace('.pkl', '')
+
+
+def load_tubes(config, units, work_queue, tubes):
+    """
+    Reads and parses the tubes this worker claims, ahead of the model.
+    Puts ((dataset, tf_path, p_id), data), then None when done, or the
+    exception if reading failed.
+    """
+    try:
+        for tf_path, path_units in groupby(units, key=lambda unit: unit[1]):
+            todo = {p_id: dataset for dataset, _, p_id in path_units
+                    if not os.path.exists(get_eval_path(config, tf_path, p_id))}
+            if not todo:
+                continue
+            for p_id, s_ex in enumerate(
+                    tf.python_io.tf_record_iterator(tf_path)):
+                eval_path = get_eval_path(config, tf_path, p_id)
+                if p_id not in todo or os.path.exists(eval_path):
+                    continue
+                if not work_queue.claim(get_unit_name(eval_path)):
+                    continue
+                tubes.put(((todo[p_id], tf_path, p_id),
+                           read_from_example(s_ex)))
+        tubes.put(None)
+    except Exception as e:
+        tubes.put(e)
+
+
+def score_tube(config, unit, data, preds, work_queue):
+    dataset, tf_path, p_id = unit
+    eval_path = get_eval_path(config, tf_path, p_id)
+    try:
+        if config.pred_mode == 'const':
+            test_sequence_const(
+                data=data,
+                preds=preds,
+                eval_path=eval_path,
+                has_3d=(dataset in DATASETS_3D),
+                min_visible=config.min_visible,
+            )
+        else:
+            compute_mesh = config.split == 'test' and dataset == '3dpw'
+            test_sequence(
+                data=data,
+                preds=preds,
+                eval_path=eval_path,
+                pred_mode=config.pred_mode,
+                has_3d=(dataset in DATASETS_3D),
+                min_visible=config.min_visible,
+                compute_mesh=compute_mesh,
+            )
+    except Exception:
+        work_queue.release(get_unit_name(eval_path))
+        raise
+
+
+def run_worker(config, units):
+    """
+    Evaluates every tube of units that isn't done or claimed by another
+    worker. Reading the next tube (loader thread), predicting (this thread)
+    and computing the errors of the previous one (scorer thread) overlap.
+    Each finished tube is marked by its eval pickle.
+    """
     resnet_path = config.resnet_path if config.precomputed_phi else ''
     model = Tester(
         config,
         pretrained_resnet_path=resnet_path,
         sequence_length=config.T
     )
+    phi_cache = None
+    if config.phi_dir:
+        # Phis only depend on the image encoder weights.
+        phi_cache = PhiCache(
+            encoder_path=resnet_path or config.load_path,
+            phi_dir=config.phi_dir,
+        )
+    work_queue = get_work_queue(config)
+    if config.reverse:
+        units = units[::-1]
+
+    tubes = Queue(maxsize=PREFETCH)
+    loader = threading.Thread(
+        target=load_tubes,
+        args=(config, units, work_queue, tubes),
+    )
+    loader.daemon = True
+    loader.start()
+    scorer = ThreadPoolExecutor(1)
+    scoring = None
+    num_done = 0
+    while True:
+        item = tubes.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+        unit, data = item
+        dataset, tf_path, p_id = unit
+        print('\n', '*' * 10)
+        print(dataset, 'Running on', os.path.basename(tf_path), 'P', p_id)
+        try:
+            preds = get_predictions(
+                model=model,
+                images=data['images'],
+                load_path=config.load_path,
+                tf_path=tf_path,
+                p_id=p_id,
+                pred_dir=config.pred_dir,
+                phi_cache=phi_cache,
+            )
+        except Exception:
+            work_queue.release(
+                get_unit_name(get_eval_path(config, tf_path, p_id)))
+            raise
+        if scoring is not None:
+            scoring.result()
+        scoring = scorer.submit(score_tube, config, unit, data, preds,
+                                work_queue)
+        num_done += 1
+    if scoring is not None:
+        scoring.result()
+    scorer.shutdown()
+    print('Worker evaluated {} tubes'.format(num_done))
+
+
+def start_workers(config):
+    """
+    Runs num_workers copies of this script with a worker_id and waits.
+
+    Returns:
+        Exit codes.
+    """
+    spec = getattr(sys.modules['__main__'], '__spec__', None)
+    if spec is not None:
+        cmd = [sys.executable, '-m', spec.name]
+    else:
+        cmd = [sys.executable, sys.argv[0]]
+    cmd += sys.argv[1:]
+    workers = []
+    for worker_id in range(config.num_workers):
+        env = dict(os.environ)
+        if config.worker_gpus:
+            env['CUDA_VISIBLE_DEVICES'] = config.worker_gpus[
+                worker_id % len(config.worker_gpus)]
+        workers.append(subprocess.Popen(
+            cmd + ['--worker_id={}'.format(worker_id)],
+            env=env,
+        ))
+    return [worker.wait() for worker in workers]
+
+
+def aggregate_results(config, units):
+    """
+    Collects the eval pickles of all tubes into the per dataset means, same
+    as evaluating the tubes one after the other.
+    """
+    missing = [unit for unit in units
+               if not os.path.exists(get_eval_path(config, *unit[1:]))]
+    if missing:
+        raise Exception(
+            '{}/{} tubes have no results yet (e.g. {} P{}), run again to '
+            'resume.'.format(len(missing), len(units),
+                             os.path.basename(missing[0][1]), missing[0][2]))
 
     all_dataset_results = {}
     if config.pred_mode == 'const':
-        all_dataset_results.update({
-            'past': {},
-            'past_const': {},
-            'present': {},
-            'future': {},
-            'future_const': {},
-        })
+        all_dataset_results.update({k: {} for k in CONST_KEYS})
     for dataset in config.test_datasets:
-        print('Evaluating dataset:', dataset)
         dataset_result = {}
         if config.pred_mode == 'const':
-            dataset_result.update({
-                'past': {},
-                'past_const': {},
-                'present': {},
-                'future': {},
-                'future_const': {},
-            })
-        if dataset == 'h36m':
-            tf_paths = sorted(glob(os.path.join(
-                config.tf_dir,
-                dataset,
-                config.split,
-                '*cam03*.tfrecord',
-                )))
-        else:
-            tf_paths = sorted(glob(os.path.join(
-                config.tf_dir,
-                dataset,
-                config.split,
-                '*.tfrecord',
-            )))
-        if config.reverse:
-            tf_paths = tf_paths[::-1]
-        for i, fname in enumerate(tf_paths):
-            print('\n', '*' * 10)
-            print(dataset, '{}/{}'.format(i, len(tf_paths)))
-            print('Running on', os.path.basename(fname))
+            dataset_result.update({k: {} for k in CONST_KEYS})
+        dataset_units = [unit for unit in units if unit[0] == dataset]
+        for tf_path, path_units in groupby(dataset_units,
+                                           key=lambda unit: unit[1]):
             path_result = {}
             if config.pred_mode == 'const':
-                path_result.update({
-                    'past': {},
-                    'past_const': {},
-                    'present': {},
-                    'future': {},
-                    'future_const': {},
-                })
-            for p_id, s_ex in enumerate(tf.python_io.tf_record_iterator(fname)):
-                data = read_from_example(s_ex)
-                images = data['images']
-                if dataset == 'h36m':
-                    images = images
-                    data['poses'] = data['poses']
-                    data['kps'] = data['kps']
-                    data['gt3ds'] = data['gt3ds']
-
-                preds = get_predictions(
-                    model=model,
-                    images=images,
-                    load_path=config.load_path,
-                    tf_path=fname,
-                    p_id=p_id,
-                    pred_dir=config.pred_dir,
-                )
-                eval_path = get_eval_path_name(
-                    load_path=config.load_path,
-                    pred_mode=config.pred_mode,
-                    tf_path=fname,
-                    p_id=p_id,
-                    pred_dir=config.pred_dir,
-                    min_visible=config.min_visible,
-                )
-
+                path_result.update({k: {} for k in CONST_KEYS})
+            for _, _, p_id in path_units:
+                with open(get_eval_path(config, tf_path, p_id), 'rb') as f:
+                    errors = pickle.load(f)
                 if config.pred_mode == 'const':
-                    errors_dict = test_sequence_const(
-                        data=data,
-                        preds=preds,
-                        eval_path=eval_path,
-                        has_3d=(dataset in DATASETS_3D),
-                        min_visible=config.min_visible,
-                    )
-                    for k in errors_dict.keys():
-                        extend_dict_entries(path_result[k], errors_dict[k])
+                    for k in errors.keys():
+                        extend_dict_entries(path_result[k], errors[k])
                 else:
-                    compute_mesh = config.split == 'test' and dataset == '3dpw'
-                    errors = test_sequence(
-                        data=data,
-                        preds=preds,
-                        eval_path=eval_path,
-                        pred_mode=config.pred_mode,
-                        has_3d=(dataset in DATASETS_3D),
-                        min_visible=config.min_visible,
-                        compute_mesh=compute_mesh,
-                    )
                     extend_dict_entries(path_result, errors)
             if config.pred_mode == 'const':
                 for k in path_result.keys():
@@ -489,7 +605,55 @@ def main(config):
         else:
             mean_of_dict_values(dataset_result)
             all_dataset_results[dataset] = dataset_result
+    return all_dataset_results
+
+
+def main(config):
+    t0 = time()
+    config = restore_config(config)
+
+    if config.worker_id >= 0:
+        with open(os.path.join(get_work_queue(config).queue_dir,
+                               'units.json'), 'r') as f:
+            units = [tuple(unit) for unit in json.load(f)]
+        run_worker(config, units)
+        return
+
+    print('-' * 20)
+    print('Evaluating {}'.format(config.load_path))
+
+    json_path = get_result_path_name(
+        split=config.split,
+        load_path=config.load_path,
+        pred_mode=config.pred_mode,
+        datasets=config.test_datasets,
+        pred_dir=config.pred_dir,
+    )
+
+    if os.path.exists(json_path):
+        print(json_path, 'already exists!')
+        all_dataset_results = json.load(open(json_path, 'r'))
+        save_results(config, all_dataset_results)
+        print('Total time:', time() - t0)
+        print('-' * 20)
+        exit(0)
+
+    units = get_units(config)
+    work_queue = get_work_queue(config)
+    num_cleared = work_queue.clear_stale_claims()
+    if num_cleared:
+        print('Resuming, cleared {} claims of stopped workers'.format(
+            num_cleared))
+    if config.num_workers > 1:
+        atomic_write(os.path.join(work_queue.queue_dir, 'units.json'),
+                     lambda f: json.dump(units, f), mode='w')
+        exit_codes = start_workers(config)
+        if any(exit_codes):
+            print('Workers failed with exit codes', exit_codes)
+    else:
+        run_worker(config, units)
 
+    all_dataset_results = aggregate_results(config, units)
     save_results(config, all_dataset_results, json_path)
 
     print('Total time:', time() - t0)
@@ -5,9 +5,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import cv2
+from human3d_utils.geometry.rotations import (
+    axis_angle_to_matrix,
+    matrix_to_axis_angle,
+)
 import numpy as np
 
+# Frames per batched Procrustes in compute_error_3d.
+CHUNK_SIZE = 10000
 
 # Error metrics
 
@@ -27,7 +32,7 @@ def compute_accel(joints):
     return np.mean(acceleration_normed, axis=1)
 
 
-def compute_error_3d(gt3ds, preds, vis=None):
+def compute_error_3d(gt3ds, preds, vis=None, chunk_size=CHUNK_SIZE):
     """
     Returns MPJPE after pelvis alignment and MPJPE after Procrustes. Should
     evaluate only on the 14 common joints.
@@ -36,28 +41,34 @@ def compute_error_3d(gt3ds, preds, vis=None):
         gt3ds (Nx14x3).
         preds (Nx14x3).
         vis (N).
+        chunk_size (int): Frames aligned at once, bounds the memory used.
 
     Returns:
-        MPJPE, PA-MPJPE
+        MPJPE (M), PA-MPJPE (M), for the M visible frames.
     """
     assert len(gt3ds) == len(preds)
+    preds = np.asarray(preds)
+    gt3ds = np.reshape(gt3ds, preds.shape)
+    if vis is not None:
+        gt3ds = gt3ds[vis]
+        preds = preds[vis]
     errors, errors_pa = [], []
-    for i, (gt3d, pred) in enumerate(zip(gt3ds, preds)):
-        if vis is None or vis[i]:
-            gt3d = gt3d.reshape(-1, 3)
-            # Root align.
-            gt3d = align_by_pelvis(gt3d)
-            pred3d = align_by_pelvis(pred)
+    for i in range(0, len(gt3ds), chunk_size):
+        # Root align.
+        gt3d = batch_align_by_pelvis(gt3ds[i:i + chunk_size])
+        pred3d = batch_align_by_pelvis(preds[i:i + chunk_size])
 
-            joint_error = np.sqrt(np.sum((gt3d - pred3d)**2, axis=1))
-            errors.append(np.mean(joint_error))
+        joint_error = np.sqrt(np.sum((gt3d - pred3d) ** 2, axis=2))
+        errors.append(np.mean(joint_error, axis=1))
 
-            # Get PA error.
-            pred3d_sym = compute_similarity_transform(pred3d, gt3d)
-            pa_error = np.sqrt(np.sum((gt3d - pred3d_sym) ** 2, axis=1))
-            errors_pa.append(np.mean(pa_error))
+        # Get PA error.
+        pred3d_sym = batch_compute_similarity_transform(pred3d, gt3d)
+        pa_error = np.sqrt(np.sum((gt3d - pred3d_sym) ** 2, axis=2))
+        errors_pa.append(np.mean(pa_error, axis=1))
 
-    return errors, errors_pa
+    if not errors:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(errors), np.concatenate(errors_pa)
 
 
 def compute_error_accel(joints_gt, joints_pred, vis=None):
@@ -232,6 +243,69 @@ def compute_similarity_transform(S1, S2):
     return S1_hat
 
 
+def batch_align_by_pelvis(joints):
+    """
+    Batched align_by_pelvis.
+
+    Args:
+        joints (Nx14x3).
+    """
+    left_id = 3
+    right_id = 2
+
+    pelvis = (joints[:, left_id] + joints[:, right_id]) / 2.
+    return joints - np.expand_dims(pelvis, axis=1)
+
+
+def batch_compute_similarity_transform(S1, S2):
+    """
+    Batched compute_similarity_transform, one stacked SVD for all frames.
+
+    Args:
+        S1 (NxJx3): Original 3D points.
+        S2 (NxJx3): Target 3D points.
+
+    Returns:
+        S1_hat (NxJx3): S1 after applying optimal alignment per frame.
+    """
+    assert S1.shape == S2.shape
+
+    # 1. Remove mean.
+    mu1 = S1.mean(axis=1, keepdims=True)
+    mu2 = S2.mean(axis=1, keepdims=True)
+    X1 = S1 - mu1
+    X2 = S2 - mu2
+
+    # 2. Compute variance of X1 used for scale.
+    var1 = np.sum(X1 ** 2, axis=(1, 2))
+
+    # 3. The outer product of X1 and X2, Nx3x3.
+    K = np.matmul(X1.transpose(0, 2, 1), X2)
+
+    # 4. Solution that Maximizes trace(R'K) is R=U*V', where U, V are
+    # singular vectors of K.
+    U, s, Vh = np.linalg.svd(K)
+    V = Vh.transpose(0, 2, 1)
+    Ut = U.transpose(0, 2, 1)
+    # Construct Z that fixes the orientation of R to get det(R)=1.
+    Z = np.tile(np.eye(U.shape[1]), (len(U), 1, 1))
+    Z[:, -1, -1] *= np.sign(np.linalg.det(np.matmul(U, Vh)))
+    # Construct R.
+    R = np.matmul(V, np.matmul(Z, Ut))
+
+    # 5. Recover scale.
+    scale = np.trace(np.matmul(R, K), axis1=1, axis2=2) / var1
+
+    # 6. Recover translation (row vectors, so R acts as R').
+    scale = scale[:, np.newaxis, np.newaxis]
+    t = mu2 - scale * np.matmul(mu1, R.transpose(0, 2, 1))
+
+    # 7. Error:
+    S1_hat = scale * np.matmul(S1, R.transpose(0, 2, 1)) + t
+
+    return S1_hat
+
+
 def compute_opt_cam_with_vis(got, want, vis):
     """
     Computes the optimal camera [scale, tx, ty] to map 2D keypoints got to 2D
@@ -318,27 +392,24 @@ def update_dict_entries(accumulator, appender):
 def axis_angle_to_rot_mat(poses_aa):
     """
     Args:
-        poses_aa (72).
+        poses_aa (...x72).
 
     Returns:
-        rot_matrices (24x3x3).
+        rot_matrices (...x24x3x3).
     """
-    rot_matrices = []
-    for pose in poses_aa.reshape(-1, 3):
-        rot_matrices.append(cv2.Rodrigues(pose)[0])
-    return np.array(rot_matrices)
+    poses_aa = np.asarray(poses_aa)
+    return axis_angle_to_matrix(
+        poses_aa.reshape(poses_aa.shape[:-1] + (-1, 3)))
 
 
 def rot_mat_to_axis_angle(rot_matrices):
     """
     Args:
-        rot_matrices (24x3x3).
+        rot_matrices (...x24x3x3).
 
     Returns:
-        poses_aa (72).
+        poses_aa (...x72).
     """
-    pose = []
-    for rot_mat in rot_matrices:
-        pose.append(cv2.Rodrigues(rot_mat)[0])
-    return np.array(pose).reshape(72)
-
+    rot_matrices = np.asarray(rot_matrices)
+    poses_aa = matrix_to_axis_angle(rot_matrices)
+    return poses_aa.reshape(rot_matrices.shape[:-3] + (-1,))
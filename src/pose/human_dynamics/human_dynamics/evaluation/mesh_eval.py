@@ -0,0 +1,78 @@
+"""
+SMPL meshes for the mesh errors of the evaluation.
+
+The SMPL graph and its session are built once, with placeholders of
+dynamic batch size, and reused for every sequence. Inputs are run in
+chunks so long sequences don't need one huge batch.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from human_dynamics.tf_smpl.batch_smpl import SMPL
+
+
+class MeshEvaluator(object):
+
+    def __init__(self, smpl_model_path, joint_type='cocoplus',
+                 chunk_size=512):
+        """
+        Args:
+            smpl_model_path (str): Path to the SMPL pickle.
+            joint_type (str): Joints returned with get_joints.
+            chunk_size (int): Most frames run at once.
+        """
+        self.chunk_size = chunk_size
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.poses_pl = tf.placeholder(tf.float32, shape=(None, 72))
+            self.shapes_pl = tf.placeholder(tf.float32, shape=(None, 10))
+            smpl = SMPL(smpl_model_path, joint_type=joint_type)
+            self.verts, self.joints, _ = smpl(
+                self.shapes_pl,
+                self.poses_pl,
+                get_skin=True,
+            )
+            init = tf.group(tf.global_variables_initializer(),
+                            tf.local_variables_initializer())
+        self.graph.finalize()
+
+        # Allow_soft_placement must be set to True to build towers on GPU,
+        # as some of the ops don't have GPU implementations. Grows on demand
+        # since the Tester shares the GPU.
+        sess_config = tf.ConfigProto(allow_soft_placement=True,
+                                     log_device_placement=False)
+        sess_config.gpu_options.allow_growth = True
+        self.sess = tf.Session(graph=self.graph, config=sess_config)
+        self.sess.run(init)
+
+    def __call__(self, poses, shapes, get_joints=False):
+        """
+        Args:
+            poses (Nx72): Axis-angle poses.
+            shapes (Nx10).
+            get_joints (bool): If True, also returns the joints.
+
+        Returns:
+            verts (Nx6890x3), and joints (NxJx3) if get_joints.
+        """
+        fetches = [self.verts, self.joints] if get_joints else [self.verts]
+        outputs = [[] for _ in fetches]
+        # At least one run, so no frames gives empty outputs.
+        for i in range(0, max(len(poses), 1), self.chunk_size):
+            results = self.sess.run(fetches, {
+                self.poses_pl: poses[i:i + self.chunk_size],
+                self.shapes_pl: shapes[i:i + self.chunk_size],
+            })
+            for output, result in zip(outputs, results):
+                output.append(result)
+        outputs = [np.concatenate(output, axis=0) for output in outputs]
+        if get_joints:
+            return outputs[0], outputs[1]
+        return outputs[0]
+
+    def close(self):
+        self.sess.close()
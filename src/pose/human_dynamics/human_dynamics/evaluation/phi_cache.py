@@ -0,0 +1,107 @@
+"""
+Disk cache of per-frame image features (phi).
+
+The ResNet features of a frame only depend on the image encoder weights,
+so they are computed once per frame and stored as a memory-mapped
+N x 2048 array per video, next to an N mask of the frames already
+computed. Any temporal checkpoint that shares the encoder can then be
+run on the same footage without touching the images.
+
+File structure:
+    +-- PHI_DIR
+       +-- encoder checkpoint name
+           +-- {video}.npy        N x 2048 float32 phis.
+           \-- {video}-valid.npy  N bool, True once the frame is computed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+
+PHI_DIR = 'phi_cache'
+PHI_DIM = 2048
+
+
+def get_video_key(tf_path, p_id):
+    """
+    Cache key of one tube, same naming as the prediction pickles.
+    """
+    vid_id = os.path.basename(tf_path).replace('.tfrecord', '')
+    # Dataset is 2 parent dirs up.
+    dataset = os.path.basename(os.path.dirname(os.path.dirname(tf_path)))
+    return '{dataset}-{vid}-P{p_id}'.format(
+        dataset=dataset,
+        vid=vid_id,
+        p_id=p_id,
+    )
+
+
+class PhiCache(object):
+
+    def __init__(self, encoder_path, phi_dir=PHI_DIR):
+        """
+        Args:
+            encoder_path (str): Checkpoint the image encoder weights come
+                from (the resnet path if given, else the model load path).
+            phi_dir (str): Directory to store all phis.
+        """
+        self.out_dir = os.path.join(phi_dir, os.path.basename(encoder_path))
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+
+    def get_paths(self, key):
+        phi_path = os.path.join(self.out_dir, key + '.npy')
+        valid_path = os.path.join(self.out_dir, key + '-valid.npy')
+        return phi_path, valid_path
+
+    def get(self, key, images, encode_fn, chunk_size=64):
+        """
+        Returns the phis of all frames, computing the missing ones.
+
+        Args:
+            key (str): Video key, see get_video_key.
+            images (NxHxWx3): Images in [-1, 1], only indexed for the
+                frames not cached yet.
+            encode_fn (function): Images (MxHxWx3) -> phis (Mx2048), e.g.
+                Tester.encode_frames.
+            chunk_size (int): Frames per encode_fn call.
+
+        Returns:
+            Read-only memmap of phis (Nx2048).
+        """
+        num_frames = len(images)
+        phi_path, valid_path = self.get_paths(key)
+        if os.path.exists(valid_path):
+            valid = np.load(valid_path, mmap_mode='r+')
+            if len(valid) != num_frames:
+                print('Phi cache {} has {} frames, expected {}. '
+                      'Recomputing.'.format(key, len(valid), num_frames))
+                del valid
+                os.remove(valid_path)
+        if not os.path.exists(valid_path):
+            np.lib.format.open_memmap(
+                phi_path, mode='w+', dtype=np.float32,
+                shape=(num_frames, PHI_DIM),
+            ).flush()
+            # The mask is written last, it marks the phis file as usable.
+            np.save(valid_path, np.zeros(num_frames, dtype=bool))
+            valid = np.load(valid_path, mmap_mode='r+')
+
+        missing = np.where(~valid)[0]
+        if len(missing):
+            print('Computing {}/{} phis for {}'.format(
+                len(missing), num_frames, key))
+            phis = np.load(phi_path, mmap_mode='r+')
+            for i in range(0, len(missing), chunk_size):
+                inds = missing[i:i + chunk_size]
+                phis[inds] = encode_fn(np.stack([images[j] for j in inds]))
+            phis.flush()
+            del phis
+            valid[missing] = True
+            valid.flush()
+        del valid
+        return np.load(phi_path, mmap_mode='r')
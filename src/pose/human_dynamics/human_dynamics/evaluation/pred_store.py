@@ -0,0 +1,203 @@
+"""
+Columnar store of per-frame predictions.
+
+One store per checkpoint. Each field of each sequence is its own .npy
+file, so a read only touches the fields it asks for and arrays are
+memory-mapped, i.e. slicing a few frames doesn't load the sequence. A
+small json per sequence records its length, fields and extra attributes
+and is written last, so a sequence is either fully there or missing.
+
+File structure:
+    +-- root
+       +-- index
+           \-- {key}.json         length, fields, attrs.
+       +-- {field}
+           \-- {key}.npy          N x ... array.
+
+Sample usage:
+    store = PredictionStore('predictions_cache/model.ckpt-1000')
+    store.save(seq_name, preds)
+    kps = store.load(seq_name, fields=['kps'])['kps']
+    joints = store.load_field('joints')           # All sequences.
+    offsets = store.index(field='joints')         # key -> (start, length).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+import json
+import os
+
+import numpy as np
+
+
+INDEX_DIR = 'index'
+
+
+def _atomic_write(path, write_fn, mode='wb'):
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+    os.rename(tmp_path, path)
+
+
+def _mkdir(path):
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Made by another process in the meantime.
+            if not os.path.isdir(path):
+                raise
+
+
+class PredictionStore(object):
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): Directory of the store, made if missing.
+        """
+        self.root = root
+        _mkdir(os.path.join(root, INDEX_DIR))
+
+    def get_meta_path(self, key):
+        return os.path.join(self.root, INDEX_DIR, key + '.json')
+
+    def get_field_path(self, key, field):
+        return os.path.join(self.root, field, key + '.npy')
+
+    def get_meta(self, key):
+        """
+        Returns:
+            dict with length, fields ({name: [dtype, frame shape]}) and
+            attrs, or None if the sequence isn't stored.
+        """
+        meta_path = self.get_meta_path(key)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def has(self, key, fields=None):
+        """
+        True if the sequence is stored with all the fields (if given).
+        """
+        meta = self.get_meta(key)
+        if meta is None:
+            return False
+        return all(field in meta['fields'] for field in (fields or []))
+
+    def keys(self):
+        index_dir = os.path.join(self.root, INDEX_DIR)
+        return sorted(name[:-len('.json')] for name in os.listdir(index_dir)
+                      if name.endswith('.json'))
+
+    def save(self, key, preds):
+        """
+        Saves the arrays of preds with one entry per frame as fields, the
+        rest (strings, numbers) as attrs. Fields already stored for key and
+        not in preds are kept.
+
+        Args:
+            key (str): Sequence key.
+            preds (dict): Predictions, arrays are N x ...
+        """
+        meta = self.get_meta(key) or {'length': None, 'fields': {},
+                                      'attrs': {}}
+        for name, value in preds.items():
+            if isinstance(value, np.ndarray) and value.ndim > 0:
+                if meta['length'] is None:
+                    meta['length'] = len(value)
+                elif len(value) != meta['length']:
+                    raise Exception(
+                        'Field {} of {} has {} frames, expected {}'.format(
+                            name, key, len(value), meta['length']))
+                _mkdir(os.path.join(self.root, name))
+                _atomic_write(self.get_field_path(key, name),
+                              lambda f: np.save(f, value))
+                meta['fields'][name] = [value.dtype.str,
+                                        list(value.shape[1:])]
+            else:
+                if isinstance(value, np.generic):
+                    value = value.item()
+                meta['attrs'][name] = value
+        # The index entry goes last, it marks the sequence as complete.
+        _atomic_write(self.get_meta_path(key),
+                      lambda f: json.dump(meta, f), mode='w')
+
+    def load(self, key, fields=None, frames=None, mmap=True):
+        """
+        Args:
+            key (str): Sequence key.
+            fields (list): Fields to read, all if None.
+            frames (slice or index array): Frames to read, all if None.
+            mmap (bool): If True, fields are read-only memmaps (unless
+                frames is an index array, which makes a copy).
+
+        Returns:
+            dict of fields and attrs.
+        """
+        meta = self.get_meta(key)
+        if meta is None:
+            raise Exception('{} not in {}'.format(key, self.root))
+        if fields is None:
+            fields = sorted(meta['fields'].keys())
+        missing = [field for field in fields if field not in meta['fields']]
+        if missing:
+            raise Exception('{} not stored for {}'.format(
+                ', '.join(missing), key))
+        results = dict(meta['attrs'])
+        for field in fields:
+            value = np.load(self.get_field_path(key, field),
+                            mmap_mode='r' if mmap else None)
+            if frames is not None:
+                value = value[frames]
+            results[field] = value
+        return results
+
+    def get_keys(self, field=None):
+        """
+        Returns:
+            Sorted keys of the sequences, only those that have field if
+            given.
+        """
+        keys = self.keys()
+        if field is not None:
+            keys = [key for key in keys if self.has(key, [field])]
+        return keys
+
+    def index(self, keys=None, field=None):
+        """
+        Offsets of the sequences when concatenated, so
+        load_field(field, keys) and index(keys, field) line up.
+
+        Args:
+            keys (list): Sequences, get_keys(field) if None.
+            field (str): Only counts the sequences that have it.
+
+        Returns:
+            OrderedDict of key -> (start, length).
+        """
+        if keys is None:
+            keys = self.get_keys(field)
+        offsets = OrderedDict()
+        start = 0
+        for key in keys:
+            length = self.get_meta(key)['length']
+            offsets[key] = (start, length)
+            start += length
+        return offsets
+
+    def load_field(self, field, keys=None):
+        """
+        Concatenates one field over sequences, get_keys(field) if None.
+        index(keys, field) gives the offsets.
+        """
+        if keys is None:
+            keys = self.get_keys(field)
+        return np.concatenate([
+            np.load(self.get_field_path(key, field), mmap_mode='r')
+            for key in keys
+        ], axis=0)
@@ -7,58 +7,37 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import pickle
 import os
-import os.path as osp
 import re
 from time import time
 
 import numpy as np
 
+from human_dynamics.evaluation.phi_cache import get_video_key
+from human_dynamics.evaluation.pred_store import PredictionStore
 
 PRED_DIR = 'predictions_cache'
 
 
-def get_pred_path_name(load_path, tf_path, p_id, pred_dir=PRED_DIR,
-                       incl_verts=False):
+def get_pred_store(load_path, pred_dir=PRED_DIR):
     """
-    Gets path name to store cached predictions. If directory doesn't exist,
-    build it automatically.
+    Gets the prediction store of a checkpoint.
 
     File structure:
         +-- PRED_DIR
            +-- load_dir
-               +-- per dataset per tfrecord preds pickle.
+               +-- PredictionStore: index + one dir per prediction field.
                +-- per dataset per tfrecord eval pickle.
                \-- results.json
     Args:
         load_path (str): Model load path.
-        tf_path (str): Path to tfrecord.
-        p_id (int): Index per person (when there are multiple tubes).
         pred_dir (str): Directory to store all predictions.
-        incl_verts (bool): If True, appends '_verts' suffix.
 
     Returns:
-        Path to prediction pickle.
+        PredictionStore.
     """
-    vid_id = os.path.basename(tf_path).replace('.tfrecord', '')
-    # Dataset is 2 parent dirs up.
-    dataset = os.path.basename(os.path.dirname(os.path.dirname(tf_path)))
     load_dir = os.path.basename(load_path)
-    verts = '-verts' if incl_verts else ''
-    output_name = '{dataset}-{vid}-P{p_id}{verts}.pkl'.format(
-        dataset=dataset,
-        vid=vid_id,
-        p_id=p_id,
-        verts=verts,
-    )
-    if not os.path.exists(pred_dir):
-        os.mkdir(pred_dir)
-    out_dir = os.path.join(pred_dir, load_dir)
-    if not os.path.exists(out_dir):
-        os.mkdir(out_dir)
-    output_path = os.path.join(out_dir, output_name)
-    return output_path, output_name
+    return PredictionStore(os.path.join(pred_dir, load_dir))
 
 
 def get_result_path_name(split, load_path, pred_mode, datasets,
@@ -102,64 +81,48 @@ def get_eval_path_name(load_path, pred_mode, tf_path, p_id, pred_dir=PRED_DIR,
     return output_path + '.pkl'
 
 
-def split_preds(preds):
-    """
-    Remove the verts from the pred dict.
-    """
-    preds_dict = {}
-    verts_dict = {}
-    for k, v in preds.items():
-        if 'vert' in k:
-            verts_dict[k] = v
-        else:
-            preds_dict[k] = v
-    return preds_dict, verts_dict
-
-
 def get_predictions(model, images, load_path, tf_path, p_id, pred_dir=PRED_DIR,
-                    incl_verts=False,):
+                    incl_verts=False, phi_cache=None):
     """
-    If predictions exist, load from pickle. Otherwise, makes the predictions.
+    If predictions exist, loads them (memory-mapped) from the checkpoint's
+    PredictionStore. Otherwise, makes the predictions.
+    With a PhiCache, the image features are read from (or added to) the
+    cache and only the temporal model runs.
     """
     t0 = time()
-    pred_path, output_name = get_pred_path_name(
-        load_path=load_path,
-        tf_path=tf_path,
-        p_id=p_id,
-        pred_dir=pred_dir,
-        incl_verts=False,
-    )
-    vert_path, _ = get_pred_path_name(
-        load_path=load_path,
-        tf_path=tf_path,
-        p_id=p_id,
-        pred_dir=pred_dir,
-        incl_verts=True,
-    )
+    store = get_pred_store(load_path=load_path, pred_dir=pred_dir)
+    key = get_video_key(tf_path, p_id)
+    vert_fields = ['verts', 'verts_delta']
 
-    if osp.exists(pred_path) and (not incl_verts or osp.exists(vert_path)):
+    stored = store.has(key)
+    if store.has(key, fields=['verts'] if incl_verts else None):
         print('Loading existing predictions!')
-        with open(pred_path, 'rb') as f:
-            preds = pickle.load(f)
-        if incl_verts:
-            with open(vert_path, 'rb') as f:
-                preds.update(pickle.load(f))
+        fields = [field for field in store.get_meta(key)['fields']
+                  if incl_verts or field not in vert_fields]
+        preds = store.load(key, fields=fields)
     else:
         print('Time to compute the predictions D:<')
         if np.max(images) > 1.1:
             # Quick sanity check.
             images = (np.array(images) / 255) * 2 - 1
-        preds = model.predict_all_images(images)
+        if phi_cache is None:
+            preds = model.predict_all_images(images, incl_verts=incl_verts)
+        else:
+            phis = phi_cache.get(
+                key=key,
+                images=images,
+                encode_fn=model.encode_frames,
+            )
+            preds = model.predict_all_phis(phis, incl_verts=incl_verts)
         preds.update({
             'tf_path': tf_path,
             'p_id': p_id,
         })
-        preds, verts = split_preds(preds)
-        with open(pred_path, 'wb') as f:
-            pickle.dump(preds, f)
-        if incl_verts:
-            preds.update(verts)
-            with open(vert_path, 'wb') as f:
-                pickle.dump(verts, f)
+        if stored:
+            # Only the verts were missing, the rest is already stored.
+            store.save(key, {field: preds[field] for field in vert_fields
+                             if field in preds})
+        else:
+            store.save(key, preds)
     print('Prediction time:', time() - t0)
     return preds
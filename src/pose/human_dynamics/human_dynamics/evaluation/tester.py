@@ -59,6 +59,8 @@ class Tester(object):
         self.smpl_model_path = config.smpl_model_path
 
         self.encoder_vars = []
+        self.fetch_dict = None
+        self.pad_phi = None
 
         # Prepare model.
         input_size = (self.batch_size, self.sequence_length,
@@ -178,6 +180,19 @@ class Tester(object):
             reuse=False,
         )
         img_feat_full = tf.reshape(img_feat, (B, T, -1))
+        # Fed directly by predict_features to skip the image encoder.
+        self.img_feat_full = img_feat_full
+
+        # Per-frame image encoder for streaming, shares the weights above.
+        self.frames_pl = tf.placeholder(
+            tf.float32,
+            shape=(None, self.img_size, self.img_size, 3)
+        )
+        self.frame_feats, _ = self.f_image_enc(
+            self.frames_pl,
+            is_training=False,
+            reuse=True,
+        )
         omega_mean = tf.tile(self.theta_mean, (self.sequence_length, 1))
 
         if self.pred_mode == 'pred':
@@ -226,6 +241,35 @@ class Tester(object):
             'omegas' + suffix: omegas.get_raw(),
         }
 
+    def get_fetch_dict(self, incl_verts=True):
+        """
+        Builds the fetch dict once, so repeated predict calls don't add ops
+        to the graph.
+
+        Args:
+            incl_verts (bool): If False, skips the verts (6890x3 per frame).
+        """
+        if self.fetch_dict is None:
+            fetch_dict = self.make_fetch_dict(self.omegas_pred[0])
+
+            fetch_dict_deltas = {}
+            for delta_t, omega_delta in sorted(self.omegas_pred.items()):
+                if delta_t == 0:
+                    continue
+                update_dict_entries(
+                    accumulator=fetch_dict_deltas,
+                    appender=self.make_fetch_dict(omega_delta,
+                                                  suffix='_delta')
+                )
+            # DxBxTx... --> BxTxDx...
+            for k in fetch_dict_deltas:
+                fetch_dict_deltas[k] = tf.stack(fetch_dict_deltas[k], axis=2)
+            fetch_dict.update(fetch_dict_deltas)
+            self.fetch_dict = fetch_dict
+        if incl_verts:
+            return self.fetch_dict
+        return {k: v for k, v in self.fetch_dict.items() if 'vert' not in k}
+
     def predict(self, images):
         """
         Runs forward pass of model.
@@ -239,74 +283,289 @@ class Tester(object):
         feed_dict = {
             self.images_pl: images,
         }
-        fetch_dict = self.make_fetch_dict(self.omegas_pred[0])
-
-        fetch_dict_deltas = {}
-        for delta_t, omega_delta in sorted(self.omegas_pred.items()):
-            if delta_t == 0:
-                continue
-            update_dict_entries(
-                accumulator=fetch_dict_deltas,
-                appender=self.make_fetch_dict(omega_delta, suffix='_delta')
-            )
-        # DxBxTx... --> BxTxDx...
-        for k in fetch_dict_deltas:
-            fetch_dict_deltas[k] = tf.stack(fetch_dict_deltas[k], axis=2)
-        fetch_dict.update(fetch_dict_deltas)
+        results = self.sess.run(self.get_fetch_dict(), feed_dict)
+        return results
+
+    def encode_frames(self, images):
+        """
+        Runs the image encoder only.
+
+        Args:
+            images (NxHxWx3): Images in [-1, 1].
+
+        Returns:
+            Nx2048 image features.
+        """
+        return self.sess.run(self.frame_feats, {self.frames_pl: images})
+
+    def predict_features(self, features, incl_verts=True):
+        """
+        Runs the temporal encoder and IEF on precomputed image features.
+
+        Args:
+            features (BxTx2048): Output of encode_frames.
+            incl_verts (bool): If False, doesn't fetch the verts.
 
-        results = self.sess.run(fetch_dict, feed_dict)
+        Returns:
+            dict, same as predict.
+        """
+        feed_dict = {
+            self.img_feat_full: features,
+        }
+        results = self.sess.run(self.get_fetch_dict(incl_verts), feed_dict)
         return results
 
-    def predict_all_images(self, all_images):
+    def get_pad_phi(self):
+        """
+        Features of the black frames used as padding at the sequence edges.
+        """
+        if self.pad_phi is None:
+            pad_image = np.zeros((1, self.img_size, self.img_size, 3))
+            self.pad_phi = self.encode_frames(pad_image)[0]
+        return self.pad_phi
+
+    def compute_phis(self, all_images):
+        """
+        Encoder stage: computes the image features of every frame once.
+
+        Args:
+            all_images (NxHxWx3): Images in sequence.
+
+        Returns:
+            Nx2048 phis.
+        """
+        chunk_size = self.batch_size * self.sequence_length
+        phis = []
+        for i in range(0, len(all_images), chunk_size):
+            phis.append(self.encode_frames(all_images[i:i + chunk_size]))
+        return np.concatenate(phis, axis=0)
+
+    def predict_all_images(self, all_images, incl_verts=True, out_dir=None):
         """
         Wrapper to predict entire sequence.
 
-        Because of edge padding, images at edges will have low quality
-        predictions since they don't have full field-of-view. Thus, we slide
-        a window of size T across the images and only keep the predictions
-        with full fov.
+        Each frame is encoded once (compute_phis), then the temporal model
+        runs on the phis (predict_all_phis).
 
         Args:
             all_images (NxHxWx3): Images in sequence.
+            incl_verts (bool): If False, skips the verts.
+            out_dir (str): If set, outputs are memory-mapped .npy files in
+                this directory.
+
+        Returns:
+            dict
+        """
+        return self.predict_all_phis(
+            self.compute_phis(all_images),
+            incl_verts=incl_verts,
+            out_dir=out_dir,
+        )
+
+    def predict_all_phis(self, all_phis, incl_verts=True, out_dir=None):
+        """
+        Temporal stage of predict_all_images, from precomputed phis (e.g. a
+        PhiCache memmap).
+
+        Each batch is written straight into preallocated Nx... arrays, so
+        peak memory is the outputs plus one batch. For videos whose
+        outputs don't fit in memory, use out_dir or iter_phis.
+
+        Args:
+            all_phis (Nx2048): Phis in sequence.
+            incl_verts (bool): If False, skips the verts.
+            out_dir (str): If set, outputs are memory-mapped .npy files in
+                this directory, named by key.
 
         Returns:
             dict
         """
+        N = len(all_phis)
+        results = {}
+        for start, batch in self.iter_batches(all_phis, incl_verts):
+            if not results:
+                for k, v in batch.items():
+                    shape = (N,) + v.shape[1:]
+                    if out_dir:
+                        results[k] = np.lib.format.open_memmap(
+                            os.path.join(out_dir, k + '.npy'),
+                            mode='w+', dtype=v.dtype, shape=shape,
+                        )
+                    else:
+                        results[k] = np.empty(shape, dtype=v.dtype)
+            for k, v in batch.items():
+                results[k][start:start + len(v)] = v
+        if out_dir:
+            for v in results.values():
+                v.flush()
+        return results
+
+    def iter_phis(self, all_phis, incl_verts=False):
+        """
+        Same as predict_all_phis, but yields (frame index, dict) per frame
+        so nothing is accumulated.
+        """
+        for start, batch in self.iter_batches(all_phis, incl_verts):
+            for i in range(len(batch['cams'])):
+                yield start + i, {k: v[i] for k, v in batch.items()}
+
+    def iter_batches(self, all_phis, incl_verts=True):
+        """
+        Runs the temporal model over the whole sequence.
+
+        Because of edge padding, images at edges will have low quality
+        predictions since they don't have full field-of-view. Thus, we slide
+        a window of size T across the phis and only keep the predictions
+        with full fov.
+
+        Args:
+            all_phis (Nx2048): Phis in sequence.
+            incl_verts (bool): If False, skips the verts.
+
+        Yields:
+            (index of the first frame, dict of (M x ...) predictions for
+            the next M frames).
+        """
         B = self.batch_size
         T = self.sequence_length
-        N = len(all_images)
-        H, W = self.img_size, self.img_size
+        N = len(all_phis)
 
         # Need margin on both sides. Num good frames = T - 2 * margin.
         margin = (self.fov - 1) // 2
         g = self.sequence_length - 2 * margin
         count = np.ceil(N / (g * B)).astype(int)
         num_fill = count * B * g + T - N
-        images_padded = np.concatenate((
-            np.zeros((margin, H, W, 3)),             # Front padding.
-            all_images,
-            np.zeros((num_fill, H, W, 3)),           # Back padding.
+        pad_phi = self.get_pad_phi()
+        phis_padded = np.concatenate((
+            np.tile(pad_phi, (margin, 1)),           # Front padding.
+            all_phis,
+            np.tile(pad_phi, (num_fill, 1)),         # Back padding.
         ), axis=0)
-        images_batched = []
+
         # [ m ][    g    ][ m ]             Slide over by g every time.
         #            [ m ][    g    ][ m ]
-        for i in range(count * B):
-            images_batched.append(images_padded[i * g : i * g + T])
-        images_batched = np.reshape(images_batched, (count, B, T, H, W, 3))
+        for c in tqdm(range(count)):
+            phis = np.stack([phis_padded[i * g : i * g + T]
+                             for i in range(c * B, (c + 1) * B)])
+            pred = self.predict_features(
+                phis,
+                incl_verts=incl_verts,
+            )
+            # BxTx... --> (B*g)x..., dropping the back padding.
+            start = c * B * g
+            num_valid = min(B * g, N - start)
+            batch = {}
+            for k, v in pred.items():
+                v = v[:, margin : -margin]
+                batch[k] = v.reshape((-1,) + v.shape[2:])[:num_valid]
+            yield start, batch
+
+
+class StreamingPredictor(object):
+    """
+    Causal sliding-window inference for live feeds and long videos.
+
+    Frames are pushed one at a time. Each frame goes through the image
+    encoder once and its features are kept in a ring of the last T frames,
+    T being the tester's sequence_length. Frame t is predicted once frame
+    t + margin has arrived, from the window ending at t + margin, so it
+    has its full field of view and the latency is a fixed margin frames.
+    Memory does not depend on the length of the stream.
+
+    Build the tester with sequence_length=fov to run the temporal model on
+    the smallest window. With batch_size B > 1, B windows are predicted
+    together, which adds up to B - 1 frames of latency.
+
+    Sample usage:
+
+        stream = StreamingPredictor(tester)
+        for image in frames:
+            for t, pred in stream.push(image):
+                ...
+        for t, pred in stream.flush():
+            ...
+    """
+
+    def __init__(self, tester):
+        self.tester = tester
+        self.fov = tester.fov
+        self.margin = (tester.fov - 1) // 2
+        self.window = tester.sequence_length
+        self.batch_size = tester.batch_size
+        if self.window < self.fov:
+            raise Exception(
+                'sequence_length {} is smaller than the fov {}'.format(
+                    self.window, self.fov)
+            )
+        # Same front padding as predict_all_images: black frames.
+        self.pad_feat = tester.get_pad_phi()
+        self.reset()
 
-        results = {}
+    def reset(self):
+        """
+        Starts a new sequence.
+        """
+        self.ring = np.tile(self.pad_feat, (self.window, 1))
+        self.head = 0
+        self.num_pushed = 0
+        self.num_emitted = 0
+        self.pending = []
 
-        for images in tqdm(images_batched):
-            pred = self.predict(
-                images,
-            )
-            update_dict_entries(results, pred)
-
-        # Results are now (CxBxTx...). Should be (Nx...).
-        new_results = {}
-        for k, v in results.items():
-            v = np.array(v)[:, :, margin : -margin]
-            old_shape = v.shape[3:]
-            new_v = v.reshape((-1,) + old_shape)[:N]
-            new_results[k] = new_v
-        return new_results
+    def push(self, image):
+        """
+        Adds the next frame.
+
+        Args:
+            image (HxWx3): Preprocessed to [-1, 1].
+
+        Returns:
+            list of (frame index, dict of that frame's predictions), empty
+            until margin frames (and a full batch) have come in.
+        """
+        feat = self.tester.encode_frames(image[np.newaxis])[0]
+        return self._add(feat)
+
+    def flush(self):
+        """
+        Ends the sequence: pads the end with black frames to predict the
+        last margin frames, then resets.
+
+        Returns:
+            list of (frame index, dict).
+        """
+        outputs = []
+        num_frames = self.num_pushed
+        while self.num_emitted + len(self.pending) < num_frames:
+            outputs.extend(self._add(self.pad_feat))
+        if self.pending:
+            outputs.extend(self._run())
+        self.reset()
+        return outputs
+
+    def _add(self, feat):
+        self.ring[self.head] = feat
+        self.head = (self.head + 1) % self.window
+        self.num_pushed += 1
+        if self.num_pushed <= self.margin:
+            return []
+        # Oldest to newest.
+        window = np.roll(self.ring, -self.head, axis=0)
+        self.pending.append(window)
+        if len(self.pending) < self.batch_size:
+            return []
+        return self._run()
+
+    def _run(self):
+        num_windows = len(self.pending)
+        windows = self.pending + \
+            [self.pending[-1]] * (self.batch_size - num_windows)
+        self.pending = []
+        pred = self.tester.predict_features(np.stack(windows))
+        # The newest frame of each window is t + margin.
+        index = self.window - 1 - self.margin
+        outputs = []
+        for b in range(num_windows):
+            frame_pred = {k: v[b, index] for k, v in pred.items()}
+            outputs.append((self.num_emitted, frame_pred))
+            self.num_emitted += 1
+        return outputs
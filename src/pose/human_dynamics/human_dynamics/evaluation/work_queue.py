@@ -0,0 +1,114 @@
+"""
+Work queue shared by evaluation workers through the file system.
+
+Each unit of work (one tube, i.e. a tfrecord and p_id) is claimed by
+creating its claim file with O_EXCL, which only one process can do, so
+any number of workers (on one host, or several sharing the directory)
+can walk the same unit list and each unit is run once. A claim records
+the host and pid of its owner, so claims of workers that died can be
+cleared and the run resumed. Completion is marked by the unit's result
+file, written atomically by the worker; the claim alone never counts as
+done.
+
+File structure:
+    +-- queue_dir
+       \-- {unit}.claim           host:pid of the worker running it.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import errno
+import os
+import socket
+
+
+def atomic_write(path, write_fn, mode='wb'):
+    """
+    Writes to a temporary file next to path and renames it into place, so
+    path either doesn't exist or is complete.
+    """
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+    os.rename(tmp_path, path)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class WorkQueue(object):
+
+    def __init__(self, queue_dir):
+        """
+        Args:
+            queue_dir (str): Directory of the claim files, made if missing.
+        """
+        self.queue_dir = queue_dir
+        self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        if not os.path.exists(queue_dir):
+            try:
+                os.makedirs(queue_dir)
+            except OSError:
+                if not os.path.isdir(queue_dir):
+                    raise
+
+    def get_claim_path(self, unit):
+        return os.path.join(self.queue_dir, unit + '.claim')
+
+    def claim(self, unit):
+        """
+        Returns:
+            True if this process now owns unit, False if another one does.
+        """
+        try:
+            fd = os.open(self.get_claim_path(unit),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        os.write(fd, self.owner.encode('utf-8'))
+        os.close(fd)
+        return True
+
+    def release(self, unit):
+        """
+        Gives up a claim, e.g. after a failure, so another worker can retry.
+        """
+        try:
+            os.remove(self.get_claim_path(unit))
+        except OSError:
+            pass
+
+    def clear_stale_claims(self):
+        """
+        Removes the claims of dead processes on this host, so the units of an
+        interrupted run are picked up again. Claims from other hosts can't
+        be checked and are kept, remove the queue_dir to reset them.
+
+        Returns:
+            Number of claims removed.
+        """
+        host = socket.gethostname()
+        num_cleared = 0
+        for name in os.listdir(self.queue_dir):
+            if not name.endswith('.claim'):
+                continue
+            path = os.path.join(self.queue_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    owner_host, pid = f.read().rsplit(':', 1)
+                pid = int(pid)
+            except (IOError, OSError, ValueError):
+                # Removed meanwhile, or still being written.
+                continue
+            if owner_host == host and not _is_alive(pid):
+                self.release(name[:-len('.claim')])
+                num_cleared += 1
+        return num_cleared
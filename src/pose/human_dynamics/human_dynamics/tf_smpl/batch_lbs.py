@@ -12,15 +12,26 @@ from __future__ import print_function
 import tensorflow as tf
 
 
+def _batch_size(x):
+    """
+    Static batch size of x if it is known, else a scalar tensor, so the
+    functions below also work with a None batch dimension.
+    """
+    batch_size = x.shape[0].value
+    if batch_size is None:
+        batch_size = tf.shape(x)[0]
+    return batch_size
+
+
 def batch_skew(vec, batch_size=None):
     """
-    vec is N x 3, batch_size is int
+    vec is N x 3, batch_size is int or a scalar tensor
 
     returns N x 3 x 3. Skew_sym version of each matrix.
     """
     with tf.name_scope("batch_skew", [vec]):
         if batch_size is None:
-            batch_size = vec.shape.as_list()[0]
+            batch_size = _batch_size(vec)
         col_inds = tf.constant([1, 2, 3, 5, 6, 7])
         indices = tf.reshape(
             tf.reshape(tf.range(0, batch_size) * 9, [-1, 1]) + col_inds,
@@ -44,7 +55,7 @@ def batch_rodrigues(theta, name=None):
     Theta is N x 3
     """
     with tf.name_scope(name, "batch_rodrigues", [theta]):
-        batch_size = theta.shape.as_list()[0]
+        batch_size = _batch_size(theta)
         angle = tf.expand_dims(tf.norm(theta + 1e-8, axis=1), -1)
         r = tf.expand_dims(tf.div(theta, angle), -1)
 
@@ -147,7 +158,7 @@ def batch_global_rigid_transformation(Rs, Js, parent, rotate_base=False):
       A     : `Tensor`: N x 24 4 x 4 relative joint transformations for LBS.
     """
     with tf.name_scope("batch_forward_kinematics", [Rs, Js]):
-        N = Rs.shape[0].value
+        N = _batch_size(Rs)
         if rotate_base:
             print('Flipping the SMPL coordinate frame!!!!')
             rot_x = tf.constant(
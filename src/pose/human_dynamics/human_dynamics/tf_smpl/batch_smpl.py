@@ -4,6 +4,8 @@ Specify joint types:
 'coco': Returns COCO+ 19 joints
 'lsp': Returns H3.6M-LSP 14 joints
 Note: To get original smpl joints, use self.J_transformed
+Set skin_topk (e.g. 4) to skin with the top-k weights of each vertex
+instead of all 24 joints.
 """
 
 from __future__ import absolute_import
@@ -16,6 +18,7 @@ import pickle
 
 import tensorflow as tf
 from .batch_lbs import batch_rodrigues, batch_global_rigid_transformation
+from .np_smpl import topk_skinning_weights
 
 
 # There are chumpy variables so convert them to numpy.
@@ -24,9 +27,12 @@ def undo_chumpy(x):
 
 
 class SMPL(object):
-    def __init__(self, pkl_path, joint_type='cocoplus', dtype=tf.float32):
+    def __init__(self, pkl_path, joint_type='cocoplus', dtype=tf.float32,
+                 skin_topk=0):
         """
         pkl_path is the path to a SMPL model
+        skin_topk: if > 0, number of LBS weights kept per vertex, 0 is
+        dense skinning.
         """
         # -- Load SMPL params --
         with open(pkl_path, 'rb') as f:
@@ -71,6 +77,16 @@ class SMPL(object):
             name='lbs_weights',
             dtype=dtype,
             trainable=False)
+        if skin_topk > 0:
+            # Precomputed once: 6890 x k joint indices and weights.
+            # Constants, so existing checkpoints still restore.
+            skin_idx, skin_w = topk_skinning_weights(
+                undo_chumpy(dd['weights']), skin_topk)
+            self.skin_idx = tf.constant(skin_idx, name='lbs_topk_idx')
+            self.skin_w = tf.constant(
+                skin_w, name='lbs_topk_weights', dtype=dtype)
+        else:
+            self.skin_idx, self.skin_w = None, None
 
         # This returns 19 keypoints: 6890 x 19
         self.joint_regressor = tf.Variable(
@@ -86,6 +102,33 @@ class SMPL(object):
                   'or "lsp"' % joint_type)
             ipdb.set_trace()
 
+    def compute_shape(self, beta, name=None):
+        """
+        Shape dependent part of SMPL.
+        Args:
+          beta: N x 10
+
+        Returns:
+          - v_shaped: N x 6890 x 3 template with shape blend shapes
+          - J: N x 24 x 3 rest joint locations
+        The outputs can be cached (e.g. with np_smpl.ShapeCache) and fed
+        back to pose_only while the betas don't change.
+        """
+        with tf.name_scope(name, 'smpl_shape', [beta]):
+            # 1. Add shape blend shapes
+            # (N x 10) x (10 x 6890*3) = N x 6890 x 3
+            v_shaped = tf.reshape(
+                tf.matmul(beta, self.shapedirs, name='shape_bs'),
+                [-1, self.size[0], self.size[1]]) + self.v_template
+
+            # 2. Infer shape-dependent joint locations.
+            Jx = tf.matmul(v_shaped[:, :, 0], self.J_regressor)
+            Jy = tf.matmul(v_shaped[:, :, 1], self.J_regressor)
+            Jz = tf.matmul(v_shaped[:, :, 2], self.J_regressor)
+            J = tf.stack([Jx, Jy, Jz], axis=2)
+
+            return v_shaped, J
+
     def __call__(self, beta, theta, get_skin=False, name=None):
         """
         Obtain SMPL with shape (beta) & pose (theta) inputs.
@@ -103,19 +146,24 @@ class SMPL(object):
           - Verts: N x 6890 x 3
         """
         with tf.name_scope(name, 'smpl_main', [beta, theta]):
-            num_batch = beta.shape[0].value
+            v_shaped, J = self.compute_shape(beta)
+            return self.pose_only(theta, v_shaped, J, get_skin=get_skin)
 
-            # 1. Add shape blend shapes
-            # (N x 10) x (10 x 6890*3) = N x 6890 x 3
-            v_shaped = tf.reshape(
-                tf.matmul(beta, self.shapedirs, name='shape_bs'),
-                [-1, self.size[0], self.size[1]]) + self.v_template
+    def pose_only(self, theta, v_shaped, J, get_skin=False, name=None):
+        """
+        Pose dependent part of SMPL, reusing the output of compute_shape.
+        Args:
+          theta: N x 72 (with 3-D axis-angle rep)
+          v_shaped: N x 6890 x 3
+          J: N x 24 x 3
 
-            # 2. Infer shape-dependent joint locations.
-            Jx = tf.matmul(v_shaped[:, :, 0], self.J_regressor)
-            Jy = tf.matmul(v_shaped[:, :, 1], self.J_regressor)
-            Jz = tf.matmul(v_shaped[:, :, 2], self.J_regressor)
-            J = tf.stack([Jx, Jy, Jz], axis=2)
+        Returns same as __call__.
+        """
+        with tf.name_scope(name, 'smpl_pose', [theta, v_shaped, J]):
+            num_batch = v_shaped.shape[0].value
+            if num_batch is None:
+                # Dynamic batch size.
+                num_batch = tf.shape(v_shaped)[0]
 
             # 3. Add pose blend shapes
             # N x 24 x 3 x 3
@@ -137,15 +185,27 @@ class SMPL(object):
                 Rs, J, self.parents)
 
             # 5. Do skinning:
-            # W is N x 6890 x 24
-            W = tf.reshape(
-                tf.tile(self.weights, [num_batch, 1]), [num_batch, -1, 24])
-            # (N x 6890 x 24) x (N x 24 x 16)
-            T = tf.reshape(
-                tf.matmul(W, tf.reshape(A, [num_batch, 24, 16])),
-                [num_batch, -1, 4, 4])
+            if self.skin_idx is not None:
+                # Accumulate one weight slot at a time, so the largest
+                # temporary is N x 6890 x 16 as with the dense matmul,
+                # not N x 6890 x k x 16.
+                A_flat = tf.reshape(A, [num_batch, 24, 16])
+                T = None
+                for j in range(self.skin_idx.shape[1].value):
+                    T_j = tf.expand_dims(self.skin_w[:, j], 1) * tf.gather(
+                        A_flat, self.skin_idx[:, j], axis=1)
+                    T = T_j if T is None else T + T_j
+                T = tf.reshape(T, [num_batch, -1, 4, 4])
+            else:
+                # W is N x 6890 x 24
+                W = tf.reshape(
+                    tf.tile(self.weights, [num_batch, 1]), [num_batch, -1, 24])
+                # (N x 6890 x 24) x (N x 24 x 16)
+                T = tf.reshape(
+                    tf.matmul(W, tf.reshape(A, [num_batch, 24, 16])),
+                    [num_batch, -1, 4, 4])
             v_posed_homo = tf.concat(
-                [v_posed, tf.ones([num_batch, v_posed.shape[1], 1])], 2)
+                [v_posed, tf.ones_like(v_posed[:, :, :1])], 2)
             v_homo = tf.matmul(T, tf.expand_dims(v_posed_homo, -1))
 
             verts = v_homo[:, :, :3, 0]
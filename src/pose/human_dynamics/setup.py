@@ -8,6 +8,8 @@ setuptools.setup(
     description="A small example package",
     long_description_content_type="text/markdown",
     packages=setuptools.find_packages(),
+    # human3d_utils, from src/human3d_utils.
+    install_requires=['hyl_utils'],
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -1,10 +1,11 @@
 import sys
-import time
+import threading
 
 import tensorflow as tf
 import numpy as np
 
 from hmr.RunModel import RunModel
+from hmr.util.pipeline import LivePipeline
 from hmr.util import renderer as vis_util
 import hmr.config
 from absl import flags
@@ -66,58 +67,50 @@ def visualize_joints(img, proc_param, joints, verts, cam):
     return rend_img_overlay
 
 
-frame_id = 0
 if __name__ == '__main__':
     client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     renderer = vis_util.SMPLRenderer(face_path=config.smpl_face_path)
 
+    def preprocess_fn(data):
+        input_img, proc_param, img = preprocess_frame(data, None)
+        return input_img, (proc_param, img)
+
+    def predict_fn(input_imgs):
+        # Only theta is sent and the mesh isn't rendered.
+        return model.predict_theta(input_imgs)
+
+    # Capture, preprocess, model and display overlap.
+    pipeline = LivePipeline(preprocess_fn, predict_fn, max_batch_size=4)
+    pipeline.start()
 
     @start_color_client(None, '172.27.15.141', 1024)
     # @start_color_client(None, '172.27.40.106', 1024)
     def process_data(self, data):
-        global frame_id
-        t0 = time.time()
-        input_img, proc_param, img = preprocess_frame(data, None)
-        # Add batch dimension: 1 x D x D x 3
-        input_img = np.expand_dims(input_img, 0)
-        print('input_img is ready. Prepared to be predicted...')
+        # data is the ingest server's copy of the camera's latest frame
+        pipeline.submit(data)
 
-        joints, verts, cams, joints3d, theta = model.predict(input_img, get_theta=True)
+    # The color client loops forever, frames go in from its own thread.
+    receiver = threading.Thread(target=process_data)
+    receiver.daemon = True
+    receiver.start()
+
+    def sink_fn(frame):
+        theta = frame.results['theta'][None]
         client.sendto(str.encode(json.dumps(theta.tolist())), ('172.27.15.141', 8888))
-        t1 = time.time()
+        proc_param, img = frame.info
         if False:
-            skel_img = visualize_joints(img, proc_param, joints[0], verts[0], cams[0])
-            t2 = time.time()
+            verts, _ = model.verts_from_theta(theta)
+            joints, _ = model.theta_smpl.joints(theta)
+            skel_img = visualize_joints(img, proc_param, joints[0], verts[0],
+                                        frame.results['cams'])
             cv2.imshow('render_SMPL', skel_img)
         else:
-            t2 = time.time()
             cv2.imshow('render_SMPL', img)
-        t3 = time.time()
         if (cv2.waitKey(1) & 0xFF) == ord('q'):
             client.sendto(str.encode(json.dumps('#STOP#')), ('172.27.15.141', 8888))
-            exit(0)
-
-        # client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # print(type(proc_param), proc_param)
-        # print(type(joints[0]), joints[0])
-        # print(type(verts[0]), verts[0])
-        # print(type(cams[0]), cams[0])
-        # exit(0)
-        # data = {
-        #     # 'img': img.tolist(),
-        #     'proc_param': proc_param.tolist(),
-        #     # 'joint': joints[0].tolist(),
-        #     # 'vert': verts[0].tolist(),
-        #     # 'cam': cams[0].tolist(),
-        # }
-        # client.sendto(str.encode(json.dumps(data)), ('172.27.15.189', 4399))
-        print('frame_id: ', frame_id)
-        frame_id += 1
-        print('inference: ', t1 - t0)
-        print('rendering: ', t2 - t1)
-        print('imshow: ', t3 - t2)
-
-        print('-' * 20)
-
-
-    process_data()
+            return False
+
+        if pipeline.num_shown % 30 == 0:
+            print('frame_id: ', frame.frame_id, pipeline.stats())
+
+    pipeline.run(sink_fn)
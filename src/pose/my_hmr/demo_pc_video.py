@@ -35,6 +35,7 @@ from hmr.util import image as img_util
 from hmr.util import openpose as op_util
 import hmr.config
 from hmr.RunModel import RunModel
+from hmr.util.pipeline import LivePipeline
 
 flags.DEFINE_string('img_path', 'data/im1963.jpg', 'Image to run')
 flags.DEFINE_string(
@@ -100,51 +101,49 @@ def main(img_path, json_path=None):
     if capture.isOpened() is False:
         print('Error openning the video')
 
-    import time
-
-    while capture.isOpened():
-
-        ret, frame = capture.read()
-        # time.sleep(0.1)
-        if ret:
-            # cv2.imshow('Original frame from the video file', frame)
-            t0 = time.time()
-            input_img, proc_param, img = preprocess_frame(frame, json_path)
-            # Add batch dimension: 1 x D x D x 3
-            input_img = np.expand_dims(input_img, 0)
-
-            t1 = time.time()
-
-            # Theta is the 85D vector holding [camera, pose, shape]
-            # where camera is 3D [s, tx, ty]
-            # pose is 72D vector holding the rotation of 24 joints of SMPL in axis angle format
-            # shape is 10D shape coefficients of SMPL
-            joints, verts, cams, joints3d, theta = model.predict(
-                input_img, get_theta=True)
-            t2 = time.time()
-            client.sendto(str.encode(json.dumps(theta.tolist())), ('127.0.0.1', 8889))
-
-            skel_img = visualize_joints(img, proc_param, joints[0], verts[0], cams[0])
-
-            t3 = time.time()
-            cv2.imshow('render_SMPL', skel_img)
-
-            t4 = time.time()
-
-            # gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # cv2.imshow('Grayscale frame', gray_frame)
-            if (cv2.waitKey(10) & 0xFF) == ord('q'):
-                client.sendto(str.encode(json.dumps('#STOP#')), ('127.0.0.1', 8889))
+    def read_frames():
+        while capture.isOpened():
+            ret, frame = capture.read()
+            if not ret:
                 break
-
-            print(t1 - t0)
-            print(t2 - t1)
-            print(t3 - t2)
-            print(t4 - t3)
-            print('-' * 20)
-        else:
-            client.sendto(str.encode(json.dumps('#STOP#')), ('127.0.0.1', 8889))
-            break
+            yield frame
+
+    def preprocess_fn(frame):
+        input_img, proc_param, img = preprocess_frame(frame, json_path)
+        return input_img, (proc_param, img)
+
+    def predict_fn(input_imgs):
+        # Theta is the 85D vector holding [camera, pose, shape]
+        # where camera is 3D [s, tx, ty]
+        # pose is 72D vector holding the rotation of 24 joints of SMPL in axis angle format
+        # shape is 10D shape coefficients of SMPL
+        # Only theta is fetched, the listener doesn't need the mesh.
+        return model.predict_theta(input_imgs, get_joints=True)
+
+    def sink_fn(frame):
+        results = frame.results
+        proc_param, img = frame.info
+        theta = results['theta'][None]
+        client.sendto(str.encode(json.dumps(theta.tolist())), ('127.0.0.1', 8889))
+
+        # Mesh only for the overlay.
+        verts, _ = model.verts_from_theta(theta)
+        skel_img = visualize_joints(img, proc_param, results['joints'],
+                                    verts[0], results['cams'])
+        cv2.imshow('render_SMPL', skel_img)
+
+        if pipeline.num_shown % 30 == 0:
+            print(pipeline.stats())
+        if (cv2.waitKey(10) & 0xFF) == ord('q'):
+            return False
+
+    # Capture, preprocess, model and rendering overlap. A file is read no
+    # faster than it's processed, so every frame's theta is sent.
+    pipeline = LivePipeline(preprocess_fn, predict_fn, max_batch_size=4,
+                            drop_frames=False)
+    pipeline.start(read_frames())
+    pipeline.run(sink_fn)
+    client.sendto(str.encode(json.dumps('#STOP#')), ('127.0.0.1', 8889))
 
     capture.release()
     cv2.destroyAllWindows()
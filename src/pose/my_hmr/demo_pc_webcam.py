@@ -35,6 +35,7 @@ from hmr.util import image as img_util
 from hmr.util import openpose as op_util
 import hmr.config
 from hmr.RunModel import RunModel
+from hmr.util.pipeline import LivePipeline
 
 flags.DEFINE_string('img_path', 'data/im1963.jpg', 'Image to run')
 flags.DEFINE_string(
@@ -91,56 +92,43 @@ def main(img_path, json_path=None):
     # cap.set(cv2.CAP_PROP_FPS, 2)
     client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    import time
-    frame_id = 0
-    while True:
-        # Capture frame-by-frame
-        # cap.grab()
-        # ret, frame = cap.retrieve(0)
-        ret, frame = cap.read()
+    def read_frames():
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
 
-        t0 = time.time()
+    def preprocess_fn(frame):
         input_img, proc_param, img = preprocess_frame(frame, json_path)
-        # Add batch dimension: 1 x D x D x 3
-        input_img = np.expand_dims(input_img, 0)
-
-        t1 = time.time()
+        return input_img, (proc_param, img)
 
+    def sink_fn(frame):
         # Theta is the 85D vector holding [camera, pose, shape]
         # where camera is 3D [s, tx, ty]
         # pose is 72D vector holding the rotation of 24 joints of SMPL in axis angle format
         # shape is 10D shape coefficients of SMPL
-        joints, verts, cams, joints3d, theta = model.predict(input_img, get_theta=True)
-        t2 = time.time()
-        # print('joints:', joints, joints.shape)
-        # print('joints3d:', joints3d, joints3d.shape)
-        # print('theta:', theta, theta.shape)
-        # print('verts:', verts[0], verts[0].shape)
-        # print('cams:', cams[0], cams[0].shape)
-
-        # cam_for_render, vert_shifted, joints_orig = vis_util.get_original(
-        #     proc_param, verts[0], cams[0], joints[0], img_size=img.shape[:2])
-
+        results = frame.results
+        proc_param, img = frame.info
+        theta = results['theta'][None]
         client.sendto(str.encode(json.dumps(theta.tolist())), ('127.0.0.1', 8888))
 
-        skel_img = visualize_joints(img, proc_param, joints[0], verts[0], cams[0])
-
-        t3 = time.time()
+        skel_img = visualize_joints(img, proc_param, results['joints'],
+                                    results['verts'], results['cams'])
         cv2.imshow('render_SMPL', skel_img)
-        # cv2.imshow('render_SMPL', img)
 
-        t4 = time.time()
+        if pipeline.num_shown % 30 == 0:
+            print('frame_id: ', frame.frame_id, pipeline.stats())
         if (cv2.waitKey(1) & 0xFF) == ord('q'):
-            client.sendto(str.encode(json.dumps('#STOP#')), ('127.0.0.1', 8888))
-            break
-
-        print('frame_id: ', frame_id)
-        frame_id += 1
-        print(t1 - t0)
-        print(t2 - t1)
-        print(t3 - t2)
-        print(t4 - t3)
-        print('-' * 20)
+            return False
+
+    # Capture, preprocess, model and rendering overlap.
+    pipeline = LivePipeline(preprocess_fn, model.predict_dict,
+                            max_batch_size=4)
+    pipeline.start(read_frames())
+    pipeline.run(sink_fn)
+    client.sendto(str.encode(json.dumps('#STOP#')), ('127.0.0.1', 8888))
+    cap.release()
 
 
 if __name__ == '__main__':
@@ -51,6 +51,10 @@ flags.DEFINE_string('model_type', 'resnet_fc3_dropout',
 flags.DEFINE_string(
     'joint_type', 'cocoplus',
     'cocoplus (19 keypoints) or lsp 14 keypoints, returned by SMPL')
+flags.DEFINE_integer(
+    'skin_topk', 0,
+    'if > 0, SMPL skinning at test time only uses the top-k LBS weights '
+    'of each vertex, 0 is dense skinning')
 
 # Training settings:
 # TODO! If you want to train, change this to your 'tf_datasets' or specify it with the flag.
@@ -0,0 +1,528 @@
+"""
+NumPy SMPL implementation as batch.
+
+Same model and outputs as batch_smpl.SMPL, but runs on CPU with plain
+NumPy, so there is no TensorFlow session or chumpy graph to build.
+Specify joint types:
+'cocoplus': Returns COCO+ 19 joints
+'lsp': Returns H3.6M-LSP 14 joints
+'smpl': Returns the 24 SMPL joints (same as self.J_transformed)
+
+In a tracked video the betas barely change, so NumpySMPL can keep a
+ShapeCache of v_shaped and the rest joints and only redo the pose part.
+
+Most SMPL vertices are influenced by at most 4 joints, so skinning can
+use the top-k weights per vertex (skin_topk) instead of all 24.
+
+@@batch_rodrigues
+@@topk_skinning_weights
+@@batch_global_rigid_transformation
+@@ShapeCache
+@@NumpySMPL
+
+NumpySMPL.get_joints skips the vertices the joint regressors don't use,
+for callers that only want joints.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+
+import numpy as np
+import pickle
+
+
+# There are chumpy variables so convert them to numpy.
+def undo_chumpy(x):
+    return x if isinstance(x, np.ndarray) else x.r
+
+
+def load_smpl_dict(pkl_path):
+    """
+    Loads the SMPL pkl both from python 2 and python 3.
+    """
+    with open(pkl_path, 'rb') as f:
+        try:
+            dd = pickle.load(f, encoding='latin1')
+        except TypeError:
+            # python 2 pickle has no encoding argument.
+            dd = pickle.load(f)
+    return dd
+
+
+def batch_rodrigues(theta):
+    """
+    Theta is N x 3 axis-angle.
+
+    returns N x 3 x 3 rotation matrices.
+    """
+    theta = np.asarray(theta).reshape(-1, 3)
+    # Same epsilon as the tf version so both give the same rotations.
+    angle = np.linalg.norm(theta + 1e-8, axis=1)[:, None]
+    r = theta / angle
+
+    cos = np.cos(angle)[:, :, None]
+    sin = np.sin(angle)[:, :, None]
+
+    outer = r[:, :, None] * r[:, None, :]
+
+    skew = np.zeros((theta.shape[0], 3, 3), dtype=theta.dtype)
+    skew[:, 0, 1] = -r[:, 2]
+    skew[:, 0, 2] = r[:, 1]
+    skew[:, 1, 0] = r[:, 2]
+    skew[:, 1, 2] = -r[:, 0]
+    skew[:, 2, 0] = -r[:, 1]
+    skew[:, 2, 1] = r[:, 0]
+
+    eye = np.eye(3, dtype=theta.dtype)
+    return cos * eye + (1 - cos) * outer + sin * skew
+
+
+def batch_global_rigid_transformation(Rs, Js, parent, rotate_base=False):
+    """
+    Computes absolute joint locations given pose.
+
+    rotate_base: if True, rotates the global rotation by 180 deg in x axis.
+    if False, this is the original SMPL coordinate.
+
+    Args:
+      Rs: N x 24 x 3 x 3 rotation vector of K joints
+      Js: N x 24 x 3, joint locations before posing
+      parent: 24 holding the parent id for each index
+
+    Returns
+      new_J : N x 24 x 3 location of absolute joints
+      A     : N x 24 4 x 4 relative joint transformations for LBS.
+    """
+    N, K = Rs.shape[:2]
+    if rotate_base:
+        rot_x = np.array([[1, 0, 0], [0, -1, 0], [0, 0, -1]], dtype=Rs.dtype)
+        root_rotation = np.matmul(Rs[:, 0], rot_x)
+    else:
+        root_rotation = Rs[:, 0]
+
+    # Bone vectors: the root keeps its absolute location.
+    j_here = Js.copy()
+    j_here[:, 1:] -= Js[:, parent[1:]]
+
+    # All local transforms at once: N x 24 x 4 x 4
+    A_local = np.zeros((N, K, 4, 4), dtype=Rs.dtype)
+    A_local[:, :, :3, :3] = Rs
+    A_local[:, 0, :3, :3] = root_rotation
+    A_local[:, :, :3, 3] = j_here
+    A_local[:, :, 3, 3] = 1
+
+    # Walk down the kinematic tree, each step is batched over N.
+    results = np.empty_like(A_local)
+    results[:, 0] = A_local[:, 0]
+    for i in range(1, K):
+        results[:, i] = np.matmul(results[:, parent[i]], A_local[:, i])
+
+    new_J = results[:, :, :3, 3].copy()
+
+    # --- Compute relative A: Skinning is based on
+    # how much the bone moved (not the final location of the bone)
+    # but (final_bone - init_bone)
+    # ---
+    init_bone = np.matmul(results[:, :, :3, :3], Js[:, :, :, None])[..., 0]
+    A = results.copy()
+    A[:, :, :3, 3] -= init_bone
+
+    return new_J, A
+
+
+def topk_skinning_weights(weights, k=4):
+    """
+    Keeps the k largest LBS weights of every vertex.
+
+    Args:
+      weights: 6890 x 24 LBS weights
+      k: number of joints kept per vertex
+
+    Returns
+      idx: 6890 x k joint indices, int32
+      w  : 6890 x k weights, renormalized to sum to 1 per vertex.
+    If no vertex has more than k non-zero weights the result is exact.
+    """
+    weights = np.asarray(weights)
+    k = min(k, weights.shape[1])
+    idx = np.argsort(-weights, axis=1)[:, :k].astype(np.int32)
+    w = np.take_along_axis(weights, idx, axis=1)
+    w = w / np.maximum(np.sum(w, axis=1, keepdims=True), 1e-8)
+    return idx, w.astype(weights.dtype)
+
+
+def sparse_skinning(A, idx, w):
+    """
+    Blends the joint transforms with the top-k weights.
+
+    Args:
+      A  : N x 24 x 4 x 4 relative joint transformations
+      idx: V x k joint indices from topk_skinning_weights
+      w  : V x k weights from topk_skinning_weights
+
+    Returns
+      T: N x V x 4 x 4 per vertex transformations.
+    """
+    A = A.reshape([A.shape[0], -1, 16])
+    T = w[None, :, 0, None] * A[:, idx[:, 0]]
+    for j in range(1, idx.shape[1]):
+        T += w[None, :, j, None] * A[:, idx[:, j]]
+    return T.reshape([A.shape[0], -1, 4, 4])
+
+
+class ShapeCache(object):
+    """
+    LRU cache of shaped template vertices and rest joints keyed by betas.
+
+    Betas whose max absolute difference to a cached entry is <= tol reuse
+    that entry, the least recently used entry is dropped past max_size.
+    """
+
+    def __init__(self, max_size=16, tol=1e-4):
+        self.max_size = max_size
+        self.tol = tol
+        # id -> (beta, v_shaped, J)
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    def match(self, betas):
+        """
+        betas: N x 10
+
+        returns N entry ids, -1 where nothing is within tol.
+        """
+        ids = -np.ones(len(betas), dtype=np.int64)
+        if len(self.entries) == 0:
+            return ids
+        keys = np.array(list(self.entries.keys()))
+        cached = np.stack([entry[0] for entry in self.entries.values()])
+        # N x M max abs difference.
+        dist = np.max(np.abs(betas[:, None, :] - cached[None, :, :]), axis=2)
+        best = np.argmin(dist, axis=1)
+        found = dist[np.arange(len(betas)), best] <= self.tol
+        ids[found] = keys[best[found]]
+        return ids
+
+    def get(self, betas, compute_fn):
+        """
+        Returns v_shaped and J for each row of betas, computing the
+        missing ones in a single call.
+
+        Args:
+          betas: N x 10
+          compute_fn: maps M x 10 betas to (M x 6890 x 3, M x 24 x 3)
+
+        Returns
+          v_shaped: N x 6890 x 3
+          J: N x 24 x 3
+        """
+        ids = self.match(betas)
+        v_shaped = [None] * len(betas)
+        J = [None] * len(betas)
+        for i in np.where(ids >= 0)[0]:
+            # Re-insert to mark it as most recently used.
+            entry = self.entries.pop(ids[i])
+            self.entries[ids[i]] = entry
+            v_shaped[i], J[i] = entry[1], entry[2]
+        self.hits += int(np.sum(ids >= 0))
+
+        miss = np.where(ids < 0)[0]
+        if len(miss) > 0:
+            # Rows of the same call can share a shape too, so only compute
+            # one representative per group of betas within tol.
+            reps, rep_of = [], []
+            for i in miss:
+                if reps:
+                    diff = np.max(np.abs(betas[reps] - betas[i]), axis=1)
+                    closest = int(np.argmin(diff))
+                    if diff[closest] <= self.tol:
+                        rep_of.append(closest)
+                        continue
+                rep_of.append(len(reps))
+                reps.append(i)
+            new_v, new_J = compute_fn(betas[reps])
+            for i, r in zip(miss, rep_of):
+                v_shaped[i], J[i] = new_v[r], new_J[r]
+            for r, i in enumerate(reps):
+                self.insert(betas[i], new_v[r], new_J[r])
+            self.misses += len(reps)
+
+        return np.stack(v_shaped), np.stack(J)
+
+    def insert(self, beta, v_shaped, J):
+        if self.max_size <= 0:
+            return
+        self.entries[self.next_id] = (np.array(beta), v_shaped, J)
+        self.next_id += 1
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class NumpySMPL(object):
+    def __init__(self, pkl_path, joint_type='cocoplus', dtype=np.float32,
+                 shape_cache_size=0, shape_tol=1e-4, skin_topk=0):
+        """
+        pkl_path is the path to a SMPL model
+        If shape_cache_size > 0, v_shaped and the rest joints of the last
+        shape_cache_size distinct betas are kept and reused by __call__.
+        If skin_topk > 0, skinning only uses the skin_topk largest weights
+        of each vertex (see topk_skinning_weights), 0 is dense skinning.
+        """
+        if joint_type not in ['cocoplus', 'lsp', 'smpl']:
+            raise Exception('Unknown joint type: %s, it must be either '
+                            '"cocoplus", "lsp" or "smpl"' % joint_type)
+        self.joint_type = joint_type
+        self.dtype = dtype
+
+        # -- Load SMPL params --
+        dd = load_smpl_dict(pkl_path)
+        # Mean template vertices
+        self.v_template = undo_chumpy(dd['v_template']).astype(dtype)
+        # Size of mesh [Number of vertices, 3]
+        self.size = [self.v_template.shape[0], 3]
+        self.num_betas = dd['shapedirs'].shape[-1]
+        # Shape blend shape basis: 6890 x 3 x 10
+        # reshaped to 6890*3 x 10, transposed to 10 x 6890*3
+        self.shapedirs = np.reshape(
+            undo_chumpy(dd['shapedirs']), [-1, self.num_betas]).T.astype(dtype)
+
+        # Regressor for joint locations given shape, transposed to 24 x 6890
+        self.J_regressor = np.asarray(
+            dd['J_regressor'].todense(), dtype=dtype)
+
+        # Pose blend shape basis: 6890 x 3 x 207, reshaped to 207 x 6890*3
+        num_pose_basis = dd['posedirs'].shape[-1]
+        self.posedirs = np.reshape(
+            undo_chumpy(dd['posedirs']), [-1, num_pose_basis]).T.astype(dtype)
+
+        # indices of parents for each joints
+        self.parents = dd['kintree_table'][0].astype(np.int32)
+
+        # LBS weights: 6890 x 24
+        self.weights = undo_chumpy(dd['weights']).astype(dtype)
+        if skin_topk > 0:
+            self.skin_idx, self.skin_w = topk_skinning_weights(
+                self.weights, skin_topk)
+        else:
+            self.skin_idx, self.skin_w = None, None
+
+        # This returns 19 keypoints, transposed to 19 x 6890
+        self.joint_regressor = np.asarray(
+            dd['cocoplus_regressor'].todense(), dtype=dtype)
+        if joint_type == 'lsp':  # 14 LSP joints!
+            self.joint_regressor = self.joint_regressor[:14]
+
+        self.J_transformed = None
+        # Built on the first get_joints call.
+        self.joint_subset = None
+
+        if shape_cache_size > 0:
+            self.shape_cache = ShapeCache(shape_cache_size, shape_tol)
+        else:
+            self.shape_cache = None
+
+    def compute_shape(self, beta):
+        """
+        Shape dependent part of SMPL, never cached.
+        Args:
+          beta: N x 10
+
+        Returns:
+          - v_shaped: N x 6890 x 3 template with shape blend shapes
+          - J: N x 24 x 3 rest joint locations
+        """
+        beta = np.asarray(beta, dtype=self.dtype).reshape(-1, self.num_betas)
+
+        # 1. Add shape blend shapes
+        # (N x 10) x (10 x 6890*3) = N x 6890 x 3
+        v_shaped = np.matmul(beta, self.shapedirs).reshape(
+            [-1, self.size[0], self.size[1]]) + self.v_template
+
+        # 2. Infer shape-dependent joint locations.
+        # (24 x 6890) x (N x 6890 x 3) = N x 24 x 3
+        J = np.matmul(self.J_regressor, v_shaped)
+
+        return v_shaped, J
+
+    def get_shape(self, beta):
+        """
+        Same as compute_shape but goes through the shape cache if there
+        is one.
+        """
+        if self.shape_cache is None:
+            return self.compute_shape(beta)
+        beta = np.asarray(beta, dtype=self.dtype).reshape(-1, self.num_betas)
+        return self.shape_cache.get(beta, self.compute_shape)
+
+    def __call__(self, beta, theta, get_skin=False):
+        """
+        Obtain SMPL with shape (beta) & pose (theta) inputs.
+        Theta includes the global rotation.
+        Args:
+          beta: N x 10
+          theta: N x 72 (with 3-D axis-angle rep)
+                 or N x 24 x 3 x 3 rotation matrices
+
+        Updates:
+        self.J_transformed: N x 24 x 3 joint location after shaping
+                 & posing with beta and theta
+        Returns:
+          - joints: N x 19, 14 or 24 x 3 joint locations depending on
+                    joint_type
+        If get_skin is True, also returns
+          - Verts: N x 6890 x 3
+          - Rs: N x 24 x 3 x 3
+        """
+        v_shaped, J = self.get_shape(beta)
+        return self.pose_only(theta, v_shaped, J, get_skin=get_skin)
+
+    def pose_only(self, theta, v_shaped, J, get_skin=False):
+        """
+        Pose dependent part of SMPL, reusing v_shaped and J from
+        compute_shape/get_shape.
+        Args:
+          theta: N x 72 (with 3-D axis-angle rep)
+                 or N x 24 x 3 x 3 rotation matrices
+          v_shaped: N (or 1) x 6890 x 3
+          J: N (or 1) x 24 x 3
+
+        Returns same as __call__.
+        """
+        theta = np.asarray(theta, dtype=self.dtype)
+
+        # 3. Add pose blend shapes
+        # N x 24 x 3 x 3
+        if theta.shape[-2:] == (3, 3):
+            Rs = theta.reshape([-1, 24, 3, 3])
+        else:
+            Rs = batch_rodrigues(theta.reshape([-1, 3])).reshape(
+                [-1, 24, 3, 3])
+        # Ignore global rotation.
+        pose_feature = (Rs[:, 1:] - np.eye(3, dtype=self.dtype)).reshape(
+            [-1, 207])
+
+        # (N x 207) x (207 x 20670) -> N x 6890 x 3
+        v_posed = np.matmul(pose_feature, self.posedirs).reshape(
+            [-1, self.size[0], self.size[1]]) + v_shaped
+
+        num_batch = Rs.shape[0]
+        if J.shape[0] != num_batch:
+            # One shape for the whole batch.
+            J = np.broadcast_to(J, (num_batch,) + J.shape[1:])
+
+        # 4. Get the global joint location
+        self.J_transformed, A = batch_global_rigid_transformation(
+            Rs, J, self.parents)
+
+        # 5. Do skinning:
+        if self.skin_idx is not None:
+            # k gathers of N x 6890 x 16 instead of the dense matmul.
+            T = sparse_skinning(A, self.skin_idx, self.skin_w)
+        else:
+            # (6890 x 24) x (N x 24 x 16) -> N x 6890 x 4 x 4
+            T = np.matmul(
+                self.weights, A.reshape([num_batch, 24, 16])).reshape(
+                    [num_batch, -1, 4, 4])
+        verts = np.einsum('nvij,nvj->nvi', T[:, :, :3, :3], v_posed) + \
+            T[:, :, :3, 3]
+
+        # Get cocoplus, lsp or smpl joints:
+        if self.joint_type == 'smpl':
+            joints = self.J_transformed
+        else:
+            joints = np.matmul(self.joint_regressor, verts)
+
+        if get_skin:
+            return verts, joints, Rs
+        else:
+            return joints
+
+    def _joint_subset(self):
+        """
+        The regressors only look at a few hundred vertices, so the joints
+        don't need the whole mesh. Builds the model restricted to them.
+        """
+        if self.joint_subset is None:
+            used = np.any(self.J_regressor != 0, axis=0)
+            if self.joint_type != 'smpl':
+                used |= np.any(self.joint_regressor != 0, axis=0)
+            vids = np.where(used)[0]
+            cols = (vids[:, None] * 3 + np.arange(3)).ravel()
+            self.joint_subset = {
+                'vids': vids,
+                'v_template': self.v_template[vids],
+                'shapedirs': self.shapedirs[:, cols],
+                'posedirs': self.posedirs[:, cols],
+                'weights': self.weights[vids],
+                'J_regressor': self.J_regressor[:, vids],
+                'joint_regressor': self.joint_regressor[:, vids],
+            }
+            if self.skin_idx is not None:
+                self.joint_subset['skin_idx'] = self.skin_idx[vids]
+                self.joint_subset['skin_w'] = self.skin_w[vids]
+        return self.joint_subset
+
+    def get_joints(self, beta, theta):
+        """
+        Same joints as __call__, but only shapes, poses and skins the
+        vertices used by J_regressor and the joint regressor. Bypasses
+        the shape cache.
+        Args:
+          beta: N x 10
+          theta: N x 72 or N x 24 x 3 x 3
+
+        Updates self.J_transformed.
+        Returns:
+          - joints: N x 19, 14 or 24 x 3
+        """
+        sub = self._joint_subset()
+        num_verts = len(sub['vids'])
+        beta = np.asarray(beta, dtype=self.dtype).reshape(-1, self.num_betas)
+        theta = np.asarray(theta, dtype=self.dtype)
+
+        v_shaped = np.matmul(beta, sub['shapedirs']).reshape(
+            [-1, num_verts, 3]) + sub['v_template']
+        J = np.matmul(sub['J_regressor'], v_shaped)
+
+        if theta.shape[-2:] == (3, 3):
+            Rs = theta.reshape([-1, 24, 3, 3])
+        else:
+            Rs = batch_rodrigues(theta.reshape([-1, 3])).reshape(
+                [-1, 24, 3, 3])
+        num_batch = Rs.shape[0]
+        if J.shape[0] != num_batch:
+            v_shaped = np.broadcast_to(
+                v_shaped, (num_batch,) + v_shaped.shape[1:])
+            J = np.broadcast_to(J, (num_batch,) + J.shape[1:])
+
+        self.J_transformed, A = batch_global_rigid_transformation(
+            Rs, J, self.parents)
+        if self.joint_type == 'smpl':
+            return self.J_transformed
+
+        pose_feature = (Rs[:, 1:] - np.eye(3, dtype=self.dtype)).reshape(
+            [-1, 207])
+        v_posed = np.matmul(pose_feature, sub['posedirs']).reshape(
+            [-1, num_verts, 3]) + v_shaped
+
+        if self.skin_idx is not None:
+            T = sparse_skinning(A, sub['skin_idx'], sub['skin_w'])
+        else:
+            T = np.matmul(
+                sub['weights'], A.reshape([num_batch, 24, 16])).reshape(
+                    [num_batch, -1, 4, 4])
+        verts = np.einsum('nvij,nvj->nvi', T[:, :, :3, :3], v_posed) + \
+            T[:, :, :3, 3]
+
+        return np.matmul(sub['joint_regressor'], verts)
@@ -0,0 +1,321 @@
+"""
+Pipelined live inference.
+
+Capture, preprocessing, the model and rendering run as separate stages
+connected by small bounded queues, so throughput is set by the slowest
+stage instead of the sum of all of them:
+
+  capture thread -> preprocess workers -> inference (micro-batched) -> sink
+
+For live cameras every queue drops its oldest item when full, so a slow
+stage skips frames instead of building up latency. For finite sources
+(video files) set drop_frames=False: the queues block instead, so capture
+waits for the slowest stage and every frame reaches the sink, in order.
+The sink runs in the thread that calls run(), since cv2.imshow wants the
+main thread.
+
+Sample usage:
+
+  pipeline = LivePipeline(preprocess_fn, predict_fn, max_batch_size=4)
+  pipeline.start(source=frames)  # or pipeline.submit(frame) per frame
+  pipeline.run(sink_fn)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import deque
+import threading
+import time
+
+import numpy as np
+
+
+class DropOldestQueue(object):
+    """
+    Bounded FIFO, put never blocks: when full the oldest item is dropped.
+    With drop_oldest=False put waits for room instead, so nothing is lost.
+    get returns None once the queue is closed and empty.
+    """
+
+    def __init__(self, maxsize, drop_oldest=True):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.cond = threading.Condition()
+        self.closed = False
+        self.num_dropped = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.cond:
+            if not self.drop_oldest:
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self.cond.wait()
+            if self.closed:
+                return
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.num_dropped += 1
+            self.items.append(item)
+            # Putters and getters share cond, wake them all.
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Returns the next item, None when closed and empty or on timeout.
+        """
+        batch = self.get_batch(1, timeout)
+        return batch[0] if batch else None
+
+    def get_batch(self, max_items, timeout=None):
+        """
+        Waits for at least one item, then also takes whatever else is
+        already queued, up to max_items.
+        Returns [None] when closed and empty, [] on timeout.
+        """
+        with self.cond:
+            if timeout is None:
+                while not self.items and not self.closed:
+                    self.cond.wait()
+            elif not self.items and not self.closed:
+                self.cond.wait(timeout)
+            if not self.items:
+                return [None] if self.closed else []
+            batch = []
+            while self.items and len(batch) < max_items:
+                batch.append(self.items.popleft())
+            # Room for blocked putters.
+            self.cond.notify_all()
+            return batch
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class Frame(object):
+    """
+    One frame going through the pipeline.
+      frame_id: capture order
+      image: the captured frame
+      t_capture: time.time() at capture
+      input_img: img_size x img_size x 3 model input (after preprocess)
+      info: whatever else preprocess_fn returns (e.g. proc_param)
+      results: dict of this frame's model outputs (after inference)
+    """
+    __slots__ = ['frame_id', 'image', 't_capture', 'input_img', 'info',
+                 'results']
+
+    def __init__(self, frame_id, image):
+        self.frame_id = frame_id
+        self.image = image
+        self.t_capture = time.time()
+        self.input_img = None
+        self.info = None
+        self.results = None
+
+
+class LivePipeline(object):
+    def __init__(self,
+                 preprocess_fn,
+                 predict_fn,
+                 num_workers=2,
+                 max_batch_size=4,
+                 queue_size=2,
+                 drop_frames=True):
+        """
+        Args:
+          preprocess_fn: image -> (input_img, info)
+          predict_fn: N x img_size x img_size x 3 -> dict of N x ... arrays,
+                      e.g. model.predict_dict or model.predict_theta
+          num_workers: number of preprocess threads
+          max_batch_size: most frames run through predict_fn at once
+          queue_size: size of each queue between stages
+          drop_frames: True for live cameras, full queues drop their
+                       oldest frame. False for files, full queues block
+                       and run() shows every frame in capture order.
+        """
+        self.preprocess_fn = preprocess_fn
+        self.predict_fn = predict_fn
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.drop_frames = drop_frames
+
+        self.capture_queue = DropOldestQueue(queue_size, drop_frames)
+        self.input_queue = DropOldestQueue(queue_size * max_batch_size,
+                                           drop_frames)
+        self.output_queue = DropOldestQueue(queue_size, drop_frames)
+
+        self.threads = []
+        self.next_id = 0
+        self.workers_left = num_workers
+        self.lock = threading.Lock()
+        self.error = None
+
+        # Stats
+        self.num_captured = 0
+        self.num_shown = 0
+        self.num_stale = 0
+        self.batch_sizes = deque(maxlen=100)
+        self.latencies = deque(maxlen=100)
+        self.shown_times = deque(maxlen=100)
+
+    def start(self, source=None):
+        """
+        Starts the stages. If source is an iterable of images, a capture
+        thread reads it and closes the pipeline when it is exhausted.
+        Else feed frames with submit and call close when done.
+        """
+        if source is not None:
+            self._spawn(self._capture, source)
+        for _ in range(self.num_workers):
+            self._spawn(self._preprocess)
+        self._spawn(self._inference)
+        return self
+
+    def submit(self, image):
+        """
+        Pushes one captured image, can be called from any thread.
+        """
+        with self.lock:
+            frame = Frame(self.next_id, image)
+            self.next_id += 1
+            self.num_captured += 1
+        self.capture_queue.put(frame)
+
+    def close(self):
+        """
+        No more frames, the stages finish what's queued and stop.
+        """
+        self.capture_queue.close()
+
+    def stop(self):
+        """
+        Stops right away, dropping everything queued.
+        """
+        for q in [self.capture_queue, self.input_queue, self.output_queue]:
+            q.close()
+            with q.cond:
+                q.items.clear()
+
+    def run(self, sink_fn):
+        """
+        Calls sink_fn(frame) for each processed frame in capture order
+        until the pipeline is closed or sink_fn returns False. With
+        drop_frames, frames older than the last one shown are skipped,
+        else out of order frames wait for the ones before them.
+        """
+        last_id = -1
+        # frame_id -> frame that arrived ahead of its turn.
+        pending = {}
+        try:
+            while True:
+                frame = self.output_queue.get()
+                if frame is None:
+                    break
+                if self.drop_frames:
+                    if frame.frame_id < last_id:
+                        self.num_stale += 1
+                        continue
+                    last_id = frame.frame_id
+                    ready = [frame]
+                else:
+                    pending[frame.frame_id] = frame
+                    ready = []
+                    while last_id + 1 in pending:
+                        last_id += 1
+                        ready.append(pending.pop(last_id))
+                if not self._show(ready, sink_fn):
+                    break
+        finally:
+            self.stop()
+            for thread in self.threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _show(self, frames, sink_fn):
+        # Returns False if sink_fn asked to stop.
+        for frame in frames:
+            if sink_fn(frame) is False:
+                return False
+            now = time.time()
+            self.num_shown += 1
+            self.latencies.append(now - frame.t_capture)
+            self.shown_times.append(now)
+        return True
+
+    def stats(self):
+        """
+        Returns a dict with fps and mean latency (sec) over the last 100
+        frames shown, mean batch size and frame counts.
+        """
+        if len(self.shown_times) > 1:
+            fps = (len(self.shown_times) - 1) / max(
+                self.shown_times[-1] - self.shown_times[0], 1e-8)
+        else:
+            fps = 0.
+        return {
+            'fps': fps,
+            'latency': np.mean(self.latencies) if self.latencies else 0.,
+            'batch_size': np.mean(self.batch_sizes)
+            if self.batch_sizes else 0.,
+            'captured': self.num_captured,
+            'shown': self.num_shown,
+            'dropped': (self.capture_queue.num_dropped +
+                        self.input_queue.num_dropped +
+                        self.output_queue.num_dropped),
+            'stale': self.num_stale,
+        }
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=self._guard, args=(target, ) + args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _guard(self, target, *args):
+        # Errors in a stage stop the whole pipeline, run() re-raises.
+        try:
+            target(*args)
+        except Exception as e:
+            self.error = e
+            self.stop()
+
+    def _capture(self, source):
+        for image in source:
+            if self.capture_queue.closed:
+                break
+            self.submit(image)
+        self.close()
+
+    def _preprocess(self):
+        while True:
+            frame = self.capture_queue.get()
+            if frame is None:
+                break
+            frame.input_img, frame.info = self.preprocess_fn(frame.image)
+            self.input_queue.put(frame)
+        with self.lock:
+            self.workers_left -= 1
+            if self.workers_left == 0:
+                self.input_queue.close()
+
+    def _inference(self):
+        while True:
+            frames = self.input_queue.get_batch(self.max_batch_size)
+            if frames[0] is None:
+                break
+            frames.sort(key=lambda frame: frame.frame_id)
+            images = np.stack([frame.input_img for frame in frames])
+            results = self.predict_fn(images)
+            self.batch_sizes.append(len(frames))
+            for i, frame in enumerate(frames):
+                frame.results = dict(
+                    (key, value[i]) for key, value in results.items())
+                self.output_queue.put(frame)
+        self.output_queue.close()
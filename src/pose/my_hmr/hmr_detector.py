@@ -59,9 +59,10 @@ def inference(input_img):
     input_img, proc_param, img = preprocess_frame(input_img, None)
     # Add batch dimension: 1 x D x D x 3
     input_img = np.expand_dims(input_img, 0)
-    joints, verts, cams, joints3d, theta = model.predict(input_img, get_theta=True)
+    # Only the joints are used, so skip the mesh.
+    results = model.predict_theta(input_img, get_joints=True)
     t1 = time.time()
-    print(joints)
+    print(results['joints'])
     print(t1 - t0)
     print('-' * 20)
 
@@ -20,6 +20,7 @@ Modules included:
 import chumpy as ch
 import numpy as np
 import cv2
+from human3d_utils.geometry.rotations import axis_angle_to_matrix
 
 
 class Rodrigues(ch.Ch):
@@ -36,7 +37,7 @@ class Rodrigues(ch.Ch):
 def lrotmin(p): 
     if isinstance(p, np.ndarray):
         p = p.ravel()[3:]
-        return np.concatenate([(cv2.Rodrigues(np.array(pp))[0]-np.eye(3)).ravel() for pp in p.reshape((-1,3))]).ravel()        
+        return (axis_angle_to_matrix(p.reshape((-1,3))) - np.eye(3)).ravel()
     if p.ndim != 2 or p.shape[1] != 3:
         p = p.reshape((-1,3))
     p = p[1:]
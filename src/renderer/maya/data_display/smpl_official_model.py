@@ -6,8 +6,14 @@ import sys
 sys.path.append('/Users/mac/.virtualenvs/py2_work/lib/python2.7/site-packages')
 import maya.cmds as cmds
 import numpy as np
-import cv2
-from scipy.spatial.transform import Rotation
+# Needs human3d_utils (src/human3d_utils) installed in the py2 env above,
+# e.g. pip install -e src/human3d_utils. Its geometry module is python 2
+# compatible.
+from human3d_utils.geometry.rotations import (
+    axis_angle_to_matrix,
+    matrix_to_axis_angle,
+    matrix_to_euler,
+)
 
 import socket
 import json
@@ -35,10 +41,10 @@ def rectify_pose(pose):
         Rotated pose.
     """
     pose = pose.copy()
-    R_mod = cv2.Rodrigues(np.array([np.pi, 0, 0]))[0]
-    R_root = cv2.Rodrigues(pose[:3])[0]
+    R_mod = axis_angle_to_matrix(np.array([np.pi, 0, 0]))
+    R_root = axis_angle_to_matrix(pose[:3])
     new_root = R_root.dot(R_mod)
-    pose[:3] = cv2.Rodrigues(new_root)[0].reshape(3)
+    pose[:3] = matrix_to_axis_angle(new_root)
     return pose
 
 
@@ -79,11 +85,12 @@ while True:
     # This is the 1 x 72 pose vector of SMPL, which is the rotation of 24 joints in axis angle format
     pose = theta[:, 3:75]
     pose[0, :] = rectify_pose(pose[0, :])
-    rotations = [cv2.Rodrigues(aa)[0] for aa in pose.reshape(-1, 3)]
+    # All 24 joints at once, 24 x 3 euler angles.
+    rotations = axis_angle_to_matrix(pose.reshape(-1, 3))
+    eulers = matrix_to_euler(rotations, 'xyz', degrees=True)
 
     cmds.currentTime(frame_id)
-    for idx, item in enumerate(rotations):
-        x, y, z = Rotation.from_dcm(item).as_euler('xyz', degrees=True)
+    for idx, (x, y, z) in enumerate(eulers):
         key = 'm_avg_' + j_names[idx]
         cmds.setAttr('{}.rx'.format(key), x)
         cmds.setAttr('{}.ry'.format(key), y)